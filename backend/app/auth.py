@@ -0,0 +1,36 @@
+import os
+
+import jwt
+from fastapi import HTTPException, Request
+
+# Tokens issued by the Flask service (backend_flask/app/utils/jwt.py)
+JWT_SECRET = os.getenv("JWT_SECRET", "change_me_in_env")
+JWT_ALG = "HS256"
+
+
+def _claims(request: Request):
+    header = request.headers.get("authorization", "")
+    if not header.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Authentication required")
+    try:
+        claims = jwt.decode(header[7:].strip(), JWT_SECRET, algorithms=[JWT_ALG])
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=401, detail="invalid token")
+    if claims.get("type") != "access":
+        raise HTTPException(status_code=401, detail="invalid token")
+    return claims
+
+
+def authenticated(request: Request):
+    """Dependency: claims of a valid access token (same policy as security.BLUEPRINT_RULES)"""
+    return _claims(request)
+
+
+def roles(*allowed):
+    """Dependency factory: a valid access token whose role is one of `allowed`"""
+    def dependency(request: Request):
+        claims = _claims(request)
+        if claims.get("role") not in allowed:
+            raise HTTPException(status_code=403, detail="Forbidden")
+        return claims
+    return dependency
@@ -0,0 +1,326 @@
+"""Filters, projections and cursor pagination shared by the read endpoints.
+
+These mirror backend_flask/app (utils/projection.py, utils/pagination.py,
+dates.py and search.py) so both services accept the same query strings and
+their `nextCursor` tokens are interchangeable. Keep them in sync:
+backend_flask/tests/test_read_tier_parity.py compares both for the same
+query strings.
+"""
+import base64
+import os
+import re
+import unicodedata
+from datetime import date, datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+from bson import ObjectId, json_util
+from fastapi import HTTPException, Request
+from pymongo import ASCENDING
+
+CLINIC_TZ = ZoneInfo(os.getenv("CLINIC_TIMEZONE", "America/Lima"))
+
+# Users with a deletion mark are invisible to every read
+NOT_DELETED = {"eliminadoEn": {"$exists": False}}
+
+# Data URLs and large arrays: only returned by single-document GETs or view=full
+HEAVY_FIELDS = {
+    "users": ["foto"],
+    "pets": ["foto"],
+    "appointments": ["comprobantePago", "comprobanteData", "historialData"],
+    "historial_clinico": ["archivosAdjuntos"],
+    "newsletter_emails": ["imagenes", "archivos", "destinatarios", "contenido"],
+}
+
+# Never leave the API
+HIDDEN_FIELDS = {
+    "users": ["password", "loginKeys", "searchTokens"],
+}
+
+# Named views (?view=) used by the frontend tables
+VIEWS = {
+    "users": {
+        "summary": ["nombre", "apellidos", "username", "email", "telefono", "rol", "fechaRegistro",
+                    "fotoMiniaturas.thumb"],
+    },
+    "pets": {
+        "summary": ["nombre", "especie", "raza", "sexo", "fechaNacimiento", "estado", "clienteId",
+                    "fotoMiniaturas.thumb"],
+    },
+    "appointments": {
+        "summary": ["mascota", "mascotaId", "especie", "clienteId", "clienteNombre", "fecha", "estado",
+                    "veterinario", "veterinarioId", "motivo", "tipoConsulta", "precio"],
+    },
+    "historial_clinico": {
+        "summary": ["mascotaId", "mascotaNombre", "fecha", "veterinario", "veterinarioId", "tipoConsulta",
+                    "motivo", "diagnostico", "estado"],
+    },
+    "notificaciones": {
+        "summary": ["usuarioId", "tipo", "titulo", "leida", "fechaCreacion"],
+    },
+    "pre_citas": {
+        "summary": ["nombreCliente", "telefono", "email", "nombreMascota", "tipoMascota", "estado",
+                    "fechaPreferida", "horaPreferida", "fechaCreacion"],
+    },
+    "newsletter_suscriptores": {
+        "summary": ["email", "activo", "fechaSuscripcion"],
+    },
+    "newsletter_emails": {
+        "summary": ["asunto", "estado", "fechaEnvio", "totalEnviados"],
+    },
+}
+
+_FIELD_RE = re.compile(r"^[A-Za-z0-9_]+(\.[A-Za-z0-9_]+)*$")
+
+
+def bad_request(message):
+    return HTTPException(status_code=400, detail=message)
+
+
+def id_filter(id):
+    """Filter by `_id` when it is a valid ObjectId, otherwise by the legacy `id` field"""
+    if ObjectId.is_valid(id):
+        return {"_id": ObjectId(id)}
+    return {"id": id}
+
+
+# Projections
+
+def list_projection(request: Request, collection_name):
+    """Mongo projection for a list from ?fields= / ?view=; heavy fields are
+    excluded unless view=full"""
+    hidden = HIDDEN_FIELDS.get(collection_name, [])
+    fields = request.query_params.get("fields")
+    view = request.query_params.get("view")
+
+    if fields:
+        names = [f.strip() for f in fields.split(",") if f.strip()]
+        for name in names:
+            if not _FIELD_RE.match(name):
+                raise bad_request(f"invalid field: {name}")
+    elif view and view != "full":
+        names = VIEWS.get(collection_name, {}).get(view)
+        if names is None:
+            raise bad_request(f"unknown view: {view}")
+    else:
+        excluded = hidden if view == "full" else hidden + HEAVY_FIELDS.get(collection_name, [])
+        return {f: 0 for f in excluded} or None
+
+    included = [n for n in names if n not in hidden and n not in ("id", "_id")]
+    # A field and one of its sub-paths collide in Mongo (Path collision); once
+    # sorted, every sub-path comes right after its field
+    paths = sorted(set(included))
+    for parent, child in zip(paths, paths[1:]):
+        if child.startswith(parent + "."):
+            raise bad_request(f"overlapping fields: {parent}, {child}")
+    return {f: 1 for f in included} or {"_id": 1}
+
+
+def include_fields(projection, names):
+    """Inclusion projection plus `names`, without collisions: a field already
+    covered is not added, and an added field replaces its sub-paths"""
+    out = dict(projection)
+    for name in names:
+        if any(name == k or name.startswith(k + ".") for k in out):
+            continue
+        out = {k: v for k, v in out.items() if not k.startswith(name + ".")}
+        out[name] = 1
+    return out
+
+
+def doc_projection(request: Request, collection_name):
+    """Like list_projection, but without parameters the whole document is returned"""
+    if request.query_params.get("fields") or request.query_params.get("view"):
+        return list_projection(request, collection_name)
+    return {f: 0 for f in HIDDEN_FIELDS.get(collection_name, [])} or None
+
+
+# Keyset pagination
+
+def encode_cursor(fields, values) -> str:
+    raw = json_util.dumps({"k": fields, "v": values}).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+
+def decode_cursor(token: str, fields):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        payload = json_util.loads(raw)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(payload, dict) or payload.get("k") != fields:
+        raise ValueError("Invalid cursor")
+    values = payload.get("v")
+    if not isinstance(values, list) or len(values) != len(fields):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def _after(field, direction, value):
+    if value is None:
+        # null/missing sorts first
+        return {field: {"$ne": None}} if direction == ASCENDING else None
+    return {field: {"$gt" if direction == ASCENDING else "$lt": value}}
+
+
+def keyset_filter(sort, values):
+    """Filter that resumes a (f1, f2, ..., _id) order right after `values`"""
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        cond = _after(field, direction, values[i])
+        if cond is None:
+            continue
+        prefix = {sort[j][0]: values[j] for j in range(i)}
+        clauses.append({**prefix, **cond})
+    return {"$or": clauses} if clauses else {"_id": {"$exists": False}}
+
+
+def page_limit(request: Request, default: int, maximum: int = 1000) -> int:
+    try:
+        limit = int(request.query_params.get("limit", default))
+    except (TypeError, ValueError):
+        raise bad_request("limit must be an integer")
+    return max(1, min(limit, maximum))
+
+
+def paged_find(collection, request: Request, query, sort=(), limit=None, projection=None):
+    """Motor find() sorted by `sort` + `_id`, resumed from ?cursor=; returns (cursor, sort fields)"""
+    sort = list(sort)
+    sort.append(("_id", sort[-1][1] if sort else ASCENDING))
+    fields = [f for f, _ in sort]
+
+    token = request.query_params.get("cursor")
+    if token:
+        try:
+            values = decode_cursor(token, fields)
+        except ValueError:
+            raise bad_request("invalid cursor")
+        after = keyset_filter(sort, values)
+        query = {"$and": [query, after]} if query else after
+
+    if projection and any(projection.values()):
+        # Inclusion projection: the sort fields are needed for the cursor
+        projection = include_fields(projection, fields)
+    cursor = collection.find(query, projection).sort(sort)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+    return cursor, fields
+
+
+async def paginate(collection, request: Request, query, sort=(), default_limit=100, max_limit=1000,
+                   projection=None):
+    """One page and the `nextCursor` of the next one (None on the last page)"""
+    limit = page_limit(request, default_limit, max_limit)
+    cursor, fields = paged_find(collection, request, query, sort, limit + 1, projection)
+    docs = await cursor.to_list(length=limit + 1)
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(fields, [docs[-1].get(f) for f in fields])
+    return docs, next_cursor
+
+
+def wants_stream(request: Request) -> bool:
+    """NDJSON requested with `Accept: application/x-ndjson` or `?stream=1`"""
+    if request.query_params.get("stream", "").lower() in ("1", "true"):
+        return True
+    accept = request.headers.get("accept", "")
+    return "application/x-ndjson" in accept and "application/json" not in accept
+
+
+# Dates (stored as naive UTC; query strings without an offset are clinic local time)
+
+def _parse(value):
+    if not isinstance(value, str) or not value.strip():
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.strip().replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=CLINIC_TZ)
+
+
+def to_utc(value):
+    parsed = _parse(value)
+    if parsed is None:
+        return None
+    return parsed.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def day_start(day: date):
+    return datetime.combine(day, time.min, tzinfo=CLINIC_TZ).astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def range_filter(desde=None, hasta=None):
+    """Mongo condition for a date range; a bare `hasta` date covers the whole day"""
+    cond = {}
+    if desde:
+        cond["$gte"] = to_utc(desde)
+        if cond["$gte"] is None:
+            raise bad_request("invalid fechaDesde")
+    if hasta:
+        if len(hasta.strip()) == 10:
+            try:
+                cond["$lt"] = day_start(date.fromisoformat(hasta.strip()) + timedelta(days=1))
+            except ValueError:
+                raise bad_request("invalid fechaHasta")
+        else:
+            cond["$lte"] = to_utc(hasta)
+            if cond["$lte"] is None:
+                raise bad_request("invalid fechaHasta")
+    return cond or None
+
+
+# User search over the indexed `searchTokens` prefixes
+
+SEARCH_FIELDS = {"nombre": 3, "apellidos": 3, "email": 1}
+PREFIX_MAX = 15
+SEARCH_CANDIDATES = 500
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def fold(text):
+    if not isinstance(text, str):
+        return ""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def words(text):
+    return _WORD_RE.findall(fold(text))
+
+
+def query_terms(search):
+    return list(dict.fromkeys(w[:PREFIX_MAX] for w in words(search)))
+
+
+def _score(doc, terms):
+    score = 0
+    for field, weight in SEARCH_FIELDS.items():
+        field_words = words(doc.get(field))
+        for term in terms:
+            if term in field_words:
+                score += 2 * weight
+            elif any(w.startswith(term) for w in field_words):
+                score += weight
+    return score
+
+
+async def search_users(db, search, query, projection, limit):
+    """Users with every search term as a word prefix, most relevant first"""
+    terms = query_terms(search)
+    if not terms:
+        return []
+    extra = []
+    if projection and any(projection.values()):
+        extra = [f for f in SEARCH_FIELDS if f not in projection]
+        projection = include_fields(projection, extra)
+    cursor = db.users.find({**query, "searchTokens": {"$all": terms}}, projection).limit(SEARCH_CANDIDATES)
+    candidates = await cursor.to_list(length=SEARCH_CANDIDATES)
+    candidates.sort(key=lambda d: (-_score(d, terms), fold(d.get("nombre")), fold(d.get("apellidos")),
+                                   str(d["_id"])))
+    out = candidates[:limit]
+    for doc in out:
+        for f in extra:
+            doc.pop(f, None)
+    return out
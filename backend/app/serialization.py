@@ -0,0 +1,54 @@
+import base64
+import decimal
+
+import orjson
+from bson import Decimal128, ObjectId
+from fastapi.responses import Response
+
+# Same output as backend_flask/app/utils/json_provider.py: naive datetimes come
+# from Mongo and are UTC, so they are emitted with a "Z"
+OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z
+NDJSON = "application/x-ndjson"
+
+
+def bson_default(value):
+    """BSON types orjson does not know, at any nesting level"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    # Decimals as strings: a float would lose precision (amounts)
+    if isinstance(value, Decimal128):
+        return str(value.to_decimal())
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(bytes(value)).decode("ascii")
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(obj) -> bytes:
+    return orjson.dumps(obj, default=bson_default, option=OPTIONS)
+
+
+def serialize_doc(doc):
+    """Shallow copy with `_id` as `id`; everything else is left to orjson"""
+    if not doc:
+        return None
+    doc = dict(doc)
+    _id = doc.pop("_id", None)
+    if isinstance(_id, ObjectId):
+        doc["id"] = str(_id)
+    elif _id is not None:
+        doc["id"] = _id
+    return doc
+
+
+class JSONResponse(Response):
+    """orjson straight from the Mongo documents: no pydantic model and no
+    jsonable_encoder pass over every document"""
+
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
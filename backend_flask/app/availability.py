@@ -0,0 +1,299 @@
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from itertools import accumulate
+
+from flask import current_app
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+from .dates import day_start, to_local
+
+# Estados de cita que no ocupan hueco en la agenda del veterinario
+FREE_STATES = ('cancelada', 'rechazada', 'expirada')
+
+
+def _minutes(t: datetime) -> int:
+    return t.hour * 60 + t.minute
+
+
+def working_hours():
+    """[(inicio, fin)] en minutos desde medianoche, de AGENDA_HOURS ("08:00-13:00,14:00-18:30")"""
+    out = []
+    for block in current_app.config['AGENDA_HOURS'].split(','):
+        start, end = block.strip().split('-')
+        h1, m1 = start.split(':')
+        h2, m2 = end.split(':')
+        out.append((int(h1) * 60 + int(m1), int(h2) * 60 + int(m2)))
+    return out
+
+
+# Minutos de un día: una cita no puede pasar de la medianoche local (la agenda es por día)
+DAY_MINUTES = 24 * 60
+
+
+def parse_duration(value):
+    """duracionMinutos recibida como entero en [1, AGENDA_MAX_MINUTES], o None si no viene"""
+    if value is None:
+        return None
+    limit = current_app.config['AGENDA_MAX_MINUTES']
+    if isinstance(value, str) and value.strip().isdigit():
+        value = int(value)
+    if isinstance(value, bool) or not isinstance(value, int) or not 1 <= value <= limit:
+        raise ValueError(f"duracionMinutos must be an integer between 1 and {limit}")
+    return value
+
+
+def check_same_day(fecha: datetime, duration):
+    """ValueError si la cita que empieza en `fecha` (hora local) acaba después de medianoche"""
+    if _minutes(fecha) + duration > DAY_MINUTES:
+        raise ValueError("appointment must end by midnight (local time)")
+
+
+def duration_of(doc):
+    """Duración de una cita guardada; la de por defecto si falta o no es válida"""
+    value = doc.get('duracionMinutos')
+    if isinstance(value, int) and not isinstance(value, bool) and value > 0:
+        return value
+    if isinstance(value, str) and value.strip().isdigit() and int(value) > 0:
+        return int(value)
+    return current_app.config['AGENDA_SLOT_MINUTES']
+
+
+class DayAgenda:
+    """Citas de un veterinario en un día como intervalos [inicio, fin) en minutos.
+
+    Los intervalos van ordenados por inicio, con el máximo acumulado de los
+    finales para detectar solapes por bisección también con datos antiguos
+    que ya se solapan entre sí.
+    """
+
+    __slots__ = ('starts', 'ends', 'ids', 'max_ends')
+
+    def __init__(self, intervals=()):
+        intervals = sorted(intervals)
+        self.starts = [i[0] for i in intervals]
+        self.ends = [i[1] for i in intervals]
+        self.ids = [i[2] for i in intervals]
+        self.max_ends = list(accumulate(self.ends, max))
+
+    def conflict(self, start, end, exclude=None):
+        """Id de una cita que se solapa con [start, end), o None. O(log n)"""
+        k = bisect_left(self.starts, end)
+        j = k - 1
+        while j >= 0 and self.max_ends[j] > start:
+            if self.ends[j] > start and self.ids[j] != exclude:
+                return self.ids[j]
+            j -= 1
+        return None
+
+    def free_slots(self, hours, slot, duration):
+        """Inicios (en minutos) de huecos libres de `duration` minutos, alineados a `slot`"""
+        out = []
+        for open_, close in hours:
+            t = open_
+            while t + duration <= close:
+                if self.conflict(t, t + duration) is None:
+                    out.append(t)
+                t += slot
+        return out
+
+
+class AgendaCache:
+    """LRU por proceso de (veterinario, día) -> (versión, DayAgenda)"""
+
+    def __init__(self, maxsize=2048):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, version):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] != version:
+                return None
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def put(self, key, version, agenda):
+        with self._lock:
+            self._data[key] = (version, agenda)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def drop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+
+agenda_cache = AgendaCache()
+
+
+def agenda_key(vet_id, day: date):
+    return f"{vet_id}|{day.isoformat()}"
+
+
+def _doc_key(doc):
+    fecha = to_local(doc.get('fecha'))
+    if not doc.get('veterinarioId') or fecha is None:
+        return None
+    return agenda_key(doc['veterinarioId'], fecha.date())
+
+
+def _load(db, vet_ids, days):
+    """DayAgenda de cada (veterinario, día) pedido, con una sola consulta"""
+    first, last = min(days), max(days)
+    query = {
+        "veterinarioId": {"$in": list(vet_ids)},
+        "fecha": {"$gte": day_start(first), "$lt": day_start(last + timedelta(days=1))},
+        "estado": {"$nin": FREE_STATES},
+    }
+    intervals = {agenda_key(v, d): [] for v in vet_ids for d in days}
+    for doc in db.appointments.find(query, {"veterinarioId": 1, "fecha": 1, "duracionMinutos": 1}):
+        key = _doc_key(doc)
+        if key in intervals:
+            start = _minutes(to_local(doc['fecha']))
+            intervals[key].append((start, start + duration_of(doc), str(doc['_id'])))
+    return {key: DayAgenda(items) for key, items in intervals.items()}
+
+
+def _versions(db, keys):
+    return {d['_id']: d['version'] for d in db.agenda_dias.find({"_id": {"$in": list(keys)}})}
+
+
+def get_agendas(db, vet_ids, days):
+    """{clave: DayAgenda}; sólo se recargan de Mongo los días cuya versión cambió"""
+    keys = {agenda_key(v, d): (v, d) for v in vet_ids for d in days}
+    versions = _versions(db, keys)
+    out, stale = {}, {}
+    for key, (vet, day) in keys.items():
+        agenda = agenda_cache.get(key, versions.get(key, 0))
+        if agenda is None:
+            stale[key] = (vet, day)
+        else:
+            out[key] = agenda
+    if stale:
+        loaded = _load(db, {v for v, _ in stale.values()}, sorted({d for _, d in stale.values()}))
+        for key in stale:
+            agenda_cache.put(key, versions.get(key, 0), loaded[key])
+            out[key] = loaded[key]
+    return out
+
+
+def invalidate(db, docs):
+    """Subir la versión de los días que tocan estas citas (antes y/o después de escribir)"""
+    keys = {k for k in (_doc_key(d) for d in docs if d) if k}
+    if not keys:
+        return
+    for key in keys:
+        agenda_cache.drop(key)
+    db.agenda_dias.bulk_write([UpdateOne({"_id": k}, {"$inc": {"version": 1}}, upsert=True) for k in keys],
+                              ordered=False)
+
+
+def _bump_if(db, key, version):
+    """Subir la versión sólo si nadie la cambió desde `version`"""
+    try:
+        res = db.agenda_dias.update_one({"_id": key, "version": version} if version else
+                                        {"_id": key, "version": {"$in": [0, None]}},
+                                        {"$inc": {"version": 1}}, upsert=True)
+    except DuplicateKeyError:
+        return False
+    return res.matched_count == 1 or res.upserted_id is not None
+
+
+def reserve(db, vet_id, fecha, duration, write, undo, exclude=None):
+    """Escribir una cita en [fecha, fecha+duration) si el hueco está libre.
+
+    `write()` hace la escritura y devuelve el id de la cita; `undo(id)` la
+    deshace. El hueco se comprueba con la agenda en caché (O(log n)) y, si otra
+    escritura en el mismo día se cruza, se vuelve a comprobar con datos frescos.
+    Devuelve (id, None) o (None, id de la cita en conflicto).
+    """
+    start = _minutes(fecha)
+    end = start + duration
+    key = agenda_key(vet_id, fecha.date())
+    version = _versions(db, [key]).get(key, 0)
+    agenda = agenda_cache.get(key, version)
+    if agenda is None:
+        agenda = _load(db, [vet_id], [fecha.date()])[key]
+        agenda_cache.put(key, version, agenda)
+    conflict = agenda.conflict(start, end, exclude)
+    if conflict:
+        return None, conflict
+
+    doc_id = write()
+    agenda_cache.drop(key)
+    if _bump_if(db, key, version):
+        return doc_id, None
+
+    # Otra escritura en el mismo día entre medias: comprobar con datos frescos
+    conflict = _load(db, [vet_id], [fecha.date()])[key].conflict(start, end, doc_id)
+    if conflict:
+        undo(doc_id)
+        invalidate(db, [{"veterinarioId": vet_id, "fecha": fecha}])
+        return None, conflict
+    invalidate(db, [{"veterinarioId": vet_id, "fecha": fecha}])
+    return doc_id, None
+
+
+class BatchReservation:
+    """Huecos de varias citas que se escriben en un solo bulk_write.
+
+    Mismo protocolo que reserve(): `check` compara cada cita con la agenda y
+    con las anteriores del lote antes de escribir; `confirm`, tras escribir,
+    sube la versión de cada día y, si otra escritura se cruzó, vuelve a
+    comprobar con datos frescos y deshace las citas que chocan.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self._versions = {}
+        self._agendas = {}
+        self._pending = {}
+
+    def check(self, vet_id, fecha, duration, doc):
+        """ValueError si el hueco está ocupado; si no, lo aparta para `doc`"""
+        key = agenda_key(vet_id, fecha.date())
+        if key not in self._agendas:
+            version = _versions(self.db, [key]).get(key, 0)
+            agenda = agenda_cache.get(key, version)
+            if agenda is None:
+                agenda = _load(self.db, [vet_id], [fecha.date()])[key]
+                agenda_cache.put(key, version, agenda)
+            self._versions[key] = version
+            self._agendas[key] = agenda
+        start = _minutes(fecha)
+        end = start + duration
+        taken = self._pending.setdefault(key, (vet_id, fecha, []))[2]
+        if self._agendas[key].conflict(start, end) or any(s < end and start < e for s, e, _ in taken):
+            raise ValueError("slot not available")
+        taken.append((start, end, doc))
+
+    def confirm(self, written, undo):
+        """Ids de las citas escritas (`written`) que pierden su hueco; `undo(ids)` las borra"""
+        lost = []
+        for key, (vet_id, fecha, taken) in self._pending.items():
+            docs = [(s, e, str(d['_id'])) for s, e, d in taken if str(d.get('_id')) in written]
+            if not docs:
+                continue
+            agenda_cache.drop(key)
+            if _bump_if(self.db, key, self._versions[key]):
+                continue
+            # Otra escritura en el mismo día entre medias: comprobar con datos frescos
+            fresh = _load(self.db, [vet_id], [fecha.date()])[key]
+            lost += [doc_id for s, e, doc_id in docs if fresh.conflict(s, e, doc_id)]
+            invalidate(self.db, [{"veterinarioId": vet_id, "fecha": fecha}])
+        if lost:
+            undo(lost)
+        return lost
+
+
+def slot_label(minutes):
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def init_agenda(app):
+    agenda_cache.maxsize = app.config['AGENDA_CACHE_SIZE']
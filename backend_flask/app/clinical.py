@@ -0,0 +1,223 @@
+import re
+from datetime import datetime, timedelta
+
+import click
+from flask.cli import AppGroup, with_appcontext
+from pymongo.errors import DuplicateKeyError
+
+from .dates import to_utc
+from .db import get_db
+
+# Resumen clínico por mascota en `historial_resumen` (_id = mascotaId): se
+# actualiza al escribir cada consulta o atender una cita, comparando fechas,
+# así que el orden en que lleguen las escrituras no importa.
+SIGNS = ('peso', 'temperatura')
+# Campos de una consulta que entran en el resumen
+ENTRY_FIELDS = ('mascotaId', 'fecha', 'tipoConsulta', 'motivo', 'diagnostico', 'veterinario', 'veterinarioId',
+                'estado', 'proximaVisita', 'medicamentos', 'vacunas', *SIGNS)
+# Reintentos si otra escritura cambia el mismo resumen entre la lectura y el reemplazo
+SAVE_ATTEMPTS = 5
+
+_DURATION_RE = re.compile(r'(\d+)\s*(d[ií]a|semana|mes)', re.IGNORECASE)
+_DURATION_DAYS = {'d': 1, 's': 7, 'm': 30}
+
+
+def _until(fecha, duracion):
+    """Fin de un tratamiento con duración "7 días", "2 semanas"...; None si no se entiende"""
+    match = _DURATION_RE.search(duracion) if isinstance(duracion, str) else None
+    if not match or fecha is None:
+        return None
+    unit = match.group(2)[0].lower()
+    return fecha + timedelta(days=int(match.group(1)) * _DURATION_DAYS[unit])
+
+
+def empty_summary(mascota_id):
+    return {"_id": mascota_id, "mascotaId": mascota_id, "totalConsultas": 0, "version": 0}
+
+
+def _newer(current, fecha, key='fecha'):
+    """¿Un dato de una consulta del `fecha` sustituye a `current`?"""
+    if current is None or current.get(key) is None:
+        return True
+    return fecha is not None and fecha >= current[key]
+
+
+def fold(summary, entry, source, count=True):
+    """Incorporar una consulta (o el historialData de una cita atendida) al resumen.
+
+    `source` identifica el origen ("historial:<id>" o "cita:<id>") para poder
+    saber después si una edición afecta al resumen.
+    """
+    fecha = to_utc(entry.get('fecha'))
+    if count:
+        summary['totalConsultas'] = summary.get('totalConsultas', 0) + 1
+
+    if _newer(summary.get('ultimaConsulta'), fecha):
+        summary['ultimaConsulta'] = {
+            "fuente": source,
+            "fecha": fecha,
+            **{f: entry.get(f) for f in ('tipoConsulta', 'motivo', 'diagnostico', 'veterinario',
+                                         'veterinarioId', 'estado')},
+        }
+    for sign in SIGNS:
+        if entry.get(sign) not in (None, '') and _newer(summary.get(sign), fecha):
+            summary[sign] = {"valor": entry[sign], "fecha": fecha, "fuente": source}
+    if entry.get('proximaVisita') and _newer(summary.get('proximaVisita'), fecha, key='desde'):
+        summary['proximaVisita'] = {"fecha": to_utc(entry['proximaVisita']), "desde": fecha, "fuente": source}
+
+    medicamentos = [m for m in entry.get('medicamentos') or [] if isinstance(m, dict) and m.get('nombre')]
+    if medicamentos and _newer(summary.get('medicamentos'), fecha):
+        summary['medicamentos'] = {"fecha": fecha, "fuente": source, "items": [
+            {**m, "hasta": _until(fecha, m.get('duracion'))} for m in medicamentos
+        ]}
+
+    # Última aplicación de cada vacuna, por nombre
+    vacunas = {v['nombre'].strip().lower(): v for v in summary.get('vacunas', [])}
+    for vacuna in entry.get('vacunas') or []:
+        if not isinstance(vacuna, dict) or not vacuna.get('nombre'):
+            continue
+        key = vacuna['nombre'].strip().lower()
+        if _newer(vacunas.get(key), fecha):
+            vacunas[key] = {"nombre": vacuna['nombre'], "lote": vacuna.get('lote'), "fecha": fecha,
+                            "proximaFecha": to_utc(vacuna.get('proximaFecha')), "fuente": source}
+    if vacunas:
+        summary['vacunas'] = sorted(vacunas.values(), key=lambda v: v['nombre'].lower())
+    return summary
+
+
+def _sources(summary):
+    """Orígenes que aparecen en algún campo del resumen"""
+    out = {summary.get(f, {}).get('fuente') for f in ('ultimaConsulta', 'proximaVisita', 'medicamentos', *SIGNS)}
+    out.update(v.get('fuente') for v in summary.get('vacunas', []))
+    return out - {None}
+
+
+def _atencion(cita):
+    """historialData de una cita atendida como entrada de historial, o None"""
+    data = cita.get('historialData')
+    if not isinstance(data, dict):
+        return None
+    return {**data, "fecha": data.get('fecha') or cita.get('fechaActualizacion') or cita.get('fecha')}
+
+
+def build(db, mascota_id):
+    """Resumen calculado desde cero con el historial y las citas atendidas de la mascota"""
+    summary = empty_summary(mascota_id)
+    for entry in db.historial_clinico.find({"mascotaId": mascota_id}, {"archivosAdjuntos": 0}):
+        fold(summary, entry, f"historial:{entry['_id']}")
+    citas = db.appointments.find({"mascotaId": mascota_id, "estado": "atendida", "historialData": {"$ne": None}},
+                                 {"historialData": 1, "fecha": 1, "fechaActualizacion": 1})
+    for cita in citas:
+        entry = _atencion(cita)
+        if entry is not None:
+            fold(summary, entry, f"cita:{cita['_id']}", count=False)
+    return summary
+
+
+def _save(db, mascota_id, change):
+    """Leer, aplicar `change(resumen)` y reemplazar si nadie lo cambió entre medias"""
+    for _ in range(SAVE_ATTEMPTS):
+        current = db.historial_resumen.find_one({"_id": mascota_id})
+        summary = change(dict(current) if current else empty_summary(mascota_id))
+        summary['version'] = (current or {}).get('version', 0) + 1
+        summary['fechaActualizacion'] = datetime.utcnow()
+        if current is None:
+            try:
+                db.historial_resumen.insert_one(summary)
+                return summary
+            except DuplicateKeyError:
+                continue
+        if db.historial_resumen.replace_one({"_id": mascota_id, "version": current.get('version', 0)},
+                                            summary).matched_count:
+            return summary
+    # Mucha contención sobre la misma mascota: recalcular desde el historial
+    summary = build(db, mascota_id)
+    summary['version'] = SAVE_ATTEMPTS + (current or {}).get('version', 0)
+    summary['fechaActualizacion'] = datetime.utcnow()
+    db.historial_resumen.replace_one({"_id": mascota_id}, summary, upsert=True)
+    return summary
+
+
+def record_consulta(db, before, after):
+    """Actualizar el resumen tras crear (before None) o editar una consulta"""
+    source = f"historial:{after['_id']}"
+    mascota_id = after.get('mascotaId')
+    if before is not None and before.get('mascotaId') != mascota_id and before.get('mascotaId'):
+        refresh(db, before['mascotaId'])
+    if not mascota_id:
+        return
+    if before is None:
+        def change(summary):
+            if not summary.get('version'):
+                # Sin resumen previo: el historial ya incluye esta consulta
+                return build(db, mascota_id)
+            return fold(summary, after, source)
+        _save(db, mascota_id, change)
+        return
+
+    def change(summary):
+        if not summary.get('version') or source in _sources(summary):
+            # La consulta editada aporta datos al resumen: no se puede restar, se recalcula
+            return build(db, mascota_id)
+        return fold(summary, after, source, count=before.get('mascotaId') != mascota_id)
+    _save(db, mascota_id, change)
+
+
+def record_atencion(db, cita):
+    """Incorporar el historialData de una cita atendida al resumen de su mascota"""
+    entry = _atencion(cita)
+    mascota_id = (entry or {}).get('mascotaId') or cita.get('mascotaId')
+    if entry is None or not mascota_id:
+        return
+    source = f"cita:{cita['_id']}"
+
+    def change(summary):
+        if not summary.get('version') or source in _sources(summary):
+            return build(db, mascota_id)
+        return fold(summary, entry, source, count=False)
+    _save(db, mascota_id, change)
+
+
+def refresh(db, mascota_id):
+    """Recalcular y guardar el resumen de una mascota"""
+    return _save(db, mascota_id, lambda summary: build(db, mascota_id))
+
+
+def get_summary(db, mascota_id):
+    """Resumen de una mascota listo para la API; lo calcula la primera vez si hay historial"""
+    summary = db.historial_resumen.find_one({"_id": mascota_id})
+    if summary is None:
+        if not db.historial_clinico.find_one({"mascotaId": mascota_id}, {"_id": 1}):
+            return {"mascotaId": mascota_id, "totalConsultas": 0, "vacunas": [], "medicamentosActivos": []}
+        # Datos anteriores al resumen: se calcula una vez desde el historial
+        summary = _save(db, mascota_id, lambda s: s if s.get('version') else build(db, mascota_id))
+
+    now = datetime.utcnow()
+    out = {k: v for k, v in summary.items() if k not in ('_id', 'medicamentos')}
+    medicamentos = summary.get('medicamentos') or {}
+    out['medicamentosActivos'] = [m for m in medicamentos.get('items', []) if m.get('hasta') is None or m['hasta'] >= now]
+    out['medicamentosDesde'] = medicamentos.get('fecha')
+    out.setdefault('vacunas', [])
+    return out
+
+
+def forget(db, mascota_ids):
+    """Borrar los resúmenes de mascotas eliminadas"""
+    if mascota_ids:
+        db.historial_resumen.delete_many({"_id": {"$in": list(mascota_ids)}})
+
+
+historial_cli = AppGroup('historial', help="Historial clínico")
+
+
+@historial_cli.command('rebuild-summaries')
+@click.option('--mascota', 'mascota_id', default=None, help="Sólo esta mascota")
+@with_appcontext
+def rebuild_summaries_command(mascota_id):
+    """Recalcular los resúmenes clínicos desde el historial y las citas atendidas"""
+    db = get_db()
+    ids = [mascota_id] if mascota_id else db.historial_clinico.distinct('mascotaId')
+    for mid in ids:
+        if mid:
+            refresh(db, mid)
+    click.echo(f"{len(ids)} resúmenes recalculados")
@@ -0,0 +1,143 @@
+from collections import Counter, defaultdict
+
+import click
+from flask.cli import AppGroup, with_appcontext
+from pymongo import ReplaceOne, ReturnDocument, UpdateOne
+
+from .db import get_db
+
+# Un documento por ámbito en `contadores`: "global" y "vet:<veterinarioId>".
+# Cada grupo guarda {estado: número de documentos}. Además "user:<usuarioId>"
+# lleva `noLeidas`, las notificaciones sin leer de ese usuario.
+GLOBAL = 'global'
+GROUPS = {
+    'appointments': 'citas',
+    'pre_citas': 'preCitas',
+}
+
+
+def _scopes(collection, doc):
+    yield GLOBAL
+    if collection == 'appointments' and doc.get('veterinarioId'):
+        yield f"vet:{doc['veterinarioId']}"
+
+
+def _estado(doc):
+    """Estado usable como nombre de campo, o None"""
+    estado = doc.get('estado')
+    if not isinstance(estado, str) or not estado or '.' in estado or estado.startswith('$'):
+        return None
+    return estado
+
+
+def record(db, collection, changes):
+    """Ajustar los contadores con $inc por documentos que pasan de `antes` a `después`.
+
+    `changes` es una lista de (antes, después); None en un lado es un alta o
+    una baja. Todos los cambios van en un solo bulk_write.
+    """
+    group = GROUPS[collection]
+    incs = defaultdict(Counter)
+    for before, after in changes:
+        for doc, sign in ((before, -1), (after, 1)):
+            estado = _estado(doc) if doc else None
+            if estado is None:
+                continue
+            for scope in _scopes(collection, doc):
+                incs[scope][f"{group}.{estado}"] += sign
+    ops = []
+    for scope, fields in incs.items():
+        fields = {k: v for k, v in fields.items() if v}
+        if fields:
+            ops.append(UpdateOne({"_id": scope}, {"$inc": fields}, upsert=True))
+    if ops:
+        db.contadores.bulk_write(ops, ordered=False)
+
+
+def record_subscribers(db, delta):
+    if delta:
+        db.contadores.update_one({"_id": GLOBAL}, {"$inc": {"suscriptoresActivos": delta}}, upsert=True)
+
+
+def user_scope(user_id):
+    return f"user:{user_id}"
+
+
+def record_unread(db, deltas):
+    """Ajustar `noLeidas` por usuario ({usuarioId: delta}); devuelve {usuarioId: nuevo total}"""
+    out = {}
+    for user_id, delta in deltas.items():
+        if not user_id or not delta:
+            continue
+        doc = db.contadores.find_one_and_update(
+            {"_id": user_scope(user_id)}, {"$inc": {"noLeidas": delta}},
+            projection={"noLeidas": 1}, upsert=True, return_document=ReturnDocument.AFTER,
+        )
+        out[user_id] = max(doc['noLeidas'], 0)
+    return out
+
+
+def read_unread(db, user_id):
+    """Notificaciones sin leer de un usuario, por clave primaria"""
+    doc = db.contadores.find_one({"_id": user_scope(user_id)}, {"noLeidas": 1})
+    return max(doc['noLeidas'], 0) if doc else 0
+
+
+def read_stats(db, vet_id=None):
+    """Contadores del panel con una sola lectura por clave primaria"""
+    ids = [GLOBAL] + ([f"vet:{vet_id}"] if vet_id else [])
+    docs = {d['_id']: d for d in db.contadores.find({"_id": {"$in": ids}})}
+    scope = docs.get(f"vet:{vet_id}" if vet_id else GLOBAL, {})
+    citas = {k: v for k, v in scope.get('citas', {}).items() if v}
+    out = {
+        "citas": {
+            "porEstado": citas,
+            "total": sum(citas.values()),
+            "pendientesValidacion": citas.get('en_validacion', 0),
+        },
+    }
+    if not vet_id:
+        pre_citas = {k: v for k, v in docs.get(GLOBAL, {}).get('preCitas', {}).items() if v}
+        out["preCitas"] = {"porEstado": pre_citas, "pendientes": pre_citas.get('pendiente', 0)}
+        out["suscriptores"] = {"activos": docs.get(GLOBAL, {}).get('suscriptoresActivos', 0)}
+    return out
+
+
+def rebuild(db):
+    """Recalcular todos los contadores desde las colecciones de origen"""
+    scopes = defaultdict(lambda: defaultdict(dict))
+    pipeline = [{"$group": {"_id": {"estado": "$estado", "vet": "$veterinarioId"}, "n": {"$sum": 1}}}]
+    for row in db.appointments.aggregate(pipeline):
+        doc = {"estado": row['_id'].get('estado'), "veterinarioId": row['_id'].get('vet')}
+        estado = _estado(doc)
+        if estado is None:
+            continue
+        for scope in _scopes('appointments', doc):
+            citas = scopes[scope]['citas']
+            citas[estado] = citas.get(estado, 0) + row['n']
+    for row in db.pre_citas.aggregate([{"$group": {"_id": "$estado", "n": {"$sum": 1}}}]):
+        estado = _estado({"estado": row['_id']})
+        if estado is not None:
+            scopes[GLOBAL]['preCitas'][estado] = row['n']
+    scopes[GLOBAL]['suscriptoresActivos'] = db.newsletter_suscriptores.count_documents({"activo": True})
+    unread = [{"$match": {"leida": False}}, {"$group": {"_id": "$usuarioId", "n": {"$sum": 1}}}]
+    for row in db.notificaciones.aggregate(unread):
+        if row['_id']:
+            scopes[user_scope(row['_id'])]['noLeidas'] = row['n']
+
+    ops = [ReplaceOne({"_id": scope}, dict(values), upsert=True) for scope, values in scopes.items()]
+    db.contadores.bulk_write(ops, ordered=False)
+    # Veterinarios que ya no tienen citas, usuarios sin notificaciones pendientes
+    stale = db.contadores.delete_many({"_id": {"$nin": list(scopes)}}).deleted_count
+    return len(ops), stale
+
+
+stats_cli = AppGroup('stats', help="Contadores del panel")
+
+
+@stats_cli.command('reconcile')
+@with_appcontext
+def reconcile_command():
+    """Reconstruir los contadores desde citas, pre-citas, suscriptores y notificaciones"""
+    written, stale = rebuild(get_db())
+    click.echo(f"{written} ámbitos recalculados, {stale} eliminados")
@@ -0,0 +1,126 @@
+from datetime import date, datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+
+import click
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
+from pymongo import UpdateOne
+
+from .db import get_db
+from .repository import versioned
+
+# Fechas que se guardan como BSON date (UTC). Lo que llega sin zona se
+# entiende en la hora local de la clínica (CLINIC_TIMEZONE).
+DATE_FIELDS = {
+    'appointments': ('fecha',),
+    'historial_clinico': ('fecha',),
+    'pets': ('fechaNacimiento',),
+}
+
+
+def clinic_tz():
+    return ZoneInfo(current_app.config['CLINIC_TIMEZONE'])
+
+
+def _parse(value):
+    """datetime con zona a partir de un ISO 8601 o un datetime, o None.
+
+    Un datetime sin zona es UTC (así lo devuelve pymongo); un texto sin zona o
+    sólo con la fecha ("2024-05-01") es hora local de la clínica.
+    """
+    if isinstance(value, datetime):
+        return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+    if isinstance(value, date):
+        return datetime.combine(value, time.min, tzinfo=clinic_tz())
+    if not isinstance(value, str) or not value.strip():
+        return None
+    try:
+        parsed = datetime.fromisoformat(value.strip().replace('Z', '+00:00'))
+    except ValueError:
+        return None
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=clinic_tz())
+
+
+def to_utc(value):
+    """Fecha para guardar en Mongo: datetime UTC sin zona, o None si no se entiende"""
+    parsed = _parse(value)
+    if parsed is None:
+        return None
+    return parsed.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def to_local(value):
+    """Fecha en la hora local de la clínica (datetime con zona), o None"""
+    parsed = _parse(value)
+    return parsed.astimezone(clinic_tz()) if parsed is not None else None
+
+
+def day_start(day: date):
+    """Inicio de un día local de la clínica, en UTC sin zona"""
+    return to_utc(datetime.combine(day, time.min, tzinfo=clinic_tz()))
+
+
+def _is_day(value):
+    return isinstance(value, str) and len(value.strip()) == 10
+
+
+def range_filter(desde=None, hasta=None):
+    """Condición de Mongo para un rango de fechas de la query string, o None.
+
+    `hasta` con sólo la fecha incluye el día entero. ValueError si no se entiende.
+    """
+    cond = {}
+    if desde:
+        cond['$gte'] = to_utc(desde)
+        if cond['$gte'] is None:
+            raise ValueError("invalid fechaDesde")
+    if hasta:
+        if _is_day(hasta):
+            try:
+                cond['$lt'] = day_start(date.fromisoformat(hasta.strip()) + timedelta(days=1))
+            except ValueError:
+                raise ValueError("invalid fechaHasta")
+        else:
+            cond['$lte'] = to_utc(hasta)
+            if cond['$lte'] is None:
+                raise ValueError("invalid fechaHasta")
+    return cond or None
+
+
+def coerce_dates(collection_name, data):
+    """Convertir a BSON date las fechas de `data` (en sitio); ValueError si alguna no se entiende"""
+    for field in DATE_FIELDS.get(collection_name, ()):
+        if data.get(field) is not None:
+            value = to_utc(data[field])
+            if value is None:
+                raise ValueError(f"invalid {field}")
+            data[field] = value
+    return data
+
+
+dates_cli = AppGroup('dates', help="Fechas guardadas como texto")
+
+
+@dates_cli.command('migrate')
+@click.option('--batch-size', default=500, show_default=True)
+@with_appcontext
+def migrate_command(batch_size):
+    """Convertir a BSON date las fechas guardadas como texto"""
+    db = get_db()
+    for collection, fields in DATE_FIELDS.items():
+        for field in fields:
+            ops = []
+            moved = invalid = 0
+            for doc in db[collection].find({field: {"$type": "string"}}, {field: 1}).batch_size(batch_size):
+                value = to_utc(doc[field])
+                if value is None:
+                    invalid += 1
+                    continue
+                ops.append(UpdateOne({"_id": doc['_id'], field: doc[field]},
+                                      versioned(db[collection], {"$set": {field: value}})))
+                if len(ops) >= batch_size:
+                    moved += db[collection].bulk_write(ops, ordered=False).modified_count
+                    ops.clear()
+            if ops:
+                moved += db[collection].bulk_write(ops, ordered=False).modified_count
+            click.echo(f"{collection}.{field}: {moved} convertidas, {invalid} sin formato válido")
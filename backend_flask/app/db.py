@@ -1,21 +1,126 @@
 import os
-from flask import current_app, g
-from pymongo import MongoClient
+import threading
+from flask import current_app
+from pymongo import MongoClient, monitoring
 
 
-def get_db():
-    if 'mongo_client' not in g:
-        uri = current_app.config['MONGO_URI']
-        g.mongo_client = MongoClient(uri)
-    dbname = current_app.config['MONGO_DB']
-    return g.mongo_client[dbname]
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Contadores del pool de conexiones de Mongo para este proceso"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checked_out = 0
+            self.waiting = 0
+            self.created = 0
+            self.closed = 0
+            self.checkout_failed = 0
+            self.cleared = 0
+
+    def _add(self, **deltas):
+        with self._lock:
+            for name, delta in deltas.items():
+                setattr(self, name, getattr(self, name) + delta)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "checkedOut": self.checked_out,
+                "waiting": self.waiting,
+                "created": self.created,
+                "closed": self.closed,
+                "open": self.created - self.closed,
+                "checkoutFailed": self.checkout_failed,
+                "cleared": self.cleared,
+            }
+
+    # Eventos del pool (pymongo.monitoring)
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._add(cleared=1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._add(created=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._add(closed=1)
+
+    def connection_check_out_started(self, event):
+        self._add(waiting=1)
 
+    def connection_check_out_failed(self, event):
+        self._add(waiting=-1, checkout_failed=1)
 
-def close_db(e=None):
-    client = g.pop('mongo_client', None)
-    if client is not None:
-        client.close()
+    def connection_checked_out(self, event):
+        self._add(waiting=-1, checked_out=1)
+
+    def connection_checked_in(self, event):
+        self._add(checked_out=-1)
+
+
+pool_stats = PoolStats()
+_client_lock = threading.Lock()
+
+
+def _create_client(app):
+    # connect=False: no abrir sockets ni hilos hasta el primer uso, así el
+    # cliente creado en create_app no cruza un fork() del servidor
+    return MongoClient(
+        app.config['MONGO_URI'],
+        maxPoolSize=app.config['MONGO_MAX_POOL_SIZE'],
+        minPoolSize=app.config['MONGO_MIN_POOL_SIZE'],
+        maxIdleTimeMS=app.config['MONGO_MAX_IDLE_TIME_MS'],
+        waitQueueTimeoutMS=app.config['MONGO_WAIT_QUEUE_TIMEOUT_MS'],
+        event_listeners=[pool_stats],
+        connect=False,
+    )
+
+
+def get_client(app=None):
+    """Cliente compartido del proceso; se recrea si el proceso fue forkeado"""
+    if app is None:
+        app = current_app._get_current_object()
+    state = app.extensions.get('mongo')
+    pid = os.getpid()
+    if state is None or state['pid'] != pid:
+        with _client_lock:
+            state = app.extensions.get('mongo')
+            if state is None or state['pid'] != pid:
+                if state is not None:
+                    # Heredado del padre: no se cierra aquí, sus sockets
+                    # pertenecen al otro proceso
+                    pool_stats.reset()
+                state = {"client": _create_client(app), "pid": pid}
+                app.extensions['mongo'] = state
+    return state['client']
+
+
+def reset_client(app):
+    """Descartar el cliente actual (p. ej. tras fork) y crear uno nuevo"""
+    with _client_lock:
+        app.extensions.pop('mongo', None)
+    pool_stats.reset()
+    return get_client(app)
+
+
+def get_db():
+    return get_client()[current_app.config['MONGO_DB']]
 
 
 def init_db(app):
-    app.teardown_appcontext(close_db)
+    # Un único cliente por proceso worker, creado junto con la app
+    get_client(app)
@@ -0,0 +1,213 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import click
+from bson import ObjectId
+from flask import current_app
+from flask.cli import with_appcontext
+
+from .db import get_db
+from .login_keys import users_cli
+from .repository import NOT_DELETED, find_by_id, update_by_id
+from .storage import blob_shas, release_blobs
+from .counters import record, user_scope
+from .availability import invalidate
+from .clinical import forget as forget_summaries
+
+logger = logging.getLogger(__name__)
+
+# Colecciones que se borran en cascada, en este orden (el historial va con
+# cada lote de mascotas)
+CASCADE_STEPS = ('appointments', 'notificaciones', 'pets')
+JOB_STATES_OPEN = ('pendiente', 'en_curso')
+
+_executor = None
+_executor_pid = None
+_lock = threading.Lock()
+
+
+def _get_executor(app):
+    global _executor, _executor_pid
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _lock:
+            if _executor is None or _executor_pid != pid:
+                _executor = ThreadPoolExecutor(max_workers=app.config['DELETE_WORKERS'],
+                                               thread_name_prefix='delete-user')
+                _executor_pid = pid
+    return _executor
+
+
+def _keys(docs):
+    """Ids con los que otras colecciones referencian estos documentos (str(_id) y `id` antiguo)"""
+    keys = []
+    for doc in docs:
+        keys.append(str(doc['_id']))
+        if doc.get('id'):
+            keys.append(doc['id'])
+    return keys
+
+
+def public_job(job):
+    """Estado del trabajo para la API, sin las listas internas"""
+    return {
+        "id": str(job['_id']),
+        "usuarioId": job['usuarioId'],
+        "estado": job['estado'],
+        "progreso": job['progreso'],
+        "error": job.get('error'),
+        "fechaCreacion": job['fechaCreacion'],
+        "fechaActualizacion": job.get('fechaActualizacion'),
+        "fechaFin": job.get('fechaFin'),
+    }
+
+
+def _tombstone(db, id, now):
+    """Marcar el usuario como borrado; devuelve {_id, id} o None si ya estaba marcado.
+
+    La marca quita también las claves de login y de búsqueda: deja de poder
+    iniciar sesión y sus email/username/telefono quedan libres de inmediato.
+    email es único y no disperso: se sustituye por un valor propio en vez de quitarlo
+    """
+    return update_by_id(db.users, id, {"$set": {"eliminadoEn": now, "email": f"eliminado:{ObjectId()}"},
+                                       "$unset": {"loginKeys": "", "searchTokens": "", "username": ""}},
+                        {"_id": 1, "id": 1}, query=NOT_DELETED)
+
+
+def _new_job(user, now):
+    return {
+        "_id": ObjectId(),
+        "tipo": "delete_user",
+        "usuarioId": str(user['_id']),
+        "claves": _keys([user]),
+        "estado": "pendiente",
+        "progreso": {name: 0 for name in (*CASCADE_STEPS, 'historial_clinico', 'blobs')},
+        "blobs": [],
+        "fechaCreacion": now,
+    }
+
+
+def _latest_job(db, user_id):
+    return db.jobs.find_one({"tipo": "delete_user", "usuarioId": user_id}, sort=[('fechaCreacion', -1)])
+
+
+def start_user_deletion(id):
+    """Marcar el usuario como borrado y encolar la cascada; devuelve el trabajo o None.
+
+    Un usuario ya marcado devuelve su trabajo existente en lugar de crear otro.
+    """
+    db = get_db()
+    now = datetime.utcnow()
+    user = find_by_id(db.users, id, {"_id": 1, "id": 1}, query=NOT_DELETED)
+    if user is None:
+        user = find_by_id(db.users, id, {"_id": 1})
+        return _latest_job(db, str(user['_id'])) if user is not None else None
+
+    # El trabajo se guarda antes de la marca (sin transacciones en un mongod
+    # suelto): si el proceso cae entre medias, resume-deletions lo completa
+    job = _new_job(user, now)
+    db.jobs.insert_one(job)
+    if _tombstone(db, user['_id'], now) is None:
+        # Otra petición lo marcó antes: vale su trabajo
+        db.jobs.delete_one({"_id": job['_id']})
+        return _latest_job(db, job['usuarioId'])
+    schedule_job(job['_id'])
+    return job
+
+
+def schedule_job(job_id):
+    app = current_app._get_current_object()
+    _get_executor(app).submit(_run_job, app, job_id)
+
+
+def _run_job(app, job_id):
+    with app.app_context():
+        db = get_db()
+        try:
+            job = db.jobs.find_one_and_update({"_id": job_id, "estado": {"$in": JOB_STATES_OPEN}},
+                                              {"$set": {"estado": "en_curso", "fechaActualizacion": datetime.utcnow()}})
+            if job is None:
+                return
+            delete_user_cascade(db, job)
+        except Exception as e:
+            logger.exception("user deletion %s failed", job_id)
+            db.jobs.update_one({"_id": job_id}, {"$set": {"estado": "error", "error": str(e),
+                                                         "fechaActualizacion": datetime.utcnow()}})
+
+
+def _delete_in_batches(db, job_id, collection, query, before=None):
+    """Borrar por lotes de DELETE_BATCH_SIZE con una pausa entre lotes, anotando el progreso"""
+    cfg = current_app.config
+    pause = cfg['DELETE_BATCH_PAUSE_MS'] / 1000
+    while True:
+        docs = list(db[collection].find(query).limit(cfg['DELETE_BATCH_SIZE']))
+        if not docs:
+            return
+        if before is not None:
+            before(docs)
+        shas = set()
+        for doc in docs:
+            shas |= blob_shas(collection, doc)
+        deleted = db[collection].delete_many({"_id": {"$in": [d['_id'] for d in docs]}}).deleted_count
+        update = {"$inc": {f"progreso.{collection}": deleted}, "$set": {"fechaActualizacion": datetime.utcnow()}}
+        if shas:
+            # Se guardan en el trabajo para poder liberarlos aunque se reanude
+            update["$addToSet"] = {"blobs": {"$each": sorted(shas)}}
+        db.jobs.update_one({"_id": job_id}, update)
+        if pause:
+            time.sleep(pause)
+
+
+def delete_user_cascade(db, job):
+    """Borrar todo lo del usuario y después el propio usuario. Es idempotente:
+    un trabajo interrumpido se puede volver a ejecutar desde el principio"""
+    job_id, keys = job['_id'], job['claves']
+    # Sin efecto si ya está marcado; completa un trabajo guardado sin su marca
+    _tombstone(db, ObjectId(job['usuarioId']), job['fechaCreacion'])
+
+    def forget_citas(citas):
+        # Las citas borradas dejan de contar y liberan su hueco en la agenda
+        record(db, 'appointments', [(c, None) for c in citas])
+        invalidate(db, citas)
+
+    def delete_historial(pets):
+        _delete_in_batches(db, job_id, 'historial_clinico', {"mascotaId": {"$in": _keys(pets)}})
+        forget_summaries(db, _keys(pets))
+
+    _delete_in_batches(db, job_id, 'appointments', {"clienteId": {"$in": keys}}, before=forget_citas)
+    _delete_in_batches(db, job_id, 'notificaciones', {"usuarioId": {"$in": keys}})
+    _delete_in_batches(db, job_id, 'pets', {"clienteId": {"$in": keys}}, before=delete_historial)
+
+    user = db.users.find_one({"_id": ObjectId(job['usuarioId'])})
+    shas = set(db.jobs.find_one({"_id": job_id}, {"blobs": 1}).get('blobs', []))
+    if user is not None:
+        shas |= blob_shas('users', user)
+        db.users.delete_one({"_id": user['_id']})
+    released = release_blobs(db, shas)
+    db.contadores.delete_many({"_id": {"$in": [user_scope(k) for k in keys]}})
+
+    now = datetime.utcnow()
+    db.jobs.update_one({"_id": job_id}, {"$set": {"estado": "completado", "progreso.blobs": released,
+                                                  "fechaActualizacion": now, "fechaFin": now}})
+
+
+@users_cli.command('resume-deletions')
+@with_appcontext
+def resume_deletions_command():
+    """Completar (de forma síncrona) los borrados de usuarios interrumpidos"""
+    db = get_db()
+    # Usuarios marcados sin trabajo (marcas anteriores a guardar el trabajo primero)
+    for user in db.users.find({"eliminadoEn": {"$exists": True}}, {"_id": 1, "id": 1}):
+        if db.jobs.find_one({"tipo": "delete_user", "usuarioId": str(user['_id'])}, {"_id": 1}) is None:
+            db.jobs.insert_one(_new_job(user, datetime.utcnow()))
+    resumed = 0
+    for job in db.jobs.find({"tipo": "delete_user", "estado": {"$in": (*JOB_STATES_OPEN, 'error')}}):
+        click.echo(f"reanudando borrado de {job['usuarioId']}")
+        db.jobs.update_one({"_id": job['_id']}, {"$set": {"estado": "en_curso"}, "$unset": {"error": ""}})
+        delete_user_cascade(db, job)
+        resumed += 1
+    click.echo(f"{resumed} borrados completados")
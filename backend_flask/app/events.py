@@ -0,0 +1,209 @@
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+from flask import Response, current_app
+from pymongo import CursorType
+from pymongo.errors import CollectionInvalid, PyMongoError
+
+from .db import get_db
+
+logger = logging.getLogger(__name__)
+
+# Colección capped por la que pasan los eventos entre workers (EVENTS_BACKEND=mongo)
+EVENTS_COLLECTION = 'eventos'
+# Al abrir el cursor se entregan también los eventos de este margen hacia atrás
+# (relojes de otros workers); los ya entregados se descartan por _id
+RESUME_WINDOW = timedelta(seconds=5)
+# Espera antes de reabrir un cursor muerto (la colección dio la vuelta o Mongo falló)
+REOPEN_SECONDS = 0.2
+
+
+class EventBus:
+    """Pub/sub en memoria del proceso: un canal por usuarioId, una cola acotada por conexión SSE"""
+
+    def __init__(self):
+        self._subs = {}
+        self._lock = threading.Lock()
+        self._seq = itertools.count(1)
+        self.dropped = 0
+
+    def subscribe(self, channel, maxsize):
+        q = queue.Queue(maxsize)
+        with self._lock:
+            self._subs.setdefault(channel, set()).add(q)
+        return q
+
+    def unsubscribe(self, channel, q):
+        with self._lock:
+            subs = self._subs.get(channel)
+            if subs is not None:
+                subs.discard(q)
+                if not subs:
+                    del self._subs[channel]
+
+    def deliver(self, channels, event_id, event, payload):
+        """Entregar un evento ya serializado a las conexiones de este proceso en `channels`"""
+        with self._lock:
+            subs = [q for channel in channels for q in self._subs.get(channel, ())]
+        if not subs:
+            return
+        message = f"id: {event_id}\nevent: {event}\ndata: {payload}\n\n"
+        for q in subs:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                # Cliente que no lee: se cierra su conexión y al reconectar recibe el estado actual
+                self.dropped += 1
+                _close(q)
+
+    def close_all(self):
+        """Cerrar todas las conexiones (el worker va a parar): los navegadores reconectan a otro"""
+        with self._lock:
+            subs = [q for qs in self._subs.values() for q in qs]
+        for q in subs:
+            _close(q)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "channels": len(self._subs),
+                "connections": sum(len(s) for s in self._subs.values()),
+                "dropped": self.dropped,
+            }
+
+
+def _close(q):
+    while True:
+        try:
+            q.get_nowait()
+        except queue.Empty:
+            break
+    q.put_nowait(None)
+
+
+bus = EventBus()
+
+_follower_pid = None
+_follower_lock = threading.Lock()
+_capped_ready = set()
+
+
+def _events(db):
+    """Colección de eventos, creada capped la primera vez en cada proceso"""
+    if os.getpid() not in _capped_ready:
+        try:
+            db.create_collection(EVENTS_COLLECTION, capped=True, size=current_app.config['EVENTS_CAPPED_BYTES'])
+            # Un cursor tailable sobre una colección vacía muere al abrirse: nunca vacía
+            db[EVENTS_COLLECTION].insert_one({"canales": [], "ts": datetime(1970, 1, 1)})
+        except CollectionInvalid:
+            pass
+        _capped_ready.add(os.getpid())
+    return db[EVENTS_COLLECTION]
+
+
+def publish(channels, event, data):
+    """Publicar en varios canales (p. ej. cliente y veterinario de una cita); ignora vacíos.
+
+    Con EVENTS_BACKEND=mongo el evento va a la colección capped y lo entrega
+    el hilo seguidor de cada worker que tenga conexiones SSE; si Mongo falla se
+    pierde el evento, no la petición
+    """
+    channels = sorted({str(c) for c in channels if c})
+    if not channels:
+        return
+    payload = current_app.json.dumps(data)
+    if current_app.config['EVENTS_BACKEND'] != 'mongo':
+        bus.deliver(channels, next(bus._seq), event, payload)
+        return
+    try:
+        _events(get_db()).insert_one({"canales": channels, "evento": event, "datos": payload,
+                                      "ts": datetime.utcnow()})
+    except PyMongoError:
+        logger.exception("could not publish %s event", event)
+
+
+def _follow(app):
+    """Seguir la colección de eventos con un cursor tailable y entregarlos al bus del proceso.
+
+    El cursor recorre la colección entera al abrirse (es pequeña) y luego
+    espera los nuevos; sólo se reabre si muere
+    """
+    seen, order = set(), deque()
+    since = datetime.utcnow()
+    with app.app_context():
+        while True:
+            try:
+                cursor = _events(get_db()).find(cursor_type=CursorType.TAILABLE_AWAIT)
+                while cursor.alive:
+                    for doc in cursor:
+                        if doc['ts'] < since - RESUME_WINDOW or doc['_id'] in seen:
+                            continue
+                        seen.add(doc['_id'])
+                        order.append(doc['_id'])
+                        if len(order) > 4096:
+                            seen.discard(order.popleft())
+                        since = max(since, doc['ts'])
+                        bus.deliver(doc['canales'], doc['_id'], doc['evento'], doc['datos'])
+                time.sleep(REOPEN_SECONDS)
+            except PyMongoError:
+                logger.exception("event follower failed, reopening")
+                time.sleep(1)
+
+
+def _ensure_follower(app):
+    """Un hilo seguidor por proceso, arrancado con la primera conexión SSE (y de nuevo tras fork)"""
+    global _follower_pid
+    pid = os.getpid()
+    if app.config['EVENTS_BACKEND'] != 'mongo' or _follower_pid == pid:
+        return
+    with _follower_lock:
+        if _follower_pid != pid:
+            threading.Thread(target=_follow, args=(app,), name='events-follower', daemon=True).start()
+            _follower_pid = pid
+
+
+def sse_response(channel, initial=()):
+    """Respuesta text/event-stream suscrita a `channel`.
+
+    `initial` son (evento, datos) que se envían nada más conectar. La conexión
+    se cierra tras SSE_MAX_SECONDS para no retener workers: el navegador
+    reconecta solo (EventSource) y vuelve a recibir el estado inicial.
+    """
+    cfg = current_app.config
+    heartbeat, max_seconds = cfg['SSE_HEARTBEAT_SECONDS'], cfg['SSE_MAX_SECONDS']
+    dumps = current_app.json.dumps
+    head = [f"retry: {cfg['SSE_RETRY_MS']}\n\n"]
+    head += [f"event: {event}\ndata: {dumps(data)}\n\n" for event, data in initial]
+    _ensure_follower(current_app._get_current_object())
+    q = bus.subscribe(channel, cfg['SSE_QUEUE_SIZE'])
+
+    def generate():
+        deadline = time.monotonic() + max_seconds
+        try:
+            yield from head
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return
+                try:
+                    message = q.get(timeout=min(heartbeat, remaining))
+                except queue.Empty:
+                    # Comentario SSE: mantiene viva la conexión a través de proxies
+                    yield ": ping\n\n"
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            bus.unsubscribe(channel, q)
+
+    return Response(generate(), mimetype='text/event-stream', headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
+    })
@@ -0,0 +1,181 @@
+import io
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+import click
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
+
+from .db import get_db
+from .repository import versioned
+from .storage import DiskBlobStore, blob_sha, get_store, parse_data_url, save_stream
+
+logger = logging.getLogger(__name__)
+
+# Derivados de cada foto: nombre -> lado mayor en px (None = tamaño original)
+DERIVATIVE_SIZES = {
+    "thumb": 128,
+    "card": 480,
+    "webp": None,
+}
+WEBP_QUALITY = 80
+
+# Colecciones cuya `foto` tiene derivados
+IMAGE_COLLECTIONS = ('users', 'pets')
+
+_executor = None
+_executor_pid = None
+_slots = None
+_lock = threading.Lock()
+
+
+def render_derivatives(source) -> dict:
+    """Generar los derivados WebP de una imagen (se ejecuta en el pool de procesos).
+
+    `source` es la ruta del blob en disco o sus bytes. Se aplica la orientación
+    EXIF y no se copian metadatos al resultado.
+    """
+    from PIL import Image, ImageOps
+
+    out = {}
+    with Image.open(source if isinstance(source, str) else io.BytesIO(source)) as src:
+        img = ImageOps.exif_transpose(src)
+        if img.mode not in ('RGB', 'RGBA'):
+            img = img.convert('RGBA' if 'A' in img.getbands() else 'RGB')
+        for name, size in DERIVATIVE_SIZES.items():
+            variant = img.copy()
+            if size is not None:
+                variant.thumbnail((size, size))
+            buf = io.BytesIO()
+            variant.save(buf, 'WEBP', quality=WEBP_QUALITY, method=4)
+            out[name] = buf.getvalue()
+    return out
+
+
+def _get_executor(app):
+    """Pool de procesos acotado, uno por proceso worker (se recrea tras fork)"""
+    global _executor, _executor_pid, _slots
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _lock:
+            if _executor is None or _executor_pid != pid:
+                _executor = ProcessPoolExecutor(max_workers=app.config['IMAGE_WORKERS'])
+                _slots = threading.BoundedSemaphore(app.config['IMAGE_QUEUE_SIZE'])
+                _executor_pid = pid
+    return _executor, _slots
+
+
+def _read_source(sha):
+    store = get_store()
+    if isinstance(store, DiskBlobStore):
+        return store.path(sha)
+    with store.open(sha) as f:
+        return f.read()
+
+
+def _render_or_none(source, sha):
+    try:
+        return render_derivatives(source)
+    except Exception:
+        logger.exception("image derivatives failed for %s", sha)
+        return None
+
+
+def _store_derivatives(app, collection, doc_id, sha, rendered):
+    with app.app_context():
+        db = get_db()
+        if rendered is None:
+            update = {"estado": "error", "origen": sha}
+        else:
+            update = {"estado": "lista", "origen": sha}
+            for name, data in rendered.items():
+                update[name] = save_stream(io.BytesIO(data), 'image/webp')['url']
+        # Si la foto cambió mientras tanto, estos derivados ya no aplican
+        db[collection].update_one(
+            {"_id": doc_id, "fotoMiniaturas.origen": sha},
+            versioned(db[collection], {"$set": {"fotoMiniaturas": update}}),
+        )
+
+
+def pending_derivatives(sha):
+    """Estado de `fotoMiniaturas` a guardar junto con una foto nueva"""
+    return {"estado": "pendiente", "origen": sha}
+
+
+def store_photo(value):
+    """`foto` y `fotoMiniaturas` de una foto recibida en el cuerpo.
+
+    Una data URL pasa al almacén de blobs y, si es una imagen, deja sus
+    derivados pendientes: tras escribir el documento, schedule_photo.
+    """
+    parsed = parse_data_url(value)
+    if parsed is None:
+        return {"foto": value, "fotoMiniaturas": None}
+    content_type, data = parsed
+    blob = save_stream(io.BytesIO(data), content_type)
+    is_image = content_type.startswith('image/')
+    return {"foto": blob['url'], "fotoMiniaturas": pending_derivatives(blob['sha256']) if is_image else None}
+
+
+def schedule_photo(collection, doc_id, fields):
+    """Encolar los derivados que store_photo dejó pendientes en `fields`"""
+    pending = fields.get('fotoMiniaturas')
+    if pending and pending.get('estado') == 'pendiente':
+        schedule_derivatives(collection, doc_id, pending['origen'])
+
+
+def schedule_derivatives(collection, doc_id, sha):
+    """Encolar los derivados de una foto ya guardada; no bloquea la petición.
+
+    El documento debe tener antes `fotoMiniaturas = pending_derivatives(sha)`.
+    Devuelve False si la cola está llena: la foto queda pendiente y se puede
+    completar con `flask images backfill`.
+    """
+    app = current_app._get_current_object()
+    executor, slots = _get_executor(app)
+    if not slots.acquire(blocking=False):
+        logger.warning("image queue full, skipping derivatives for %s", sha)
+        return False
+
+    def done(future):
+        try:
+            try:
+                rendered = future.result()
+            except Exception:
+                logger.exception("image derivatives failed for %s", sha)
+                rendered = None
+            _store_derivatives(app, collection, doc_id, sha, rendered)
+        finally:
+            slots.release()
+
+    try:
+        executor.submit(render_derivatives, _read_source(sha)).add_done_callback(done)
+    except Exception:
+        slots.release()
+        raise
+    return True
+
+
+images_cli = AppGroup('images', help="Miniaturas y derivados WebP de fotos")
+
+
+@images_cli.command('backfill')
+@with_appcontext
+def backfill_command():
+    """Generar derivados para fotos que aún no los tienen (de forma síncrona)"""
+    db = get_db()
+    app = current_app._get_current_object()
+    for collection in IMAGE_COLLECTIONS:
+        processed = 0
+        query = {"foto": {"$regex": "^/api/blobs/"}, "fotoMiniaturas.estado": {"$ne": "lista"}}
+        for doc in db[collection].find(query, {"foto": 1}):
+            sha = blob_sha(doc['foto'])
+            if not sha:
+                continue
+            db[collection].update_one({"_id": doc['_id']},
+                                      versioned(db[collection], {"$set": {"fotoMiniaturas": pending_derivatives(sha)}}))
+            _store_derivatives(app, collection, doc['_id'], sha, _render_or_none(_read_source(sha), sha))
+            processed += 1
+        click.echo(f"{collection}: {processed} fotos procesadas")
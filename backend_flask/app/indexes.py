@@ -0,0 +1,219 @@
+import sys
+from datetime import datetime
+
+import click
+from bson import ObjectId
+from flask.cli import AppGroup, with_appcontext
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+
+from .db import get_db
+from .deletion import NOT_DELETED
+from .storage import BLOB_FIELDS, blob_url
+
+ASC, DESC = ASCENDING, DESCENDING
+
+# Índices por colección. Los listados paginan por (orden, _id), así que `_id`
+# forma parte de cada índice compuesto para que el orden salga del índice.
+INDEXES = {
+    'users': [
+        IndexModel([('email', ASC)], unique=True),
+        # Parcial y no disperso: las altas sin username guardan null, y un
+        # índice disperso sí indexa los null
+        IndexModel([('username', ASC)], unique=True, partialFilterExpression={'username': {'$type': 'string'}}),
+        # email/username/telefono normalizados (app/login_keys.py)
+        IndexModel([('loginKeys', ASC)], unique=True, sparse=True),
+        IndexModel([('rol', ASC), ('_id', ASC)]),
+        # Prefijos sin tildes de nombre, apellidos y email (app/search.py)
+        IndexModel([('searchTokens', ASC), ('rol', ASC)]),
+        # Usuarios marcados como borrados, para resume-deletions (app/deletion.py)
+        IndexModel([('eliminadoEn', ASC)], sparse=True),
+        # Referencias a blobs (storage.BLOB_FIELDS), para release_blobs
+        IndexModel([('foto', ASC)], sparse=True),
+        IndexModel([('fotoMiniaturas.thumb', ASC)], sparse=True),
+        IndexModel([('fotoMiniaturas.card', ASC)], sparse=True),
+        IndexModel([('fotoMiniaturas.webp', ASC)], sparse=True),
+    ],
+    'pets': [
+        IndexModel([('fechaNacimiento', DESC), ('_id', DESC)]),
+        IndexModel([('clienteId', ASC), ('fechaNacimiento', DESC), ('_id', DESC)]),
+        IndexModel([('foto', ASC)], sparse=True),
+        IndexModel([('fotoMiniaturas.thumb', ASC)], sparse=True),
+        IndexModel([('fotoMiniaturas.card', ASC)], sparse=True),
+        IndexModel([('fotoMiniaturas.webp', ASC)], sparse=True),
+    ],
+    'appointments': [
+        IndexModel([('fecha', ASC), ('_id', ASC)]),
+        IndexModel([('estado', ASC), ('fecha', ASC), ('_id', ASC)]),
+        IndexModel([('veterinarioId', ASC), ('fecha', ASC), ('_id', ASC)]),
+        IndexModel([('clienteId', ASC), ('fecha', ASC), ('_id', ASC)]),
+        # Citas atendidas de una mascota, para recalcular su resumen clínico
+        IndexModel([('mascotaId', ASC), ('estado', ASC)]),
+        IndexModel([('comprobantePago', ASC)], sparse=True),
+        IndexModel([('comprobanteData.data', ASC)], sparse=True),
+    ],
+    'historial_clinico': [
+        IndexModel([('mascotaId', ASC), ('fecha', DESC), ('_id', DESC)]),
+    ],
+    'pre_citas': [
+        IndexModel([('fechaCreacion', DESC), ('_id', DESC)]),
+        IndexModel([('estado', ASC), ('fechaCreacion', DESC), ('_id', DESC)]),
+    ],
+    'notificaciones': [
+        IndexModel([('usuarioId', ASC), ('fechaCreacion', DESC), ('_id', DESC)]),
+        IndexModel([('usuarioId', ASC), ('leida', ASC), ('fechaCreacion', DESC), ('_id', DESC)]),
+    ],
+    'newsletter_suscriptores': [
+        IndexModel([('email', ASC)], unique=True),
+        IndexModel([('fechaSuscripcion', DESC), ('_id', DESC)]),
+        IndexModel([('activo', ASC), ('fechaSuscripcion', DESC), ('_id', DESC)]),
+        # Recorrido por cursor de los activos al encolar un envío (app/mailer.py)
+        IndexModel([('activo', ASC), ('_id', ASC)]),
+    ],
+    'newsletter_emails': [
+        IndexModel([('fechaEnvio', DESC), ('_id', DESC)]),
+        IndexModel([('estado', ASC), ('fechaEnvio', DESC), ('_id', DESC)]),
+    ],
+    'newsletter_entregas': [
+        IndexModel([('emailId', ASC), ('email', ASC)], unique=True),
+        IndexModel([('emailId', ASC), ('estado', ASC), ('_id', ASC)]),
+        IndexModel([('emailId', ASC), ('_id', ASC)]),
+    ],
+    # Un solo archivo de GridFS por contenido (GridFSBlobStore.put); las subidas
+    # a medias no tienen sha256 y quedan fuera
+    'blobs.files': [
+        IndexModel([('metadata.sha256', ASC)], unique=True, sparse=True),
+        # El mismo que crea GridFS en la primera subida (lectura por nombre)
+        IndexModel([('filename', ASC), ('uploadDate', ASC)]),
+    ],
+    # Trabajos en segundo plano (app/deletion.py)
+    'jobs': [
+        IndexModel([('tipo', ASC), ('usuarioId', ASC), ('fechaCreacion', DESC)]),
+        IndexModel([('tipo', ASC), ('estado', ASC)]),
+    ],
+}
+
+# Consulta canónica de cada ruta: (nombre, colección, filtro, orden)
+CANONICAL_QUERIES = [
+    ('users.list', 'users', {**NOT_DELETED}, [('_id', ASC)]),
+    ('users.list?rol', 'users', {**NOT_DELETED, 'rol': 'veterinario'}, [('_id', ASC)]),
+    ('users.search', 'users', {**NOT_DELETED, 'searchTokens': {'$all': ['gom', 'an']}}, None),
+    ('users.search?rol', 'users', {**NOT_DELETED, 'searchTokens': {'$all': ['gom']}, 'rol': 'veterinario'}, None),
+    ('auth.login', 'users', {'loginKeys': 'a@b.c', **NOT_DELETED}, None),
+    ('appointments.disponibilidad?vets', 'users', {'rol': 'veterinario', **NOT_DELETED}, None),
+    ('users.login_conflict', 'users', {'loginKeys': {'$in': ['a@b.c', 'ana', '34666123456']}}, None),
+    ('pets.list', 'pets', {}, [('fechaNacimiento', DESC), ('_id', DESC)]),
+    ('pets.list?clienteId', 'pets', {'clienteId': 'x'}, [('fechaNacimiento', DESC), ('_id', DESC)]),
+    ('appointments.list', 'appointments', {}, [('fecha', ASC), ('_id', ASC)]),
+    ('appointments.list?estado', 'appointments', {'estado': 'pendiente_pago'}, [('fecha', ASC), ('_id', ASC)]),
+    ('appointments.list?veterinarioId&fecha', 'appointments',
+     {'veterinarioId': 'x', 'fecha': {'$gte': datetime(2024, 1, 1, 5), '$lt': datetime(2025, 1, 1, 5)}},
+     [('fecha', ASC), ('_id', ASC)]),
+    ('appointments.list?clienteId&fecha', 'appointments',
+     {'clienteId': 'x', 'fecha': {'$gte': datetime(2024, 1, 1, 5), '$lt': datetime(2025, 1, 1, 5)}},
+     [('fecha', ASC), ('_id', ASC)]),
+    ('appointments.list?fecha', 'appointments',
+     {'fecha': {'$gte': datetime(2024, 5, 1, 5), '$lt': datetime(2024, 5, 2, 5)}}, [('fecha', ASC), ('_id', ASC)]),
+    ('users.resume_deletions', 'users', {'eliminadoEn': {'$exists': True}}, None),
+    ('users.delete_cascade?pets', 'pets', {'clienteId': {'$in': ['x']}}, None),
+    ('users.delete_cascade?appointments', 'appointments', {'clienteId': {'$in': ['x']}}, None),
+    ('users.delete_cascade?notificaciones', 'notificaciones', {'usuarioId': {'$in': ['x']}}, None),
+    ('users.delete_cascade?historial', 'historial_clinico', {'mascotaId': {'$in': ['x']}}, None),
+    ('appointments.agenda', 'appointments',
+     {'veterinarioId': {'$in': ['x', 'y']}, 'fecha': {'$gte': datetime(2024, 5, 1, 5), '$lt': datetime(2024, 5, 8, 5)},
+      'estado': {'$nin': ['cancelada', 'rechazada', 'expirada']}}, None),
+    ('historial.mascota', 'historial_clinico', {'mascotaId': 'x'}, [('fecha', DESC), ('_id', DESC)]),
+    ('historial.resumen?citas', 'appointments', {'mascotaId': 'x', 'estado': 'atendida', 'historialData': {'$ne': None}},
+     None),
+    ('precitas.list', 'pre_citas', {}, [('fechaCreacion', DESC), ('_id', DESC)]),
+    ('precitas.list?estado', 'pre_citas', {'estado': 'pendiente'}, [('fechaCreacion', DESC), ('_id', DESC)]),
+    ('notifications.list', 'notificaciones', {'usuarioId': 'x'}, [('fechaCreacion', DESC), ('_id', DESC)]),
+    ('notifications.list?leida', 'notificaciones', {'usuarioId': 'x', 'leida': False},
+     [('fechaCreacion', DESC), ('_id', DESC)]),
+    ('notifications.mark_all_read', 'notificaciones', {'usuarioId': 'x', 'leida': False}, None),
+    ('newsletter.suscriptores', 'newsletter_suscriptores', {}, [('fechaSuscripcion', DESC), ('_id', DESC)]),
+    ('newsletter.suscriptores?activo', 'newsletter_suscriptores', {'activo': True},
+     [('fechaSuscripcion', DESC), ('_id', DESC)]),
+    ('newsletter.email', 'newsletter_suscriptores', {'email': 'a@b.c'}, None),
+    ('newsletter.enqueue', 'newsletter_suscriptores', {'activo': True, '_id': {'$gt': ObjectId('0' * 24)}},
+     [('_id', ASC)]),
+    ('newsletter.pending', 'newsletter_entregas', {'emailId': ObjectId('0' * 24), 'estado': 'pendiente'},
+     [('_id', ASC)]),
+    ('newsletter.entregas', 'newsletter_entregas', {'emailId': ObjectId('0' * 24)}, [('_id', ASC)]),
+    ('newsletter.emails', 'newsletter_emails', {}, [('fechaEnvio', DESC), ('_id', DESC)]),
+    ('newsletter.emails?estado', 'newsletter_emails', {'estado': 'enviado'}, [('fechaEnvio', DESC), ('_id', DESC)]),
+    ('blobs.put', 'blobs.files', {'filename': '0' * 64}, None),
+    *((f'blobs.release?{collection}.{field}', collection, {field: {'$in': [blob_url('0' * 64)]}}, None)
+      for collection, fields in BLOB_FIELDS.items() for field in fields),
+]
+
+BAD_STAGES = {'COLLSCAN', 'SORT', 'SORT_KEY_GENERATOR'}
+
+
+def ensure_indexes(db):
+    """Crear los índices del registro; los existentes con la misma definición no cambian"""
+    created = {}
+    for collection, models in INDEXES.items():
+        created[collection] = db[collection].create_indexes(models)
+    return created
+
+
+def _plan_stages(plan):
+    if 'queryPlan' in plan:
+        # Motor SBE (MongoDB 7+): el árbol clásico va dentro de queryPlan
+        plan = plan['queryPlan']
+    yield plan.get('stage')
+    if 'inputStage' in plan:
+        yield from _plan_stages(plan['inputStage'])
+    for child in plan.get('inputStages', []):
+        yield from _plan_stages(child)
+
+
+def explain_query(db, collection, query, sort):
+    cursor = db[collection].find(query).limit(100)
+    if sort:
+        cursor = cursor.sort(sort)
+    plan = cursor.explain()['queryPlanner']['winningPlan']
+    return [s for s in _plan_stages(plan) if s]
+
+
+def verify_indexes(db):
+    """[(nombre, etapas, ok)] para cada consulta canónica"""
+    results = []
+    for name, collection, query, sort in CANONICAL_QUERIES:
+        stages = explain_query(db, collection, query, sort)
+        results.append((name, stages, not BAD_STAGES.intersection(stages)))
+    return results
+
+
+def init_indexes(app):
+    if app.config.get('MONGO_ENSURE_INDEXES'):
+        with app.app_context():
+            try:
+                ensure_indexes(get_db())
+            except OperationFailure:
+                app.logger.exception("could not create indexes")
+
+
+indexes_cli = AppGroup('indexes', help="Índices de MongoDB")
+
+
+@indexes_cli.command('apply')
+@with_appcontext
+def apply_command():
+    """Crear (de forma idempotente) todos los índices del registro"""
+    for collection, names in ensure_indexes(get_db()).items():
+        click.echo(f"{collection}: {', '.join(names)}")
+
+
+@indexes_cli.command('verify')
+@with_appcontext
+def verify_command():
+    """Fallar si alguna consulta canónica hace COLLSCAN o SORT en memoria"""
+    failed = 0
+    for name, stages, ok in verify_indexes(get_db()):
+        click.echo(f"{'ok  ' if ok else 'FAIL'} {name}: {' <- '.join(stages)}")
+        failed += not ok
+    if failed:
+        click.echo(f"{failed} consultas sin índice adecuado", err=True)
+        sys.exit(1)
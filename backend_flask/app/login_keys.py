@@ -0,0 +1,106 @@
+import re
+
+import click
+from flask.cli import AppGroup, with_appcontext
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from .db import get_db
+from .repository import NOT_DELETED
+
+# Campos de usuario con los que se puede iniciar sesión
+LOGIN_FIELDS = ('email', 'username', 'telefono')
+
+_PHONE_RE = re.compile(r'^\+?[\d\s\-().]+$')
+_NON_DIGITS = re.compile(r'\D')
+
+
+def normalize_identifier(value):
+    """Clave de login de un identificador: email/username en minúsculas,
+    teléfonos sólo con dígitos ("+34 666 123 456" -> "34666123456")"""
+    if not isinstance(value, str):
+        return None
+    value = value.strip()
+    if not value:
+        return None
+    if '@' not in value and _PHONE_RE.match(value):
+        digits = _NON_DIGITS.sub('', value)
+        if len(digits) >= 6:
+            return digits
+    return value.lower()
+
+
+def login_keys(doc):
+    """Claves `loginKeys` de un usuario, sin duplicados y en orden estable"""
+    keys = []
+    for field in LOGIN_FIELDS:
+        key = normalize_identifier(doc.get(field))
+        if key and key not in keys:
+            keys.append(key)
+    return keys
+
+
+def find_conflict(db, doc, exclude_id=None):
+    """Primer campo de login de `doc` que ya usa otro usuario, o None"""
+    keys = login_keys(doc)
+    if not keys:
+        return None
+    q = {"loginKeys": {"$in": keys}}
+    if exclude_id is not None:
+        q["_id"] = {"$ne": exclude_id}
+    existing = db.users.find_one(q, {"loginKeys": 1})
+    if not existing:
+        return None
+    taken = set(existing.get('loginKeys', []))
+    for field in LOGIN_FIELDS:
+        if normalize_identifier(doc.get(field)) in taken:
+            return field
+    return LOGIN_FIELDS[0]
+
+
+def duplicate_field(error):
+    """Campo de login de un DuplicateKeyError: otro alta lo ocupó entre
+    find_conflict y la escritura"""
+    pattern = (error.details or {}).get('keyPattern') or {}
+    for field in LOGIN_FIELDS:
+        if field in pattern:
+            return field
+    return LOGIN_FIELDS[0]
+
+
+users_cli = AppGroup('users', help="Mantenimiento de usuarios")
+
+
+@users_cli.command('backfill-login-keys')
+@click.option('--batch-size', default=500, show_default=True)
+@with_appcontext
+def backfill_login_keys_command(batch_size):
+    """Normalizar email y calcular loginKeys de los usuarios existentes"""
+    db = get_db()
+    projection = {f: 1 for f in LOGIN_FIELDS}
+    ops = []
+    updated = conflicts = 0
+
+    def flush():
+        nonlocal updated, conflicts
+        if not ops:
+            return
+        try:
+            updated += db.users.bulk_write(ops, ordered=False).modified_count
+        except BulkWriteError as e:
+            updated += e.details.get('nModified', 0)
+            for err in e.details.get('writeErrors', []):
+                conflicts += 1
+                click.echo(f"conflicto en {err['op']['q']['_id']}: {err['errmsg']}", err=True)
+        ops.clear()
+
+    # Los usuarios marcados como borrados no recuperan sus claves de login
+    for doc in db.users.find(NOT_DELETED, projection).batch_size(batch_size):
+        update = {"loginKeys": login_keys(doc)}
+        if isinstance(doc.get('email'), str):
+            update['email'] = doc['email'].strip().lower()
+        ops.append(UpdateOne({"_id": doc['_id'], **NOT_DELETED}, {"$set": update}))
+        if len(ops) >= batch_size:
+            flush()
+    flush()
+    click.echo(f"{updated} usuarios actualizados, {conflicts} conflictos")
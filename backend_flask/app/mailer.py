@@ -0,0 +1,269 @@
+import asyncio
+import logging
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+import aiosmtplib
+import click
+from bson import ObjectId
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+
+from .db import get_db
+
+logger = logging.getLogger(__name__)
+
+# Estados de un envío (newsletter_emails) que aún tienen trabajo pendiente
+CAMPAIGN_STATES_OPEN = ('en_cola', 'enviando')
+# Espera antes del siguiente lote si en el anterior no salió ningún mensaje
+RETRY_BACKOFF_SECONDS = 5
+
+_TAG_RE = re.compile(r'<[^>]+>')
+
+_executor = None
+_executor_pid = None
+_lock = threading.Lock()
+
+
+def _get_executor(app):
+    global _executor, _executor_pid
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _lock:
+            if _executor is None or _executor_pid != pid:
+                _executor = ThreadPoolExecutor(max_workers=app.config['NEWSLETTER_WORKERS'],
+                                               thread_name_prefix='newsletter')
+                _executor_pid = pid
+    return _executor
+
+
+class SMTPPool:
+    """Conexiones SMTP reutilizables compartidas por las tareas de un envío"""
+
+    def __init__(self, cfg):
+        self.cfg = cfg
+        self.size = cfg['NEWSLETTER_SMTP_CONNECTIONS']
+        # Un permiso por conexión en uso: si una falla, el permiso vuelve y
+        # la siguiente tarea en espera abre otra
+        self._slots = asyncio.Semaphore(self.size)
+        self._idle = []
+
+    async def _connect(self):
+        cfg = self.cfg
+        client = aiosmtplib.SMTP(hostname=cfg['SMTP_HOST'], port=cfg['SMTP_PORT'],
+                                 start_tls=cfg['SMTP_STARTTLS'], timeout=cfg['SMTP_TIMEOUT'])
+        await client.connect()
+        if cfg['SMTP_USER']:
+            await client.login(cfg['SMTP_USER'], cfg['SMTP_PASSWORD'])
+        return client
+
+    async def send(self, message):
+        async with self._slots:
+            client = self._idle.pop() if self._idle else await self._connect()
+            try:
+                await client.send_message(message)
+            except BaseException:
+                # Tras un error la sesión puede quedar a medias: se descarta
+                client.close()
+                raise
+            self._idle.append(client)
+
+    async def close(self):
+        while self._idle:
+            client = self._idle.pop()
+            try:
+                await client.quit()
+            except aiosmtplib.SMTPException:
+                client.close()
+
+
+class RateLimiter:
+    """Como mucho `rate` envíos por segundo, repartidos de forma uniforme (0 = sin límite)"""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate > 0 else 0
+        self._next = 0.0
+
+    async def wait(self):
+        if not self.interval:
+            return
+        now = asyncio.get_running_loop().time()
+        slot = max(now, self._next)
+        self._next = slot + self.interval
+        if slot > now:
+            await asyncio.sleep(slot - now)
+
+
+def build_message(campaign, to, cfg):
+    msg = EmailMessage()
+    msg['Subject'] = campaign['asunto']
+    msg['From'] = cfg['NEWSLETTER_FROM']
+    msg['To'] = to
+    if cfg['NEWSLETTER_UNSUBSCRIBE_URL']:
+        msg['List-Unsubscribe'] = f"<{cfg['NEWSLETTER_UNSUBSCRIBE_URL'].format(email=to)}>"
+    html = campaign['contenido']
+    msg.set_content(_TAG_RE.sub('', html))
+    msg.add_alternative(html, subtype='html')
+    return msg
+
+
+async def _deliver_one(pool, limiter, campaign, entrega, cfg):
+    """(estado, error) de un destinatario: enviado, fallido (permanente) o pendiente (reintentar)"""
+    await limiter.wait()
+    try:
+        await pool.send(build_message(campaign, entrega['email'], cfg))
+        return 'enviado', None
+    except aiosmtplib.SMTPRecipientsRefused as e:
+        # 4xx en RCPT (buzón lleno, greylisting) también se reintenta
+        permanent = all(r.code >= 500 for r in e.recipients)
+        return ('fallido' if permanent else 'pendiente'), str(e)
+    except aiosmtplib.SMTPResponseException as e:
+        return ('fallido' if e.code >= 500 else 'pendiente'), str(e)
+    except (aiosmtplib.SMTPException, OSError) as e:
+        return 'pendiente', str(e)
+
+
+def enqueue_recipients(db, campaign):
+    """Crear una entrega pendiente por suscriptor activo, recorriendo por cursor en lotes.
+
+    Se reanuda desde `ultimoSuscriptor`; las entregas ya creadas no se duplican.
+    """
+    cfg = current_app.config
+    batch_size = cfg['NEWSLETTER_BATCH_SIZE']
+    last = campaign.get('ultimoSuscriptor')
+    while True:
+        q = {"activo": True}
+        if last is not None:
+            q['_id'] = {"$gt": last}
+        batch = list(db.newsletter_suscriptores.find(q, {"email": 1}).sort('_id', 1).limit(batch_size))
+        if not batch:
+            break
+        ops = [UpdateOne(
+            {"emailId": campaign['_id'], "email": s['email']},
+            {"$setOnInsert": {"suscriptorId": s['_id'], "estado": "pendiente", "intentos": 0}},
+            upsert=True,
+        ) for s in batch]
+        res = db.newsletter_entregas.bulk_write(ops, ordered=False)
+        last = batch[-1]['_id']
+        db.newsletter_emails.update_one({"_id": campaign['_id']}, {
+            "$set": {"ultimoSuscriptor": last},
+            "$inc": {"totalDestinatarios": res.upserted_count},
+        })
+    db.newsletter_emails.update_one({"_id": campaign['_id']}, {"$set": {"encolado": True}})
+
+
+def _claim(db, email_id, lease):
+    """Tomar el envío si nadie lo tiene (o su lease caducó) y devolverlo"""
+    now = datetime.utcnow()
+    return db.newsletter_emails.find_one_and_update(
+        {"_id": email_id, "estado": {"$in": CAMPAIGN_STATES_OPEN},
+         "$or": [{"leaseHasta": None}, {"leaseHasta": {"$lt": now}}]},
+        {"$set": {"estado": "enviando", "leaseHasta": now + lease}},
+        projection={"destinatarios": 0},
+    )
+
+
+async def _deliver(db, campaign, cfg):
+    email_id = campaign['_id']
+    lease = timedelta(seconds=cfg['NEWSLETTER_LEASE_SECONDS'])
+    pool = SMTPPool(cfg)
+    limiter = RateLimiter(cfg['NEWSLETTER_RATE_PER_SEC'])
+    try:
+        while True:
+            batch = list(db.newsletter_entregas.find(
+                {"emailId": email_id, "estado": "pendiente"}, {"email": 1, "intentos": 1},
+            ).sort('_id', 1).limit(cfg['NEWSLETTER_BATCH_SIZE']))
+            if not batch:
+                return
+            results = await asyncio.gather(*(_deliver_one(pool, limiter, campaign, e, cfg) for e in batch))
+
+            now = datetime.utcnow()
+            ops = []
+            sent = failed = 0
+            for entrega, (estado, error) in zip(batch, results):
+                attempts = entrega.get('intentos', 0) + 1
+                if estado == 'pendiente' and attempts >= cfg['NEWSLETTER_MAX_ATTEMPTS']:
+                    estado = 'fallido'
+                sent += estado == 'enviado'
+                failed += estado == 'fallido'
+                update = {"estado": estado, "intentos": attempts, "fechaIntento": now}
+                if estado == 'enviado':
+                    update['fechaEnvio'] = now
+                if error:
+                    update['error'] = error
+                ops.append(UpdateOne({"_id": entrega['_id']}, {"$set": update}))
+            try:
+                db.newsletter_entregas.bulk_write(ops, ordered=False)
+            except BulkWriteError:
+                logger.exception("could not record newsletter deliveries for %s", email_id)
+            db.newsletter_emails.update_one({"_id": email_id}, {
+                "$inc": {"totalEnviados": sent, "totalFallidos": failed},
+                "$set": {"leaseHasta": now + lease},
+            })
+            if not sent and sent + failed < len(batch):
+                # Servidor SMTP caído o saturado: no agotar los intentos de golpe
+                await asyncio.sleep(RETRY_BACKOFF_SECONDS)
+    finally:
+        await pool.close()
+
+
+def run_campaign(email_id):
+    """Encolar y enviar un newsletter hasta terminar; False si otro proceso lo tiene"""
+    db = get_db()
+    cfg = current_app.config
+    campaign = _claim(db, email_id, timedelta(seconds=cfg['NEWSLETTER_LEASE_SECONDS']))
+    if campaign is None:
+        return False
+    if not campaign.get('encolado'):
+        enqueue_recipients(db, campaign)
+    asyncio.run(_deliver(db, campaign, cfg))
+    db.newsletter_emails.update_one({"_id": email_id}, {
+        "$set": {"estado": "enviado", "fechaFin": datetime.utcnow()},
+        "$unset": {"leaseHasta": ""},
+    })
+    return True
+
+
+def schedule_campaign(email_id):
+    app = current_app._get_current_object()
+
+    def run():
+        with app.app_context():
+            try:
+                run_campaign(email_id)
+            except Exception as e:
+                logger.exception("newsletter %s failed", email_id)
+                # El lease se conserva: `flask newsletter resume` lo retoma al caducar
+                get_db().newsletter_emails.update_one({"_id": email_id}, {"$set": {"error": str(e)}})
+
+    _get_executor(app).submit(run)
+
+
+newsletter_cli = AppGroup('newsletter', help="Envío de newsletters")
+
+
+@newsletter_cli.command('send')
+@click.argument('email_id')
+@with_appcontext
+def send_command(email_id):
+    """Enviar (de forma síncrona) un newsletter en cola"""
+    if not run_campaign(ObjectId(email_id)):
+        click.echo("el envío no está en cola o lo tiene otro proceso", err=True)
+
+
+@newsletter_cli.command('resume')
+@with_appcontext
+def resume_command():
+    """Retomar los envíos interrumpidos (con el lease caducado)"""
+    db = get_db()
+    resumed = 0
+    for campaign in db.newsletter_emails.find({"estado": {"$in": CAMPAIGN_STATES_OPEN}}, {"_id": 1}):
+        if run_campaign(campaign['_id']):
+            resumed += 1
+    click.echo(f"{resumed} envíos completados")
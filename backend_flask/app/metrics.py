@@ -0,0 +1,125 @@
+import functools
+import hmac
+import os
+import time
+
+from flask import Blueprint, Response, current_app, g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+                               generate_latest, multiprocess)
+from pymongo import monitoring
+
+# Métricas en formato Prometheus (GET /metrics). Con varios workers (gunicorn)
+# cada proceso escribe sus valores en PROMETHEUS_MULTIPROC_DIR y /metrics los
+# suma todos; sin esa variable (python -m app) son las del propio proceso.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+SIZE_BUCKETS = tuple(64 * 4 ** i for i in range(10))  # 64 B .. 16 MB
+
+REQUEST_LATENCY = Histogram('petla_http_request_duration_seconds', "Duración de las peticiones HTTP",
+                            ('blueprint', 'endpoint', 'method', 'status'), buckets=LATENCY_BUCKETS)
+REQUESTS_IN_FLIGHT = Gauge('petla_http_requests_in_flight', "Peticiones HTTP en curso", ('blueprint',),
+                           multiprocess_mode='livesum')
+REQUEST_SIZE = Histogram('petla_http_request_size_bytes', "Tamaño del cuerpo de las peticiones",
+                         ('blueprint', 'endpoint'), buckets=SIZE_BUCKETS)
+RESPONSE_SIZE = Histogram('petla_http_response_size_bytes', "Tamaño del cuerpo de las respuestas (sin streaming)",
+                          ('blueprint', 'endpoint'), buckets=SIZE_BUCKETS)
+MONGO_LATENCY = Histogram('petla_mongodb_command_duration_seconds', "Duración de los comandos de MongoDB",
+                          ('collection', 'command'), buckets=LATENCY_BUCKETS)
+MONGO_FAILURES = Counter('petla_mongodb_command_failures_total', "Comandos de MongoDB fallidos",
+                         ('collection', 'command'))
+
+# Comandos de servidor o de sesión: no van sobre una colección
+_NO_COLLECTION = frozenset({'ping', 'hello', 'isMaster', 'ismaster', 'buildInfo', 'buildinfo', 'endSessions',
+                            'listCollections', 'listDatabases', 'dropDatabase', 'serverStatus', 'explain'})
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """Latencia y fallos de cada comando de Mongo por colección y operación.
+
+    La colección sólo viene en el evento de inicio: se guarda por request_id
+    hasta que llega el de fin (los ids son únicos por proceso)
+    """
+
+    def __init__(self):
+        self._pending = {}
+
+    def started(self, event):
+        name = event.command_name
+        if name in _NO_COLLECTION:
+            collection = ''
+        elif name == 'getMore':
+            collection = event.command.get('collection', '')
+        else:
+            collection = event.command.get(name, '')
+        self._pending[event.request_id] = collection if isinstance(collection, str) else ''
+
+    def succeeded(self, event):
+        collection = self._pending.pop(event.request_id, '')
+        _child(MONGO_LATENCY, collection, event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        collection = self._pending.pop(event.request_id, '')
+        _child(MONGO_LATENCY, collection, event.command_name).observe(event.duration_micros / 1e6)
+        _child(MONGO_FAILURES, collection, event.command_name).inc()
+
+
+command_metrics = CommandMetrics()
+_registered = False
+
+metrics_bp = Blueprint('metrics', __name__)
+
+
+@metrics_bp.get('/metrics')
+def metrics():
+    """Exposición de texto de Prometheus, sumando todos los workers"""
+    # Revela rutas, volúmenes y colecciones: sólo con METRICS_TOKEN configurado
+    expected = current_app.config.get('METRICS_TOKEN')
+    if not expected:
+        return {"error": "Not found"}, 404
+    header = request.headers.get('Authorization', '')
+    if not hmac.compare_digest(header.encode(), f"Bearer {expected}".encode()):
+        return {"error": "Authentication required"}, 401
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+
+@functools.lru_cache(maxsize=4096)
+def _child(metric, *labels):
+    """Serie de una métrica por etiquetas; `labels()` valida y bloquea en cada llamada"""
+    return metric.labels(*labels)
+
+
+def _start_request():
+    g.metrics_start = time.perf_counter()
+    _child(REQUESTS_IN_FLIGHT, request.blueprint or '').inc()
+
+
+def _end_request(response):
+    start = g.pop('metrics_start', None)
+    if start is None:
+        return response
+    blueprint, endpoint = request.blueprint or '', request.endpoint or 'unmatched'
+    _child(REQUESTS_IN_FLIGHT, blueprint).dec()
+    _child(REQUEST_LATENCY, blueprint, endpoint, request.method, str(response.status_code)).observe(
+        time.perf_counter() - start)
+    if request.content_length:
+        _child(REQUEST_SIZE, blueprint, endpoint).observe(request.content_length)
+    if response.content_length is not None:
+        _child(RESPONSE_SIZE, blueprint, endpoint).observe(response.content_length)
+    return response
+
+
+def init_metrics(app):
+    """Instrumentación HTTP y de Mongo; se llama antes que los demás before_request
+    para contar también las peticiones que corta la autenticación"""
+    global _registered
+    # Global de pymongo: lo recogen los clientes creados después (db._create_client)
+    if not _registered:
+        monitoring.register(command_metrics)
+        _registered = True
+    app.before_request(_start_request)
+    app.after_request(_end_request)
+    app.register_blueprint(metrics_bp)
@@ -0,0 +1,84 @@
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+
+from .utils.projection import HIDDEN_FIELDS, include_fields
+
+
+# Usuarios sin marca de borrado (app/deletion.py): las lecturas de usuarios filtran por esto
+NOT_DELETED = {"eliminadoEn": {"$exists": False}}
+
+# Colecciones con lecturas condicionales (ETag): cada escritura sube `version`
+# y fija `fechaActualizacion` (Last-Modified)
+VERSIONED = {'users', 'pets', 'appointments', 'historial_clinico', 'pre_citas'}
+
+
+def id_filter(id):
+    """Filtro por `_id` si es un ObjectId válido; si no, por el campo `id` antiguo"""
+    if isinstance(id, ObjectId):
+        return {"_id": id}
+    if isinstance(id, str) and ObjectId.is_valid(id):
+        return {"_id": ObjectId(id)}
+    return {"id": id}
+
+
+def _projection(collection, projection):
+    if projection is not None:
+        return projection
+    return {f: 0 for f in HIDDEN_FIELDS.get(collection.name, [])} or None
+
+
+def versioned(collection, update):
+    """`update` con el $inc de `version` y la fecha de actualización si la colección es versionada"""
+    if collection.name not in VERSIONED:
+        return update
+    return {
+        **update,
+        "$set": {"fechaActualizacion": datetime.utcnow(), **update.get("$set", {})},
+        "$inc": {**update.get("$inc", {}), "version": 1},
+    }
+
+
+def find_by_id(collection, id, projection=None, query=None):
+    """Documento por id (ObjectId o id antiguo) o None. `query` añade condiciones al filtro"""
+    return collection.find_one({**id_filter(id), **(query or {})}, _projection(collection, projection))
+
+
+def update_by_id(collection, id, update, projection=None, query=None):
+    """Aplicar `update` y devolver el documento ya actualizado en un solo viaje; None si no existe"""
+    return collection.find_one_and_update(
+        {**id_filter(id), **(query or {})}, versioned(collection, update),
+        projection=_projection(collection, projection),
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+def delete_by_id(collection, id, projection=None):
+    """Borrar por id y devolver el documento borrado (por defecto sólo `_id`), o None"""
+    return collection.find_one_and_delete(id_filter(id), projection=projection or {"_id": 1})
+
+
+def set_by_id(collection, id, fields, projection=None, needed=()):
+    """$set de `fields` devolviendo (antes, después) en un solo viaje; (None, None) si no existe.
+
+    `después` se obtiene aplicando `fields` a la imagen previa y se recorta a
+    `projection`; los campos de `needed` siempre vienen en `antes` (para
+    contadores, agenda...).
+    """
+    update = versioned(collection, {"$set": fields})
+    projection = _projection(collection, projection)
+    inclusion = bool(projection) and any(v for v in projection.values())
+    if inclusion:
+        requested = {k.split('.', 1)[0] for k in projection} | {'_id'}
+        projection = include_fields(projection, (*needed, *update.get("$inc", {})))
+    before = collection.find_one_and_update(id_filter(id), update, projection=projection,
+                                            return_document=ReturnDocument.BEFORE)
+    if before is None:
+        return None, None
+    after = {**before, **update["$set"]}
+    for field, step in update.get("$inc", {}).items():
+        after[field] = before.get(field, 0) + step
+    if inclusion:
+        after = {k: v for k, v in after.items() if k in requested}
+    return before, after
@@ -1,11 +1,22 @@
 from flask import Blueprint, request, current_app
-from bson import ObjectId
-from werkzeug.utils import secure_filename
-import os
-import base64
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from ..db import get_db
+from ..repository import find_by_id, update_by_id, delete_by_id, id_filter, set_by_id
+from ..counters import record
+from ..clinical import record_atencion
+from ..availability import (FREE_STATES, BatchReservation, agenda_key, check_same_day, duration_of, get_agendas,
+                            invalidate, parse_duration, reserve, slot_label, working_hours)
+from ..dates import coerce_dates, range_filter, to_local
+from ..deletion import NOT_DELETED
+from ..events import publish
+from ..security import allowed
 from ..utils.helpers import serialize_doc
+from ..utils.conditional import conditional_response, find_conditional
+from ..storage import save_upload, store_data_url
+from ..utils.pagination import paginate
+from ..utils.projection import doc_projection, list_projection
+from ..utils.streaming import stream_docs, wants_stream
+from ..utils.bulk import bulk_items, requires, run_bulk
 
 appts_bp = Blueprint('appointments', __name__)
 
@@ -28,50 +39,58 @@ def list_appointments():
     if cliente_id:
         q['clienteId'] = cliente_id
     
-    # Filtros de fecha si se proporcionan
-    if fecha_desde or fecha_hasta:
-        date_filter = {}
-        if fecha_desde:
-            date_filter['$gte'] = fecha_desde
-        if fecha_hasta:
-            date_filter['$lte'] = fecha_hasta
-        if date_filter:
-            q['fecha'] = date_filter
-    
-    docs = [serialize_doc(d) for d in db.appointments.find(q).sort('fecha', 1).limit(500)]
-    return {"success": True, "data": docs}
+    # Filtros de fecha si se proporcionan (rango sobre el índice de veterinario/cliente + fecha)
+    try:
+        date_filter = range_filter(fecha_desde, fecha_hasta)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    if date_filter:
+        q['fecha'] = date_filter
+    
+    projection = list_projection('appointments')
+    if wants_stream():
+        return stream_docs(db.appointments, q, [('fecha', 1)], projection=projection)
+    docs, next_cursor = paginate(db.appointments, q, [('fecha', 1)], default_limit=500, projection=projection)
+    return {"success": True, "data": [serialize_doc(d) for d in docs], "nextCursor": next_cursor}
 
 @appts_bp.get('/<id>')
 def get_appointment(id: str):
     db = get_db()
-    try:
-        doc = db.appointments.find_one({"_id": ObjectId(id)})
-    except:
-        doc = db.appointments.find_one({"id": id})
+    doc, validators = find_conditional(db.appointments, id, doc_projection('appointments'))
     
     if not doc:
         return {"error": "Appointment not found"}, 404
-    return {"success": True, "data": serialize_doc(doc)}
+    return conditional_response({"success": True, "data": serialize_doc(doc)}, validators)
 
-@appts_bp.post('')
-def create_appointment():
-    db = get_db()
-    data = request.get_json(force=True)
-    
-    # Validaciones requeridas
+def _store_comprobantes(data):
+    """Pasar al almacén de blobs los comprobantes en línea de `data` (en sitio)"""
+    if data.get('comprobantePago'):
+        data['comprobantePago'] = store_data_url(data['comprobantePago'])
+    comprobante = data.get('comprobanteData')
+    if isinstance(comprobante, dict) and comprobante.get('data'):
+        comprobante['data'] = store_data_url(comprobante['data'])
+    return data
+
+def _build_cita(data):
+    """Documento de cita nuevo; ValueError si falta un campo requerido o no es válido"""
     required_fields = ['mascota', 'fecha', 'motivo', 'tipoConsulta']
     for field in required_fields:
         if not data.get(field):
-            return {"error": f"{field} required"}, 400
+            raise ValueError(f"{field} required")
+    fecha = coerce_dates('appointments', {"fecha": data['fecha']})['fecha']
+    duracion = parse_duration(data.get('duracionMinutos'))
+    check_same_day(to_local(fecha), duracion or duration_of({}))
+    _store_comprobantes(data)
     
     # Estructura compatible con AppContext del frontend
-    cita_doc = {
+    return {
         "mascota": data['mascota'],  # nombre de la mascota
         "mascotaId": data.get('mascotaId'),
         "especie": data.get('especie', ''),
         "clienteId": data.get('clienteId'),
         "clienteNombre": data.get('clienteNombre'),
-        "fecha": data['fecha'],
+        "fecha": fecha,
+        "duracionMinutos": duracion,
         "estado": data.get('estado', 'pendiente_pago'),
         "veterinario": data.get('veterinario', ''),
         "veterinarioId": data.get('veterinarioId'),
@@ -85,9 +104,115 @@ def create_appointment():
         "notasAdmin": data.get('notasAdmin'),
         "fechaCreacion": datetime.utcnow(),
     }
+
+# Campos que deciden el hueco que ocupa una cita en la agenda
+SLOT_FIELDS = ('fecha', 'veterinarioId', 'duracionMinutos', 'estado')
+# Imagen previa que se lee al escribir: agenda, contadores, destinatarios de eventos y resumen clínico
+IMAGE_FIELDS = SLOT_FIELDS + ('clienteId', 'mascotaId')
+
+def _slot(doc):
+    """(veterinarioId, fecha local) si la cita ocupa hueco en la agenda, o None"""
+    fecha = to_local(doc.get('fecha'))
+    if not doc.get('veterinarioId') or fecha is None or doc.get('estado') in FREE_STATES:
+        return None
+    return doc['veterinarioId'], fecha
+
+def _publish_estado(doc):
+    """Avisar por SSE al cliente y al veterinario de la cita de su estado actual"""
+    publish([doc.get('clienteId'), doc.get('veterinarioId')], 'cita',
+            {"id": str(doc['_id']), "estado": doc.get('estado')})
+
+def _set_estado(db, id, update_data):
+    """Aplicar un cambio de estado en un solo viaje, ajustando contadores, agenda, eventos y resumen clínico.
+
+    Devuelve la cita ya actualizada o None si no existe.
+    """
+    before, after = set_by_id(db.appointments, id, update_data, doc_projection('appointments'),
+                              needed=IMAGE_FIELDS)
+    if before is None:
+        return None
+    record(db, 'appointments', [(before, {**before, **update_data})])
+    if before.get('estado') != update_data.get('estado', before.get('estado')):
+        invalidate(db, [before])
+    _publish_estado({**before, **update_data})
+    if update_data.get('historialData'):
+        record_atencion(db, {**before, **update_data})
+    return after
+
+def _estado_update(data):
+    estado = data.get('estado') or data.get('status')
+    if not estado:
+        raise ValueError("estado required")
+    
+    update_data = {
+        "estado": estado,
+        "fechaActualizacion": datetime.utcnow()
+    }
+    
+    # Agregar notas del admin si se proporcionan
+    if data.get('notasAdmin'):
+        update_data['notasAdmin'] = data['notasAdmin']
+    return update_data
+
+def _validar_pago_update(data):
+    valid = data.get('valid')
+    notas = data.get('notasAdmin')
+    
+    if valid is None:
+        raise ValueError("valid field required")
+    
+    new_status = 'aceptada' if valid else 'rechazada'
+    update_data = {
+        "estado": new_status,
+        "fechaActualizacion": datetime.utcnow()
+    }
     
-    res = db.appointments.insert_one(cita_doc)
-    cita_doc['_id'] = res.inserted_id
+    if notas:
+        update_data['notasAdmin'] = notas
+    return update_data
+
+def _atender_update(data):
+    update_data = {
+        "estado": "atendida",
+        "fechaActualizacion": datetime.utcnow()
+    }
+    
+    # Si hay datos del historial clínico, los guardamos
+    if data.get('historialData'):
+        update_data['historialData'] = data['historialData']
+    
+    # Notas adicionales del veterinario
+    if data.get('notas'):
+        update_data['notas'] = data['notas']
+    return update_data
+
+@appts_bp.post('')
+def create_appointment():
+    db = get_db()
+    data = request.get_json(force=True)
+    
+    try:
+        cita_doc = _build_cita(data)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    
+    slot = _slot(cita_doc)
+    if slot is None:
+        db.appointments.insert_one(cita_doc)
+        record(db, 'appointments', [(None, cita_doc)])
+        _publish_estado(cita_doc)
+        return {"success": True, "data": serialize_doc(cita_doc)}, 201
+    
+    # Insertar sólo si el veterinario tiene libre ese hueco
+    _, conflict = reserve(
+        db, *slot, duration_of(cita_doc),
+        write=lambda: str(db.appointments.insert_one(cita_doc).inserted_id),
+        undo=lambda doc_id: delete_by_id(db.appointments, doc_id),
+    )
+    if conflict:
+        return {"error": "Slot not available", "conflictoId": conflict}, 409
+    record(db, 'appointments', [(None, cita_doc)])
+    _publish_estado(cita_doc)
     return {"success": True, "data": serialize_doc(cita_doc)}, 201
 
 @appts_bp.put('/<id>')
@@ -95,33 +220,74 @@ def update_appointment(id: str):
     db = get_db()
     data = request.get_json(force=True)
     
+    # Cambiar el estado aquí pide los mismos roles que PUT /<id>/estado
+    if 'estado' in data and not allowed('appointments.update_estado'):
+        return {"error": "Forbidden"}, 403
+    
+    try:
+        coerce_dates('appointments', data)
+        if 'duracionMinutos' in data:
+            data['duracionMinutos'] = parse_duration(data['duracionMinutos'])
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    _store_comprobantes(data)
+    
     # Añadir timestamp de actualización
     update_data = {**data, "fechaActualizacion": datetime.utcnow()}
+    projection = doc_projection('appointments')
     
-    try:
-        result = db.appointments.update_one({"_id": ObjectId(id)}, {"$set": update_data})
-        if result.matched_count == 0:
+    if not any(f in data for f in SLOT_FIELDS):
+        doc = update_by_id(db.appointments, id, {"$set": update_data}, projection)
+        if not doc:
             return {"error": "Appointment not found"}, 404
-        doc = db.appointments.find_one({"_id": ObjectId(id)})
-    except:
-        result = db.appointments.update_one({"id": id}, {"$set": update_data})
-        if result.matched_count == 0:
-            return {"error": "Appointment not found"}, 404
-        doc = db.appointments.find_one({"id": id})
+        return {"success": True, "data": serialize_doc(doc)}
     
-    return {"success": True, "data": serialize_doc(doc)}
+    # Reprogramación: comprobar el hueco nuevo y liberar el anterior
+    current = find_by_id(db.appointments, id, {f: 1 for f in IMAGE_FIELDS})
+    if not current:
+        return {"error": "Appointment not found"}, 404
+    slot = _slot({**current, **update_data})
+    if slot is not None and ('fecha' in data or 'duracionMinutos' in data):
+        try:
+            check_same_day(slot[1], duration_of({**current, **update_data}))
+        except ValueError as e:
+            return {"error": str(e)}, 400
+    written = {}
+    
+    def write():
+        written['doc'] = update_by_id(db.appointments, current['_id'], {"$set": update_data}, projection)
+        return str(current['_id'])
+    
+    def undo(doc_id):
+        changed = [f for f in SLOT_FIELDS if f in data]
+        restore = {"$set": {f: current[f] for f in changed if f in current}}
+        unset = {f: "" for f in changed if f not in current}
+        if unset:
+            restore["$unset"] = unset
+        update_by_id(db.appointments, current['_id'], {k: v for k, v in restore.items() if v})
+    
+    if slot is None:
+        write()
+    else:
+        _, conflict = reserve(db, *slot, duration_of({**current, **update_data}), write, undo,
+                              exclude=str(current['_id']))
+        if conflict:
+            return {"error": "Slot not available", "conflictoId": conflict}, 409
+    invalidate(db, [current])
+    record(db, 'appointments', [(current, {**current, **update_data})])
+    if 'estado' in data:
+        _publish_estado({**current, **update_data})
+    
+    return {"success": True, "data": serialize_doc(written['doc'])}
 
 @appts_bp.delete('/<id>')
 def delete_appointment(id: str):
     db = get_db()
-    try:
-        result = db.appointments.delete_one({"_id": ObjectId(id)})
-        if result.deleted_count == 0:
-            return {"error": "Appointment not found"}, 404
-    except:
-        result = db.appointments.delete_one({"id": id})
-        if result.deleted_count == 0:
-            return {"error": "Appointment not found"}, 404
+    doc = delete_by_id(db.appointments, id, {f: 1 for f in SLOT_FIELDS})
+    if not doc:
+        return {"error": "Appointment not found"}, 404
+    invalidate(db, [doc])
+    record(db, 'appointments', [(doc, None)])
     
     return {"success": True, "message": "Appointment deleted successfully"}
 
@@ -129,29 +295,14 @@ def delete_appointment(id: str):
 def update_estado(id: str):
     db = get_db()
     data = request.get_json(force=True)
-    estado = data.get('estado') or data.get('status')
-    if not estado:
-        return {"error": "estado required"}, 400
-    
-    update_data = {
-        "estado": estado,
-        "fechaActualizacion": datetime.utcnow()
-    }
-    
-    # Agregar notas del admin si se proporcionan
-    if data.get('notasAdmin'):
-        update_data['notasAdmin'] = data['notasAdmin']
-    
     try:
-        result = db.appointments.update_one({"_id": ObjectId(id)}, {"$set": update_data})
-        if result.matched_count == 0:
-            return {"error": "Appointment not found"}, 404
-        doc = db.appointments.find_one({"_id": ObjectId(id)})
-    except:
-        result = db.appointments.update_one({"id": id}, {"$set": update_data})
-        if result.matched_count == 0:
-            return {"error": "Appointment not found"}, 404
-        doc = db.appointments.find_one({"id": id})
+        update_data = _estado_update(data)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    
+    doc = _set_estado(db, id, update_data)
+    if not doc:
+        return {"error": "Appointment not found"}, 404
     
     return {"success": True, "data": serialize_doc(doc)}
 
@@ -163,15 +314,15 @@ def upload_comprobante(id: str):
         if f.filename == '':
             return {"error": "No file selected"}, 400
         
-        # Convertir a base64 para compatibilidad
-        file_data = f.read()
-        base64_data = base64.b64encode(file_data).decode('utf-8')
+        # Guardar por trozos en el almacén de blobs; la cita sólo guarda la URL
+        blob = save_upload(f)
         
         comprobante_data = {
             "id": id,
-            "data": f"data:{f.content_type};base64,{base64_data}",
+            "data": blob['url'],
+            "blob": blob['sha256'],
             "originalName": f.filename,
-            "size": len(file_data),
+            "size": blob['size'],
             "type": f.content_type,
             "timestamp": int(datetime.utcnow().timestamp() * 1000)
         }
@@ -181,6 +332,8 @@ def upload_comprobante(id: str):
         comprobante_data = data.get('comprobanteData')
         if not comprobante_data:
             return {"error": "file or comprobanteData required"}, 400
+        if comprobante_data.get('data'):
+            comprobante_data['data'] = store_data_url(comprobante_data['data'])
     
     db = get_db()
     update_data = {
@@ -190,16 +343,9 @@ def upload_comprobante(id: str):
         "fechaActualizacion": datetime.utcnow()
     }
     
-    try:
-        result = db.appointments.update_one({"_id": ObjectId(id)}, {"$set": update_data})
-        if result.matched_count == 0:
-            return {"error": "Appointment not found"}, 404
-        doc = db.appointments.find_one({"_id": ObjectId(id)})
-    except:
-        result = db.appointments.update_one({"id": id}, {"$set": update_data})
-        if result.matched_count == 0:
-            return {"error": "Appointment not found"}, 404
-        doc = db.appointments.find_one({"id": id})
+    doc = _set_estado(db, id, update_data)
+    if not doc:
+        return {"error": "Appointment not found"}, 404
     
     return {"success": True, "data": serialize_doc(doc)}
 
@@ -207,31 +353,14 @@ def upload_comprobante(id: str):
 def validar_pago(id: str):
     db = get_db()
     data = request.get_json(force=True)
-    valid = data.get('valid')
-    notas = data.get('notasAdmin')
-    
-    if valid is None:
-        return {"error": "valid field required"}, 400
-    
-    new_status = 'aceptada' if valid else 'rechazada'
-    update_data = {
-        "estado": new_status,
-        "fechaActualizacion": datetime.utcnow()
-    }
-    
-    if notas:
-        update_data['notasAdmin'] = notas
-    
     try:
-        result = db.appointments.update_one({"_id": ObjectId(id)}, {"$set": update_data})
-        if result.matched_count == 0:
-            return {"error": "Appointment not found"}, 404
-        doc = db.appointments.find_one({"_id": ObjectId(id)})
-    except:
-        result = db.appointments.update_one({"id": id}, {"$set": update_data})
-        if result.matched_count == 0:
-            return {"error": "Appointment not found"}, 404
-        doc = db.appointments.find_one({"id": id})
+        update_data = _validar_pago_update(data)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    
+    doc = _set_estado(db, id, update_data)
+    if not doc:
+        return {"error": "Appointment not found"}, 404
     
     return {"success": True, "data": serialize_doc(doc)}
 
@@ -239,29 +368,124 @@ def validar_pago(id: str):
 def atender(id: str):
     db = get_db()
     data = request.get_json(force=True)
+    update_data = _atender_update(data)
     
-    update_data = {
-        "estado": "atendida",
-        "fechaActualizacion": datetime.utcnow()
+    doc = _set_estado(db, id, update_data)
+    if not doc:
+        return {"error": "Appointment not found"}, 404
+    
+    return {"success": True, "data": serialize_doc(doc)}
+
+@appts_bp.post('/bulk')
+def bulk_appointments():
+    """Varias altas, cambios y transiciones de estado en un solo bulk_write.
+
+    Cada operación: {"op": "create", "data": {...}} o {"op": "update" |
+    "estado" | "validar_pago" | "atender" | "delete", "id": ..., "data": {...}}
+    """
+    db = get_db()
+    items = bulk_items()
+    slots = BatchReservation(db)
+    
+    def create(item):
+        doc = _build_cita(item.get('data') or {})
+        slot = _slot(doc)
+        if slot is not None:
+            slots.check(*slot, duration_of(doc), doc)
+        return "insert", doc
+    
+    def update(item):
+        data = _store_comprobantes(coerce_dates('appointments', dict(item.get('data') or {})))
+        if 'estado' in data and not allowed('appointments.update_estado'):
+            raise ValueError("forbidden")
+        # Reprogramar necesita reservar el hueco nuevo: PUT /api/citas/<id>
+        if any(f in data for f in SLOT_FIELDS if f != 'estado'):
+            raise ValueError("use PUT /api/citas/<id> to change fecha, veterinarioId or duracionMinutos")
+        return "update", item.get('id'), {"$set": {**data, "fechaActualizacion": datetime.utcnow()}}
+    
+    handlers = {
+        "create": create,
+        "update": update,
+        "estado": requires('appointments.update_estado', lambda item: (
+            "update", item.get('id'), {"$set": _estado_update(item.get('data') or {})})),
+        "validar_pago": requires('appointments.validar_pago', lambda item: (
+            "update", item.get('id'), {"$set": _validar_pago_update(item.get('data') or {})})),
+        "atender": requires('appointments.atender', lambda item: (
+            "update", item.get('id'), {"$set": _atender_update(item.get('data') or {})})),
+        "delete": lambda item: ("delete", item.get('id')),
     }
     
-    # Si hay datos del historial clínico, los guardamos
-    if data.get('historialData'):
-        update_data['historialData'] = data['historialData']
+    # Imágenes de antes y de después de las citas afectadas, para agenda y contadores
+    ids = [item['id'] for item in items if isinstance(item, dict) and isinstance(item.get('id'), str)]
+    projection = {f: 1 for f in IMAGE_FIELDS}
     
-    # Notas adicionales del veterinario
-    if data.get('notas'):
-        update_data['notas'] = data['notas']
+    def images(ids):
+        if not ids:
+            return {}
+        return {str(d['_id']): d for d in db.appointments.find({"$or": [id_filter(i) for i in ids]}, projection)}
+    
+    before = images(ids)
+    result = run_bulk(db.appointments, items, handlers)
+    # Altas que otra escritura concurrente dejó sin hueco: se deshacen
+    lost = slots.confirm({r['id'] for r in result['data'] if r['ok']},
+                         lambda ids: db.appointments.delete_many({"$or": [id_filter(i) for i in ids]}))
+    for r in result['data']:
+        if r['ok'] and r['id'] in lost:
+            r.update(ok=False, error="slot not available")
+            del r['id']
+    if lost:
+        result['summary']['inserted'] -= len(lost)
+        result['summary']['errors'] += len(lost)
+        result['success'] = False
+    after = images([r['id'] for r in result['data'] if r['ok']])
+    invalidate(db, [*before.values(), *after.values()])
+    record(db, 'appointments', [(before.get(k), after.get(k)) for k in {*before, *after}])
+    for k, doc in after.items():
+        if doc.get('estado') != before.get(k, {}).get('estado'):
+            _publish_estado(doc)
     
+    # Atenciones con datos clínicos: al resumen de la mascota
+    done = {r['index'] for r in result['data'] if r['ok']}
+    for index, item in enumerate(items):
+        data = item.get('data') if isinstance(item, dict) else None
+        if index in done and item.get('op') == 'atender' and isinstance(data, dict) and data.get('historialData'):
+            cita = after.get(item['id'])
+            if cita:
+                record_atencion(db, {**cita, **_atender_update(data)})
+    return result
+
+@appts_bp.get('/disponibilidad')
+def disponibilidad():
+    """Huecos libres por veterinario y día: ?desde=YYYY-MM-DD&hasta=...&veterinarioIds=a,b&duracion=30"""
+    db = get_db()
     try:
-        result = db.appointments.update_one({"_id": ObjectId(id)}, {"$set": update_data})
-        if result.matched_count == 0:
-            return {"error": "Appointment not found"}, 404
-        doc = db.appointments.find_one({"_id": ObjectId(id)})
-    except:
-        result = db.appointments.update_one({"id": id}, {"$set": update_data})
-        if result.matched_count == 0:
-            return {"error": "Appointment not found"}, 404
-        doc = db.appointments.find_one({"id": id})
+        desde = date.fromisoformat(request.args['desde'])
+        hasta = date.fromisoformat(request.args.get('hasta') or request.args['desde'])
+    except (KeyError, ValueError):
+        return {"error": "desde (YYYY-MM-DD) required"}, 400
+    if hasta < desde or (hasta - desde).days >= 31:
+        return {"error": "range must be between 1 and 31 days"}, 400
     
-    return {"success": True, "data": serialize_doc(doc)}
+    slot = current_app.config['AGENDA_SLOT_MINUTES']
+    try:
+        duracion = parse_duration(request.args.get('duracion')) or slot
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    vet_ids = [v for v in (request.args.get('veterinarioIds') or '').split(',') if v]
+    if not vet_ids:
+        vets = db.users.find({"rol": "veterinario", **NOT_DELETED}, {"_id": 1})
+        vet_ids = [str(v['_id']) for v in vets]
+    if not vet_ids:
+        return {"success": True, "data": {}}
+    
+    days = [desde + timedelta(days=i) for i in range((hasta - desde).days + 1)]
+    agendas = get_agendas(db, vet_ids, days)
+    hours = working_hours()
+    data = {
+        vet: {
+            day.isoformat(): [slot_label(m) for m in agendas[agenda_key(vet, day)].free_slots(hours, slot, duracion)]
+            for day in days
+        }
+        for vet in vet_ids
+    }
+    return {"success": True, "data": data}
@@ -1,10 +1,15 @@
 from flask import Blueprint, request, current_app
-from passlib.hash import bcrypt
 from datetime import datetime
+from pymongo.errors import DuplicateKeyError
 from ..db import get_db
+from ..repository import find_by_id
+from ..deletion import NOT_DELETED
 from ..utils.jwt import create_tokens, verify_token
 from ..utils.helpers import serialize_doc
-from bson import ObjectId
+from ..utils.passwords import hash_password, verify_password
+from ..login_keys import duplicate_field, find_conflict, login_keys, normalize_identifier
+from ..search import search_tokens
+from ..images import schedule_photo, store_photo
 
 auth_bp = Blueprint('auth', __name__)
 
@@ -16,22 +21,30 @@ def login():
     if not identifier or not password:
         return {"error": "identifier and password required"}, 400
     
+    # email, username o telefono normalizados en un único índice (loginKeys)
+    key = normalize_identifier(identifier)
+    if key is None:
+        return {"error": "invalid credentials"}, 401
+    
     db = get_db()
-    # Buscar por email, username o telefono (como frontend espera)
-    query = {"$or": [
-        {"email": identifier},
-        {"username": identifier},
-        {"telefono": identifier}
-    ]}
-    user = db.users.find_one(query)
+    user = db.users.find_one({"loginKeys": key, **NOT_DELETED})
+    
+    if not user:
+        return {"error": "invalid credentials"}, 401
     
-    if not user or not bcrypt.verify(password, user.get('password', '')):
+    valid, new_hash = verify_password(password, user.get('password'))
+    if not valid:
         return {"error": "invalid credentials"}, 401
     
+    # Rehash transparente si cambió el coste configurado
+    if new_hash:
+        db.users.update_one({"_id": user['_id']}, {"$set": {"password": new_hash}})
+    
     tokens = create_tokens(str(user['_id']), user.get('rol', 'cliente'))
     profile = serialize_doc(user)
-    if 'password' in profile:
-        del profile['password']
+    profile.pop('password', None)
+    profile.pop('loginKeys', None)
+    profile.pop('searchTokens', None)
     
     return {"success": True, "tokens": tokens, "user": profile}
 
@@ -47,41 +60,48 @@ def register():
     
     db = get_db()
     
-    # Verificar email único
-    if db.users.find_one({"email": data['email']}):
-        return {"error": "email already exists"}, 409
-    
-    # Verificar username único si se proporciona
-    if data.get('username') and db.users.find_one({"username": data['username']}):
-        return {"error": "username already exists"}, 409
+    # Verificar email, username y telefono únicos (mismas claves que el login)
+    conflict = find_conflict(db, data)
+    if conflict:
+        return {"error": f"{conflict} already exists"}, 409
     
     # Estructura del usuario compatible con frontend
     doc = {
         "nombre": data['nombre'],
         "apellidos": data.get('apellidos'),
         "username": data.get('username'),
-        "email": data['email'],
+        "email": data['email'].strip().lower(),
         "telefono": data.get('telefono'),
         "direccion": data.get('direccion'),
         "fechaNacimiento": data.get('fechaNacimiento'),
         "genero": data.get('genero'),
-        "rol": data.get('rol', 'cliente'),
-        "password": bcrypt.hash(data['password']),
+        # Alta pública: siempre cliente; otros roles sólo los asigna un admin (users.create_user)
+        "rol": 'cliente',
+        "password": hash_password(data['password']),
         "documento": data.get('documento'),
         "tipoDocumento": data.get('tipoDocumento'),
         "fechaRegistro": datetime.utcnow(),
-        "foto": data.get('foto'),
+        **store_photo(data.get('foto')),
         # Campos para veterinarios
         "especialidad": data.get('especialidad'),
         "experiencia": data.get('experiencia'),
         "colegiatura": data.get('colegiatura'),
     }
     
-    res = db.users.insert_one(doc)
+    doc['loginKeys'] = login_keys(doc)
+    doc['searchTokens'] = search_tokens(doc)
+    
+    try:
+        res = db.users.insert_one(doc)
+    except DuplicateKeyError as e:
+        return {"error": f"{duplicate_field(e)} already exists"}, 409
     tokens = create_tokens(str(res.inserted_id), doc['rol'])
     doc['_id'] = res.inserted_id
+    schedule_photo('users', res.inserted_id, doc)
     profile = serialize_doc(doc)
     del profile['password']
+    del profile['loginKeys']
+    del profile['searchTokens']
     
     return {"success": True, "tokens": tokens, "user": profile}, 201
 
@@ -96,7 +116,7 @@ def refresh_token():
         payload = verify_token(token, expected_type='refresh')
         user_id = payload['sub']
         db = get_db()
-        user = db.users.find_one({"_id": ObjectId(user_id)})
+        user = find_by_id(db.users, user_id, {"rol": 1}, query=NOT_DELETED)
         if not user:
             return {"error": "user not found"}, 404
         
@@ -0,0 +1,38 @@
+from flask import Blueprint, request, send_file
+from gridfs.errors import NoFile
+from ..db import get_db
+from ..storage import SHA256_RE, get_store, GridFSBlobStore
+
+blobs_bp = Blueprint('blobs', __name__)
+
+# El contenido de un blob nunca cambia: se puede cachear indefinidamente
+BLOB_MAX_AGE = 365 * 24 * 60 * 60
+
+@blobs_bp.get('/<sha>')
+def get_blob(sha: str):
+    """Servir un blob por su SHA-256 (soporta Range, ETag e If-None-Match)"""
+    if not SHA256_RE.match(sha):
+        return {"error": "Blob not found"}, 404
+    
+    meta = get_db().blobs.find_one({"_id": sha})
+    if not meta:
+        return {"error": "Blob not found"}, 404
+    
+    mimetype = meta.get('contentType') or 'application/octet-stream'
+    store = get_store()
+    if isinstance(store, GridFSBlobStore):
+        try:
+            stream = store.open(sha)
+        except NoFile:
+            return {"error": "Blob not found"}, 404
+        rv = send_file(stream, mimetype=mimetype, conditional=False, etag=False, max_age=BLOB_MAX_AGE)
+        rv.set_etag(sha)
+        rv = rv.make_conditional(request, accept_ranges=True, complete_length=meta['size'])
+    else:
+        try:
+            rv = send_file(store.path(sha), mimetype=mimetype, conditional=True, etag=sha, max_age=BLOB_MAX_AGE)
+        except FileNotFoundError:
+            return {"error": "Blob not found"}, 404
+    
+    rv.cache_control.immutable = True
+    return rv
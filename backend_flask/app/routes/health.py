@@ -1,5 +1,7 @@
 from flask import Blueprint
-from ..db import get_db
+from ..db import get_db, pool_stats
+from ..events import bus
+from ..utils.passwords import hash_stats
 
 health_bp = Blueprint('health', __name__)
 
@@ -7,4 +9,10 @@ health_bp = Blueprint('health', __name__)
 def health():
     db = get_db()
     ping = db.command({'ping': 1})
-    return {"status": "ok", "mongo": ping.get('ok', 0) == 1}
+    return {
+        "status": "ok",
+        "mongo": ping.get('ok', 0) == 1,
+        "pool": pool_stats.snapshot(),
+        "passwords": hash_stats.snapshot(),
+        "events": bus.snapshot(),
+    }
@@ -1,35 +1,47 @@
 from flask import Blueprint, request
-from bson import ObjectId
 from datetime import datetime
 from ..db import get_db
+from ..clinical import ENTRY_FIELDS, get_summary, record_consulta
+from ..dates import coerce_dates
+from ..repository import set_by_id
 from ..utils.helpers import serialize_doc
+from ..utils.conditional import conditional_response, find_conditional
+from ..utils.pagination import paginate
+from ..utils.projection import doc_projection, list_projection
+from ..utils.streaming import stream_docs, wants_stream
 
 historial_bp = Blueprint('historial', __name__)
 
 @historial_bp.get('/mascota/<mascota_id>')
 def get_historial_mascota(mascota_id: str):
-    """Obtener historial clínico completo de una mascota"""
+    """Historial clínico de una mascota, del más reciente al más antiguo, paginado por cursor"""
     db = get_db()
     
     # Buscar en colección de historial clínico
     query = {"mascotaId": mascota_id}
-    docs = [serialize_doc(d) for d in db.historial_clinico.find(query).sort('fecha', -1)]
+    projection = list_projection('historial_clinico')
+    if wants_stream():
+        return stream_docs(db.historial_clinico, query, [('fecha', -1)], projection=projection)
+    docs, next_cursor = paginate(db.historial_clinico, query, [('fecha', -1)], default_limit=20, projection=projection)
     
-    return {"success": True, "data": docs}
+    return {"success": True, "data": [serialize_doc(d) for d in docs], "nextCursor": next_cursor}
+
+@historial_bp.get('/mascota/<mascota_id>/resumen')
+def get_resumen_mascota(mascota_id: str):
+    """Resumen clínico de una mascota: última consulta, peso, vacunas, medicación activa y próxima visita"""
+    db = get_db()
+    return {"success": True, "data": get_summary(db, mascota_id)}
 
 @historial_bp.get('/<id>')
 def get_consulta(id: str):
     """Obtener una consulta específica del historial"""
     db = get_db()
-    try:
-        doc = db.historial_clinico.find_one({"_id": ObjectId(id)})
-    except:
-        doc = db.historial_clinico.find_one({"id": id})
+    doc, validators = find_conditional(db.historial_clinico, id, doc_projection('historial_clinico'))
     
     if not doc:
         return {"error": "Consulta not found"}, 404
     
-    return {"success": True, "data": serialize_doc(doc)}
+    return conditional_response({"success": True, "data": serialize_doc(doc)}, validators)
 
 @historial_bp.post('')
 def create_consulta():
@@ -43,11 +55,16 @@ def create_consulta():
         if not data.get(field):
             return {"error": f"{field} required"}, 400
     
+    try:
+        fecha = coerce_dates('historial_clinico', {"fecha": data['fecha']})['fecha']
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    
     # Estructura del historial clínico compatible con frontend
     historial_doc = {
         "mascotaId": data['mascotaId'],
         "mascotaNombre": data.get('mascotaNombre', ''),
-        "fecha": data['fecha'],
+        "fecha": fecha,
         "veterinario": data.get('veterinario', ''),
         "veterinarioId": data.get('veterinarioId'),
         "tipoConsulta": data.get('tipoConsulta'),
@@ -71,6 +88,7 @@ def create_consulta():
     
     res = db.historial_clinico.insert_one(historial_doc)
     historial_doc['_id'] = res.inserted_id
+    record_consulta(db, None, historial_doc)
     
     return {"success": True, "data": serialize_doc(historial_doc)}, 201
 
@@ -80,17 +98,17 @@ def update_consulta(id: str):
     db = get_db()
     data = request.get_json(force=True)
     
+    try:
+        coerce_dates('historial_clinico', data)
+    except ValueError as e:
+        return {"error": str(e)}, 400
+    
     update_data = {**data, "fechaActualizacion": datetime.utcnow()}
     
-    try:
-        result = db.historial_clinico.update_one({"_id": ObjectId(id)}, {"$set": update_data})
-        if result.matched_count == 0:
-            return {"error": "Consulta not found"}, 404
-        doc = db.historial_clinico.find_one({"_id": ObjectId(id)})
-    except:
-        result = db.historial_clinico.update_one({"id": id}, {"$set": update_data})
-        if result.matched_count == 0:
-            return {"error": "Consulta not found"}, 404
-        doc = db.historial_clinico.find_one({"id": id})
+    before, doc = set_by_id(db.historial_clinico, id, update_data, doc_projection('historial_clinico'),
+                            needed=ENTRY_FIELDS)
+    if not doc:
+        return {"error": "Consulta not found"}, 404
+    record_consulta(db, before, {**before, **update_data})
     
     return {"success": True, "data": serialize_doc(doc)}
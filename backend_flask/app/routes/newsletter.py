@@ -1,8 +1,15 @@
 from flask import Blueprint, request
 from bson import ObjectId
 from datetime import datetime
+from pymongo import ReturnDocument
 from ..db import get_db
+from ..repository import find_by_id
+from ..mailer import schedule_campaign
+from ..counters import record_subscribers
 from ..utils.helpers import serialize_doc
+from ..utils.pagination import paginate
+from ..utils.projection import doc_projection, list_projection
+from ..utils.streaming import stream_docs, wants_stream
 
 newsletter_bp = Blueprint('newsletter', __name__)
 
@@ -16,8 +23,11 @@ def list_subscribers():
     if activo is not None:
         q['activo'] = activo.lower() == 'true'
     
-    docs = [serialize_doc(d) for d in db.newsletter_suscriptores.find(q).sort('fechaSuscripcion', -1)]
-    return {"success": True, "data": docs}
+    projection = list_projection('newsletter_suscriptores')
+    if wants_stream():
+        return stream_docs(db.newsletter_suscriptores, q, [('fechaSuscripcion', -1)], projection=projection)
+    docs, next_cursor = paginate(db.newsletter_suscriptores, q, [('fechaSuscripcion', -1)], default_limit=500, projection=projection)
+    return {"success": True, "data": [serialize_doc(d) for d in docs], "nextCursor": next_cursor}
 
 @newsletter_bp.post('/suscribir')
 def subscribe():
@@ -36,11 +46,14 @@ def subscribe():
             return {"error": "Email already subscribed"}, 409
         else:
             # Reactivar suscripción
-            db.newsletter_suscriptores.update_one(
-                {"email": email},
-                {"$set": {"activo": True, "fechaReactivacion": datetime.utcnow()}}
+            doc = db.newsletter_suscriptores.find_one_and_update(
+                {"email": email, "activo": {"$ne": True}},
+                {"$set": {"activo": True, "fechaReactivacion": datetime.utcnow()}},
+                return_document=ReturnDocument.AFTER
             )
-            doc = db.newsletter_suscriptores.find_one({"email": email})
+            if not doc:
+                return {"error": "Email already subscribed"}, 409
+            record_subscribers(db, 1)
             return {"success": True, "data": serialize_doc(doc)}
     
     # Nueva suscripción
@@ -53,6 +66,7 @@ def subscribe():
     
     res = db.newsletter_suscriptores.insert_one(subscriber_doc)
     subscriber_doc['_id'] = res.inserted_id
+    record_subscribers(db, 1)
     
     return {"success": True, "data": serialize_doc(subscriber_doc)}, 201
 
@@ -61,13 +75,16 @@ def unsubscribe(email: str):
     """Desuscribir email del newsletter"""
     db = get_db()
     
-    result = db.newsletter_suscriptores.update_one(
+    before = db.newsletter_suscriptores.find_one_and_update(
         {"email": email},
-        {"$set": {"activo": False, "fechaDesuscripcion": datetime.utcnow()}}
+        {"$set": {"activo": False, "fechaDesuscripcion": datetime.utcnow()}},
+        projection={"activo": 1}
     )
     
-    if result.matched_count == 0:
+    if before is None:
         return {"error": "Email not found"}, 404
+    if before.get('activo'):
+        record_subscribers(db, -1)
     
     return {"success": True, "message": "Email unsubscribed successfully"}
 
@@ -81,8 +98,9 @@ def list_newsletter_emails():
     if estado:
         q['estado'] = estado
     
-    docs = [serialize_doc(d) for d in db.newsletter_emails.find(q).sort('fechaEnvio', -1)]
-    return {"success": True, "data": docs}
+    projection = list_projection('newsletter_emails')
+    docs, next_cursor = paginate(db.newsletter_emails, q, [('fechaEnvio', -1)], default_limit=100, projection=projection)
+    return {"success": True, "data": [serialize_doc(d) for d in docs], "nextCursor": next_cursor}
 
 @newsletter_bp.post('/send')
 def send_newsletter():
@@ -96,28 +114,56 @@ def send_newsletter():
         if not data.get(field):
             return {"error": f"{field} required"}, 400
     
-    # Obtener suscriptores activos
-    suscriptores = list(db.newsletter_suscriptores.find({"activo": True}))
-    destinatarios = [s['email'] for s in suscriptores]
+    # Un borrador sólo se guarda; el resto se encola y se envía en segundo plano
+    borrador = data.get('estado') == 'borrador'
     
-    # Estructura del email
+    # Estructura del email. Los destinatarios van a newsletter_entregas, uno
+    # por documento, con su propio estado de entrega (app/mailer.py)
     newsletter_doc = {
         "asunto": data['asunto'],
         "contenido": data['contenido'],
         "fechaEnvio": datetime.utcnow(),
-        "destinatarios": destinatarios,
-        "estado": data.get('estado', 'enviado'),
+        "estado": 'borrador' if borrador else 'en_cola',
         "colorTema": data.get('colorTema'),
         "plantilla": data.get('plantilla'),
         "imagenes": data.get('imagenes', []),
         "archivos": data.get('archivos', []),
-        "totalEnviados": len(destinatarios),
+        "totalDestinatarios": 0,
+        "totalEnviados": 0,
+        "totalFallidos": 0,
     }
     
     res = db.newsletter_emails.insert_one(newsletter_doc)
     newsletter_doc['_id'] = res.inserted_id
     
-    # Aquí iría la lógica real de envío de emails
-    # Por ahora solo guardamos en BD
+    if borrador:
+        return {"success": True, "data": serialize_doc(newsletter_doc)}, 201
     
-    return {"success": True, "data": serialize_doc(newsletter_doc)}, 201
+    schedule_campaign(res.inserted_id)
+    return {"success": True, "data": serialize_doc(newsletter_doc)}, 202
+
+@newsletter_bp.get('/emails/<id>')
+def get_newsletter_email(id: str):
+    """Estado de un envío: totales de destinatarios, enviados y fallidos"""
+    db = get_db()
+    doc = find_by_id(db.newsletter_emails, id, doc_projection('newsletter_emails'))
+    
+    if not doc:
+        return {"error": "Newsletter not found"}, 404
+    return {"success": True, "data": serialize_doc(doc)}
+
+@newsletter_bp.get('/emails/<id>/entregas')
+def list_entregas(id: str):
+    """Estado de entrega por destinatario de un envío"""
+    db = get_db()
+    if not ObjectId.is_valid(id):
+        return {"error": "Newsletter not found"}, 404
+    
+    q = {"emailId": ObjectId(id)}
+    estado = request.args.get('estado')
+    if estado:
+        q['estado'] = estado
+    
+    docs, next_cursor = paginate(db.newsletter_entregas, q, default_limit=500,
+                                 projection=list_projection('newsletter_entregas'))
+    return {"success": True, "data": [serialize_doc(d) for d in docs], "nextCursor": next_cursor}
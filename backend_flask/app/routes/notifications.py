@@ -1,8 +1,14 @@
-from flask import Blueprint, request
-from bson import ObjectId
+from collections import Counter
+from flask import Blueprint, request, g
 from datetime import datetime
 from ..db import get_db
+from ..counters import read_unread, record_unread
+from ..events import publish, sse_response
+from ..repository import id_filter, set_by_id
 from ..utils.helpers import serialize_doc
+from ..utils.pagination import paginate
+from ..utils.projection import doc_projection, list_projection
+from ..utils.bulk import bulk_items, run_bulk
 
 notifications_bp = Blueprint('notifications', __name__)
 
@@ -20,23 +26,19 @@ def list_notifications():
     if leida is not None:
         q['leida'] = leida.lower() == 'true'
     
-    docs = [serialize_doc(d) for d in db.notificaciones.find(q).sort('fechaCreacion', -1).limit(100)]
-    return {"success": True, "data": docs}
+    projection = list_projection('notificaciones')
+    docs, next_cursor = paginate(db.notificaciones, q, [('fechaCreacion', -1)], default_limit=100, projection=projection)
+    return {"success": True, "data": [serialize_doc(d) for d in docs], "nextCursor": next_cursor}
 
-@notifications_bp.post('')
-def create_notification():
-    """Crear nueva notificación"""
-    db = get_db()
-    data = request.get_json(force=True)
-    
-    # Validaciones requeridas
+def _build_notification(data):
+    """Documento de notificación nuevo; ValueError si falta un campo requerido"""
     required_fields = ['usuarioId', 'tipo', 'titulo', 'mensaje']
     for field in required_fields:
         if not data.get(field):
-            return {"error": f"{field} required"}, 400
+            raise ValueError(f"{field} required")
     
     # Estructura compatible con AppContext
-    notification_doc = {
+    return {
         "usuarioId": data['usuarioId'],
         "tipo": data['tipo'],
         "titulo": data['titulo'],
@@ -45,32 +47,76 @@ def create_notification():
         "fechaCreacion": datetime.utcnow(),
         "datos": data.get('datos', {}),
     }
+
+def _leida_update():
+    return {
+        "leida": True,
+        "fechaLectura": datetime.utcnow()
+    }
+
+def _unread_changed(db, deltas):
+    """Aplicar {usuarioId: delta} al contador de no leídas y avisar por SSE del total nuevo"""
+    for user_id, count in record_unread(db, deltas).items():
+        publish([user_id], 'noLeidas', {"noLeidas": count})
+
+def _channel():
+    """usuarioId del canal: el propio; un admin puede pedir ?usuarioId="""
+    if g.role == 'admin':
+        return request.args.get('usuarioId') or g.user_id
+    return g.user_id
+
+@notifications_bp.get('/stream')
+def stream():
+    """Server-Sent Events del usuario: notificaciones nuevas, lecturas, cambios de citas y contador.
+
+    Con EventSource el token va en ?access_token=
+    """
+    db = get_db()
+    user_id = _channel()
+    return sse_response(user_id, [('noLeidas', {"noLeidas": read_unread(db, user_id)})])
+
+@notifications_bp.get('/no-leidas')
+def unread_count():
+    """Número de notificaciones sin leer (contador mantenido, sin recorrer la colección)"""
+    db = get_db()
+    return {"success": True, "data": {"noLeidas": read_unread(db, _channel())}}
+
+@notifications_bp.post('')
+def create_notification():
+    """Crear nueva notificación"""
+    db = get_db()
+    data = request.get_json(force=True)
+    
+    try:
+        notification_doc = _build_notification(data)
+    except ValueError as e:
+        return {"error": str(e)}, 400
     
     res = db.notificaciones.insert_one(notification_doc)
     notification_doc['_id'] = res.inserted_id
     
-    return {"success": True, "data": serialize_doc(notification_doc)}, 201
+    data = serialize_doc(notification_doc)
+    publish([notification_doc['usuarioId']], 'notificacion', data)
+    if notification_doc['leida'] is False:
+        _unread_changed(db, {notification_doc['usuarioId']: 1})
+    
+    return {"success": True, "data": data}, 201
 
 @notifications_bp.put('/<id>/leida')
 def mark_as_read(id: str):
     """Marcar notificación como leída"""
     db = get_db()
     
-    update_data = {
-        "leida": True,
-        "fechaLectura": datetime.utcnow()
-    }
+    update_data = _leida_update()
     
-    try:
-        result = db.notificaciones.update_one({"_id": ObjectId(id)}, {"$set": update_data})
-        if result.matched_count == 0:
-            return {"error": "Notification not found"}, 404
-        doc = db.notificaciones.find_one({"_id": ObjectId(id)})
-    except:
-        result = db.notificaciones.update_one({"id": id}, {"$set": update_data})
-        if result.matched_count == 0:
-            return {"error": "Notification not found"}, 404
-        doc = db.notificaciones.find_one({"id": id})
+    before, doc = set_by_id(db.notificaciones, id, update_data, doc_projection('notificaciones'),
+                            needed=('usuarioId', 'leida'))
+    if not doc:
+        return {"error": "Notification not found"}, 404
+    
+    if before.get('leida') is False:
+        publish([before.get('usuarioId')], 'leida', {"id": str(before['_id'])})
+        _unread_changed(db, {before.get('usuarioId'): -1})
     
     return {"success": True, "data": serialize_doc(doc)}
 
@@ -84,14 +130,62 @@ def mark_all_as_read():
     if not user_id:
         return {"error": "usuarioId required"}, 400
     
-    update_data = {
-        "leida": True,
-        "fechaLectura": datetime.utcnow()
-    }
+    update_data = _leida_update()
     
     result = db.notificaciones.update_many(
         {"usuarioId": user_id, "leida": False}, 
         {"$set": update_data}
     )
     
+    if result.modified_count:
+        publish([user_id], 'leida', {"todas": True})
+        _unread_changed(db, {user_id: -result.modified_count})
+    
     return {"success": True, "message": f"Marked {result.modified_count} notifications as read"}
+
+@notifications_bp.post('/bulk')
+def bulk_notifications():
+    """Crear o marcar como leídas varias notificaciones en un solo bulk_write.
+
+    Cada operación: {"op": "create", "data": {...}} o {"op": "leida", "id": ...}
+    """
+    db = get_db()
+    items = bulk_items()
+    created = []
+    
+    def create(item):
+        doc = _build_notification(item.get('data') or {})
+        created.append(doc)
+        return "insert", doc
+    
+    handlers = {
+        "create": create,
+        "leida": lambda item: ("update", item.get('id'), {"$set": _leida_update()}),
+    }
+    
+    # Estado previo de las que se marcan como leídas, para el contador de no leídas
+    ids = [item['id'] for item in items if isinstance(item, dict) and isinstance(item.get('id'), str)]
+    before = {}
+    if ids:
+        for d in db.notificaciones.find({"$or": [id_filter(i) for i in ids]}, {"id": 1, "usuarioId": 1, "leida": 1}):
+            before[str(d['_id'])] = before[d.get('id')] = d
+    
+    result = run_bulk(db.notificaciones, items, handlers)
+    created = {str(d['_id']): d for d in created}
+    deltas = Counter()
+    read = set()
+    for r in result['data']:
+        if not r['ok']:
+            continue
+        if r['id'] in created:
+            doc = created[r['id']]
+            publish([doc['usuarioId']], 'notificacion', serialize_doc(doc))
+            deltas[doc['usuarioId']] += doc['leida'] is False
+            continue
+        prev = before.get(r['id'])
+        if prev and prev.get('leida') is False and prev['_id'] not in read:
+            read.add(prev['_id'])
+            publish([prev.get('usuarioId')], 'leida', {"id": str(prev['_id'])})
+            deltas[prev.get('usuarioId')] -= 1
+    _unread_changed(db, deltas)
+    return result
@@ -1,8 +1,15 @@
 from flask import Blueprint, request
-from bson import ObjectId
 from datetime import datetime
 from ..db import get_db
+from ..repository import update_by_id, delete_by_id, id_filter
+from ..dates import coerce_dates
 from ..utils.helpers import serialize_doc
+from ..utils.conditional import conditional_response, find_conditional
+from ..storage import save_upload
+from ..images import pending_derivatives, schedule_derivatives, schedule_photo, store_photo
+from ..utils.pagination import paginate
+from ..utils.projection import doc_projection, list_projection
+from ..utils.bulk import bulk_items, run_bulk
 
 pets_bp = Blueprint('pets', __name__)
 
@@ -14,52 +21,67 @@ def list_pets():
     if cliente_id:
         q['clienteId'] = cliente_id
     
-    # Buscar con límite y ordenar por fecha de creación
-    docs = [serialize_doc(d) for d in db.pets.find(q).sort('fechaNacimiento', -1).limit(200)]
-    return {"success": True, "data": docs}
+    projection = list_projection('pets')
+    # Paginar por cursor ordenando por fecha de nacimiento
+    docs, next_cursor = paginate(db.pets, q, [('fechaNacimiento', -1)], default_limit=200, projection=projection)
+    return {"success": True, "data": [serialize_doc(d) for d in docs], "nextCursor": next_cursor}
 
 @pets_bp.get('/<id>')
 def get_pet(id: str):
     db = get_db()
-    try:
-        doc = db.pets.find_one({"_id": ObjectId(id)})
-    except:
-        doc = db.pets.find_one({"id": id})
+    doc, validators = find_conditional(db.pets, id, doc_projection('pets'))
     
     if not doc:
         return {"error": "Pet not found"}, 404
-    return {"success": True, "data": serialize_doc(doc)}
+    return conditional_response({"success": True, "data": serialize_doc(doc)}, validators)
 
-@pets_bp.post('')
-def create_pet():
-    db = get_db()
-    data = request.get_json(force=True)
-    
-    # Validaciones básicas
+def _build_pet(data):
+    """Documento de mascota nuevo; ValueError si falta un campo requerido"""
     required_fields = ['nombre', 'especie', 'raza', 'fechaNacimiento', 'clienteId']
     for field in required_fields:
         if not data.get(field):
-            return {"error": f"{field} required"}, 400
+            raise ValueError(f"{field} required")
     
     # Estructura compatible con frontend
-    pet_doc = {
+    return {
         "nombre": data['nombre'],
         "especie": data['especie'],
         "raza": data['raza'],
         "sexo": data.get('sexo'),
-        "fechaNacimiento": data['fechaNacimiento'],
+        "fechaNacimiento": coerce_dates('pets', {"fechaNacimiento": data['fechaNacimiento']})['fechaNacimiento'],
         "peso": data.get('peso'),
         "microchip": data.get('microchip'),
         "estado": data.get('estado', 'saludable'),
         "clienteId": data['clienteId'],
         "proximaCita": data.get('proximaCita'),
         "ultimaVacuna": data.get('ultimaVacuna'),
-        "foto": data.get('foto'),
+        **store_photo(data.get('foto')),
         "fechaCreacion": datetime.utcnow(),
     }
+
+def _pet_update(data):
+    """$set de una edición; ValueError si una fecha no es válida"""
+    coerce_dates('pets', data)
+    if data.get('foto'):
+        # Las miniaturas de la foto anterior ya no sirven
+        data.update(store_photo(data['foto']))
+    
+    # Añadir timestamp de actualización
+    return {**data, "fechaActualizacion": datetime.utcnow()}
+
+@pets_bp.post('')
+def create_pet():
+    db = get_db()
+    data = request.get_json(force=True)
+    
+    try:
+        pet_doc = _build_pet(data)
+    except ValueError as e:
+        return {"error": str(e)}, 400
     
     res = db.pets.insert_one(pet_doc)
     pet_doc['_id'] = res.inserted_id
+    schedule_photo('pets', res.inserted_id, pet_doc)
     return {"success": True, "data": serialize_doc(pet_doc)}, 201
 
 @pets_bp.put('/<id>')
@@ -67,33 +89,23 @@ def update_pet(id: str):
     db = get_db()
     data = request.get_json(force=True)
     
-    # Añadir timestamp de actualización
-    update_data = {**data, "fechaActualizacion": datetime.utcnow()}
-    
     try:
-        result = db.pets.update_one({"_id": ObjectId(id)}, {"$set": update_data})
-        if result.matched_count == 0:
-            return {"error": "Pet not found"}, 404
-        doc = db.pets.find_one({"_id": ObjectId(id)})
-    except:
-        result = db.pets.update_one({"id": id}, {"$set": update_data})
-        if result.matched_count == 0:
-            return {"error": "Pet not found"}, 404
-        doc = db.pets.find_one({"id": id})
+        update_data = _pet_update(data)
+    except ValueError as e:
+        return {"error": str(e)}, 400
     
+    doc = update_by_id(db.pets, id, {"$set": update_data}, doc_projection('pets'))
+    if not doc:
+        return {"error": "Pet not found"}, 404
+    
+    schedule_photo('pets', doc['_id'], update_data)
     return {"success": True, "data": serialize_doc(doc)}
 
 @pets_bp.delete('/<id>')
 def delete_pet(id: str):
     db = get_db()
-    try:
-        result = db.pets.delete_one({"_id": ObjectId(id)})
-        if result.deleted_count == 0:
-            return {"error": "Pet not found"}, 404
-    except:
-        result = db.pets.delete_one({"id": id})
-        if result.deleted_count == 0:
-            return {"error": "Pet not found"}, 404
+    if not delete_by_id(db.pets, id):
+        return {"error": "Pet not found"}, 404
     
     return {"success": True, "message": "Pet deleted successfully"}
 
@@ -106,31 +118,55 @@ def upload_photo(id: str):
     if f.filename == '':
         return {"error": "No file selected"}, 400
     
-    # En este caso, asumimos que el frontend enviará la imagen en base64
-    # Para compatibilidad con el sistema actual
-    import base64
-    import io
-    
-    # Leer archivo y convertir a base64
-    file_data = f.read()
-    base64_data = base64.b64encode(file_data).decode('utf-8')
+    # Guardar por trozos en el almacén de blobs; el documento sólo guarda la URL
+    blob = save_upload(f)
+    # Miniaturas y WebP se generan en segundo plano tras guardar la URL
+    is_image = (f.mimetype or '').startswith('image/')
+    photo_update = {
+        "foto": blob['url'],
+        "fotoMiniaturas": pending_derivatives(blob['sha256']) if is_image else None,
+    }
     
     db = get_db()
-    try:
-        result = db.pets.update_one(
-            {"_id": ObjectId(id)}, 
-            {"$set": {"foto": f"data:{f.content_type};base64,{base64_data}"}}
-        )
-        if result.matched_count == 0:
-            return {"error": "Pet not found"}, 404
-        doc = db.pets.find_one({"_id": ObjectId(id)})
-    except:
-        result = db.pets.update_one(
-            {"id": id}, 
-            {"$set": {"foto": f"data:{f.content_type};base64,{base64_data}"}}
-        )
-        if result.matched_count == 0:
-            return {"error": "Pet not found"}, 404
-        doc = db.pets.find_one({"id": id})
+    doc = update_by_id(db.pets, id, {"$set": photo_update}, doc_projection('pets'))
+    if not doc:
+        return {"error": "Pet not found"}, 404
+    
+    if is_image:
+        schedule_derivatives('pets', doc['_id'], blob['sha256'])
     
     return {"success": True, "data": serialize_doc(doc)}
+
+@pets_bp.post('/bulk')
+def bulk_pets():
+    """Varias altas, cambios y bajas de mascotas en un solo bulk_write.
+
+    Cada operación: {"op": "create", "data": {...}}, {"op": "update", "id": ...,
+    "data": {...}} o {"op": "delete", "id": ...}
+    """
+    db = get_db()
+    items = bulk_items()
+    # Campos escritos por item, para encolar las miniaturas de las fotos nuevas
+    written = {}
+    
+    def create(item):
+        written[id(item)] = doc = _build_pet(item.get('data') or {})
+        return "insert", doc
+    
+    def update(item):
+        written[id(item)] = update_data = _pet_update(item.get('data') or {})
+        return "update", item.get('id'), {"$set": update_data}
+    
+    handlers = {
+        "create": create,
+        "update": update,
+        "delete": lambda item: ("delete", item.get('id')),
+    }
+    result = run_bulk(db.pets, items, handlers)
+    for r in result['data']:
+        fields = written.get(id(items[r['index']])) if r['ok'] else None
+        if fields and fields.get('fotoMiniaturas'):
+            doc = db.pets.find_one(id_filter(r['id']), {"_id": 1})
+            if doc:
+                schedule_photo('pets', doc['_id'], fields)
+    return result
@@ -1,8 +1,12 @@
 from flask import Blueprint, request
-from bson import ObjectId
 from datetime import datetime
 from ..db import get_db
+from ..repository import set_by_id
+from ..counters import record
 from ..utils.helpers import serialize_doc
+from ..utils.conditional import conditional_response, find_conditional
+from ..utils.pagination import paginate
+from ..utils.projection import doc_projection, list_projection
 
 precitas_bp = Blueprint('precitas', __name__)
 
@@ -16,22 +20,20 @@ def list_precitas():
     if estado:
         q['estado'] = estado
     
-    docs = [serialize_doc(d) for d in db.pre_citas.find(q).sort('fechaCreacion', -1).limit(200)]
-    return {"success": True, "data": docs}
+    projection = list_projection('pre_citas')
+    docs, next_cursor = paginate(db.pre_citas, q, [('fechaCreacion', -1)], default_limit=200, projection=projection)
+    return {"success": True, "data": [serialize_doc(d) for d in docs], "nextCursor": next_cursor}
 
 @precitas_bp.get('/<id>')
 def get_precita(id: str):
     """Obtener una pre-cita específica"""
     db = get_db()
-    try:
-        doc = db.pre_citas.find_one({"_id": ObjectId(id)})
-    except:
-        doc = db.pre_citas.find_one({"id": id})
+    doc, validators = find_conditional(db.pre_citas, id, doc_projection('pre_citas'))
     
     if not doc:
         return {"error": "Pre-cita not found"}, 404
     
-    return {"success": True, "data": serialize_doc(doc)}
+    return conditional_response({"success": True, "data": serialize_doc(doc)}, validators)
 
 @precitas_bp.post('')
 def create_precita():
@@ -65,6 +67,7 @@ def create_precita():
     
     res = db.pre_citas.insert_one(precita_doc)
     precita_doc['_id'] = res.inserted_id
+    record(db, 'pre_citas', [(None, precita_doc)])
     
     return {"success": True, "data": serialize_doc(precita_doc)}, 201
 
@@ -84,16 +87,10 @@ def aprobar_precita(id: str):
         "notasAdmin": data.get('notasAdmin'),
     }
     
-    try:
-        result = db.pre_citas.update_one({"_id": ObjectId(id)}, {"$set": update_data})
-        if result.matched_count == 0:
-            return {"error": "Pre-cita not found"}, 404
-        doc = db.pre_citas.find_one({"_id": ObjectId(id)})
-    except:
-        result = db.pre_citas.update_one({"id": id}, {"$set": update_data})
-        if result.matched_count == 0:
-            return {"error": "Pre-cita not found"}, 404
-        doc = db.pre_citas.find_one({"id": id})
+    before, doc = set_by_id(db.pre_citas, id, update_data, doc_projection('pre_citas'), needed=('estado',))
+    if not doc:
+        return {"error": "Pre-cita not found"}, 404
+    record(db, 'pre_citas', [(before, {**before, **update_data})])
     
     return {"success": True, "data": serialize_doc(doc)}
 
@@ -109,15 +106,9 @@ def rechazar_precita(id: str):
         "notasAdmin": data.get('notasAdmin', 'Pre-cita rechazada'),
     }
     
-    try:
-        result = db.pre_citas.update_one({"_id": ObjectId(id)}, {"$set": update_data})
-        if result.matched_count == 0:
-            return {"error": "Pre-cita not found"}, 404
-        doc = db.pre_citas.find_one({"_id": ObjectId(id)})
-    except:
-        result = db.pre_citas.update_one({"id": id}, {"$set": update_data})
-        if result.matched_count == 0:
-            return {"error": "Pre-cita not found"}, 404
-        doc = db.pre_citas.find_one({"id": id})
+    before, doc = set_by_id(db.pre_citas, id, update_data, doc_projection('pre_citas'), needed=('estado',))
+    if not doc:
+        return {"error": "Pre-cita not found"}, 404
+    record(db, 'pre_citas', [(before, {**before, **update_data})])
     
     return {"success": True, "data": serialize_doc(doc)}
@@ -0,0 +1,15 @@
+from flask import Blueprint, request, g
+from ..db import get_db
+from ..counters import read_stats
+
+stats_bp = Blueprint('stats', __name__)
+
+@stats_bp.get('')
+def get_stats():
+    """Contadores del panel (citas por estado, pre-citas pendientes, suscriptores activos).
+
+    Un veterinario sólo ve los de sus citas; un admin puede pedir ?veterinarioId=
+    """
+    db = get_db()
+    vet_id = g.user_id if g.role == 'veterinario' else request.args.get('veterinarioId')
+    return {"success": True, "data": read_stats(db, vet_id)}
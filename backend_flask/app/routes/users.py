@@ -1,12 +1,37 @@
-from flask import Blueprint, request
+from flask import Blueprint, request, g
 from bson import ObjectId
 from datetime import datetime
-from passlib.hash import bcrypt
+from pymongo.errors import DuplicateKeyError
 from ..db import get_db
+from ..repository import find_by_id, update_by_id
+from ..deletion import NOT_DELETED, public_job, start_user_deletion
 from ..utils.helpers import serialize_doc
+from ..utils.conditional import conditional_response, find_conditional
+from ..utils.passwords import hash_password
+from ..login_keys import LOGIN_FIELDS, duplicate_field, find_conflict, login_keys
+from ..search import SEARCH_FIELDS, search_tokens, search_users
+from ..storage import save_upload
+from ..images import pending_derivatives, schedule_derivatives, schedule_photo, store_photo
+from ..utils.pagination import page_limit, paginate
+from ..utils.projection import doc_projection, list_projection
+from ..utils.streaming import stream_docs, wants_stream
 
 users_bp = Blueprint('users', __name__)
 
+# Campos que acepta una edición; version, marcas de borrado, miniaturas y
+# claves derivadas los mantiene el servidor
+EDITABLE_FIELDS = ('nombre', 'apellidos', 'username', 'email', 'telefono', 'direccion', 'fechaNacimiento', 'genero',
+                   'rol', 'password', 'documento', 'tipoDocumento', 'foto', 'especialidad', 'experiencia',
+                   'colegiatura')
+
+def _public_user(doc):
+    """Serializar usuario sin campos sensibles"""
+    out = serialize_doc(doc)
+    out.pop('password', None)
+    out.pop('loginKeys', None)
+    out.pop('searchTokens', None)
+    return out
+
 @users_bp.get('')
 def list_users():
     """Listar usuarios con filtros opcionales"""
@@ -16,44 +41,38 @@ def list_users():
     rol = request.args.get('rol') or request.args.get('role')
     search = request.args.get('search')
     
-    q = {}
+    q = dict(NOT_DELETED)
     if rol:
         q['rol'] = rol
     
-    # Búsqueda por nombre o email
+    projection = list_projection('users')
+    
+    # Búsqueda por prefijos de nombre, apellidos o email, sin tildes (app/search.py)
     if search:
-        q['$or'] = [
-            {"nombre": {"$regex": search, "$options": "i"}},
-            {"email": {"$regex": search, "$options": "i"}},
-            {"apellidos": {"$regex": search, "$options": "i"}}
-        ]
+        docs = search_users(db, search, q, projection, page_limit(20, 100))
+        return {"success": True, "data": [_public_user(d) for d in docs], "nextCursor": None}
     
-    docs = [serialize_doc(d) for d in db.users.find(q).limit(200)]
+    if wants_stream():
+        return stream_docs(db.users, q, transform=_public_user, projection=projection)
     
+    page, next_cursor = paginate(db.users, q, default_limit=200, projection=projection)
     # Remover campos sensibles
-    for doc in docs:
-        if 'password' in doc:
-            del doc['password']
+    docs = [_public_user(d) for d in page]
     
-    return {"success": True, "data": docs}
+    return {"success": True, "data": docs, "nextCursor": next_cursor}
 
 @users_bp.get('/<id>')
 def get_user(id: str):
     """Obtener un usuario específico"""
     db = get_db()
-    try:
-        doc = db.users.find_one({"_id": ObjectId(id)})
-    except:
-        doc = db.users.find_one({"id": id})
+    doc, validators = find_conditional(db.users, id, doc_projection('users'), query=NOT_DELETED)
     
     if not doc:
         return {"error": "User not found"}, 404
     
-    doc = serialize_doc(doc)
-    if 'password' in doc:
-        del doc['password']
+    doc = _public_user(doc)
     
-    return {"success": True, "data": doc}
+    return conditional_response({"success": True, "data": doc}, validators)
 
 @users_bp.post('')
 def create_user():
@@ -67,20 +86,17 @@ def create_user():
         if not data.get(field):
             return {"error": f"{field} required"}, 400
     
-    # Verificar email único
-    if db.users.find_one({"email": data['email']}):
-        return {"error": "Email already exists"}, 409
-    
-    # Verificar username único si se proporciona
-    if data.get('username') and db.users.find_one({"username": data['username']}):
-        return {"error": "Username already exists"}, 409
+    # Verificar email, username y telefono únicos (mismas claves que el login)
+    conflict = find_conflict(db, data)
+    if conflict:
+        return {"error": f"{conflict.capitalize()} already exists"}, 409
     
     # Estructura del usuario compatible con AppContext
     user_doc = {
         "nombre": data['nombre'],
         "apellidos": data.get('apellidos'),
         "username": data.get('username'),
-        "email": data['email'],
+        "email": data['email'].strip().lower(),
         "telefono": data.get('telefono'),
         "direccion": data.get('direccion'),
         "fechaNacimiento": data.get('fechaNacimiento'),
@@ -89,7 +105,7 @@ def create_user():
         "documento": data.get('documento'),
         "tipoDocumento": data.get('tipoDocumento'),
         "fechaRegistro": datetime.utcnow(),
-        "foto": data.get('foto'),
+        **store_photo(data.get('foto')),
         # Campos para veterinarios
         "especialidad": data.get('especialidad'),
         "experiencia": data.get('experiencia'),
@@ -98,93 +114,120 @@ def create_user():
     
     # Hash password si se proporciona
     if data.get('password'):
-        user_doc['password'] = bcrypt.hash(data['password'])
+        user_doc['password'] = hash_password(data['password'])
+    
+    user_doc['loginKeys'] = login_keys(user_doc)
+    user_doc['searchTokens'] = search_tokens(user_doc)
     
-    res = db.users.insert_one(user_doc)
+    try:
+        res = db.users.insert_one(user_doc)
+    except DuplicateKeyError as e:
+        return {"error": f"{duplicate_field(e).capitalize()} already exists"}, 409
     user_doc['_id'] = res.inserted_id
+    schedule_photo('users', res.inserted_id, user_doc)
     
-    result = serialize_doc(user_doc)
-    if 'password' in result:
-        del result['password']
+    result = _public_user(user_doc)
     
     return {"success": True, "data": result}, 201
 
 @users_bp.put('/<id>')
 def update_user(id: str):
     """Actualizar usuario"""
-    db = get_db()
     data = request.get_json(force=True)
     
-    # Verificar email único si se está cambiando
-    if 'email' in data:
-        existing = db.users.find_one({"email": data['email']})
-        if existing and str(existing['_id']) != id:
-            return {"error": "Email already exists"}, 409
+    # Sólo un admin puede editar a otros usuarios o cambiar roles
+    if g.role != 'admin':
+        if id != g.user_id:
+            return {"error": "Forbidden"}, 403
+        data.pop('rol', None)
     
-    # Verificar username único si se está cambiando
-    if 'username' in data:
-        existing = db.users.find_one({"username": data['username']})
-        if existing and str(existing['_id']) != id:
-            return {"error": "Username already exists"}, 409
+    return _update_user(id, data)
+
+def _update_user(id: str, data: dict):
+    db = get_db()
+    data = {f: data[f] for f in EDITABLE_FIELDS if f in data}
+    
+    # Si cambia algún campo de login, recalcular loginKeys y verificar unicidad
+    if any(f in data for f in LOGIN_FIELDS):
+        if isinstance(data.get('email'), str):
+            data['email'] = data['email'].strip().lower()
+        current = find_by_id(db.users, id, {f: 1 for f in LOGIN_FIELDS}, query=NOT_DELETED)
+        if not current:
+            return {"error": "User not found"}, 404
+        merged = {**current, **data}
+        conflict = find_conflict(db, merged, exclude_id=current['_id'])
+        if conflict:
+            return {"error": f"{conflict.capitalize()} already exists"}, 409
+        data['loginKeys'] = login_keys(merged)
+    
+    # Si cambia nombre, apellidos o email, recalcular los prefijos de búsqueda
+    if any(f in data for f in SEARCH_FIELDS):
+        current = find_by_id(db.users, id, {f: 1 for f in SEARCH_FIELDS}, query=NOT_DELETED)
+        if not current:
+            return {"error": "User not found"}, 404
+        data['searchTokens'] = search_tokens({**current, **data})
     
     # Hash password si se está actualizando
     if 'password' in data:
-        data['password'] = bcrypt.hash(data['password'])
+        data['password'] = hash_password(data['password'])
+    
+    if data.get('foto'):
+        # Las miniaturas de la foto anterior ya no sirven
+        data.update(store_photo(data['foto']))
     
     # Añadir timestamp de actualización
     update_data = {**data, "fechaActualizacion": datetime.utcnow()}
     
     try:
-        result = db.users.update_one({"_id": ObjectId(id)}, {"$set": update_data})
-        if result.matched_count == 0:
-            return {"error": "User not found"}, 404
-        doc = db.users.find_one({"_id": ObjectId(id)})
-    except:
-        result = db.users.update_one({"id": id}, {"$set": update_data})
-        if result.matched_count == 0:
-            return {"error": "User not found"}, 404
-        doc = db.users.find_one({"id": id})
+        doc = update_by_id(db.users, id, {"$set": update_data}, doc_projection('users'), query=NOT_DELETED)
+    except DuplicateKeyError as e:
+        return {"error": f"{duplicate_field(e).capitalize()} already exists"}, 409
+    if not doc:
+        return {"error": "User not found"}, 404
     
-    result = serialize_doc(doc)
-    if 'password' in result:
-        del result['password']
+    schedule_photo('users', doc['_id'], data)
+    result = _public_user(doc)
     
     return {"success": True, "data": result}
 
 @users_bp.delete('/<id>')
 def delete_user(id: str):
-    """Eliminar usuario"""
-    db = get_db()
-    
-    try:
-        result = db.users.delete_one({"_id": ObjectId(id)})
-        if result.deleted_count == 0:
-            return {"error": "User not found"}, 404
-    except:
-        result = db.users.delete_one({"id": id})
-        if result.deleted_count == 0:
-            return {"error": "User not found"}, 404
+    """Eliminar usuario: se marca como borrado y sus datos se borran en segundo plano"""
+    job = start_user_deletion(id)
+    if job is None:
+        return {"error": "User not found"}, 404
     
-    # También eliminar mascotas y citas relacionadas
-    db.pets.delete_many({"clienteId": id})
-    db.appointments.delete_many({"clienteId": id})
-    db.notificaciones.delete_many({"usuarioId": id})
+    # Mascotas, citas, historial, notificaciones y blobs en app/deletion.py
+    return {"success": True, "data": public_job(job)}, 202
+
+@users_bp.get('/deletions/<job_id>')
+def get_deletion(job_id: str):
+    """Progreso del borrado de un usuario"""
+    db = get_db()
+    job = db.jobs.find_one({"_id": ObjectId(job_id), "tipo": "delete_user"}) if ObjectId.is_valid(job_id) else None
+    if not job:
+        return {"error": "Deletion job not found"}, 404
     
-    return {"success": True, "message": "User deleted successfully"}
+    return {"success": True, "data": public_job(job)}
 
 @users_bp.get('/profile')
 def get_profile():
     """Obtener perfil del usuario actual (requiere autenticación)"""
-    # Este endpoint necesitaría middleware de autenticación
-    # Por ahora retorna un placeholder
-    return {"error": "Authentication required"}, 401
+    db = get_db()
+    doc = find_by_id(db.users, g.user_id, doc_projection('users'), query=NOT_DELETED)
+    
+    if not doc:
+        return {"error": "User not found"}, 404
+    
+    return {"success": True, "data": _public_user(doc)}
 
 @users_bp.put('/profile')
 def update_profile():
     """Actualizar perfil del usuario actual (requiere autenticación)"""
-    # Este endpoint necesitaría middleware de autenticación
-    # Por ahora retorna un placeholder
-    return {"error": "Authentication required"}, 401
+    data = request.get_json(force=True)
+    # El rol no se cambia desde el propio perfil
+    data.pop('rol', None)
+    return _update_user(g.user_id, data)
 
 @users_bp.post('/upload-avatar')
 def upload_avatar():
@@ -196,36 +239,29 @@ def upload_avatar():
     if f.filename == '':
         return {"error": "No file selected"}, 400
     
-    # Convertir a base64 para compatibilidad con el frontend
-    import base64
-    
-    file_data = f.read()
-    base64_data = base64.b64encode(file_data).decode('utf-8')
-    
     user_id = request.form.get('userId')
     if not user_id:
         return {"error": "userId required"}, 400
     
+    # Como en update_user: sólo un admin cambia la foto de otro usuario
+    if g.role != 'admin' and user_id != g.user_id:
+        return {"error": "Forbidden"}, 403
+    
+    # Guardar por trozos en el almacén de blobs; el documento sólo guarda la URL
+    blob = save_upload(f)
+    # Miniaturas y WebP se generan en segundo plano tras guardar la URL
+    is_image = (f.mimetype or '').startswith('image/')
+    photo_update = {
+        "foto": blob['url'],
+        "fotoMiniaturas": pending_derivatives(blob['sha256']) if is_image else None,
+    }
+    
     db = get_db()
-    try:
-        result = db.users.update_one(
-            {"_id": ObjectId(user_id)}, 
-            {"$set": {"foto": f"data:{f.content_type};base64,{base64_data}"}}
-        )
-        if result.matched_count == 0:
-            return {"error": "User not found"}, 404
-        doc = db.users.find_one({"_id": ObjectId(user_id)})
-    except:
-        result = db.users.update_one(
-            {"id": user_id}, 
-            {"$set": {"foto": f"data:{f.content_type};base64,{base64_data}"}}
-        )
-        if result.matched_count == 0:
-            return {"error": "User not found"}, 404
-        doc = db.users.find_one({"id": user_id})
+    doc = update_by_id(db.users, user_id, {"$set": photo_update}, doc_projection('users'), query=NOT_DELETED)
+    if not doc:
+        return {"error": "User not found"}, 404
     
-    result = serialize_doc(doc)
-    if 'password' in result:
-        del result['password']
+    if is_image:
+        schedule_derivatives('users', doc['_id'], blob['sha256'])
     
-    return {"success": True, "data": result}
+    return {"success": True, "data": _public_user(doc)}
@@ -0,0 +1,100 @@
+import re
+import unicodedata
+
+import click
+from flask.cli import with_appcontext
+from pymongo import UpdateOne
+
+from .db import get_db
+from .repository import NOT_DELETED
+from .utils.projection import include_fields
+from .login_keys import users_cli
+
+# Campos de usuario por los que busca el panel de administración, con su peso al ordenar
+SEARCH_FIELDS = {'nombre': 3, 'apellidos': 3, 'email': 1}
+# Prefijos indexados por palabra: "gomez" -> g, go, gom, ... hasta PREFIX_MAX letras
+PREFIX_MAX = 15
+# Coincidencias que se leen para ordenarlas por relevancia
+SEARCH_CANDIDATES = 500
+
+_WORD_RE = re.compile(r'[a-z0-9]+')
+
+
+def fold(text):
+    """Minúsculas sin tildes ni diéresis: "Gómez Núñez" -> "gomez nunez" """
+    if not isinstance(text, str):
+        return ''
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c))
+
+
+def words(text):
+    """Palabras normalizadas de un texto; un email se parte en sus piezas"""
+    return _WORD_RE.findall(fold(text))
+
+
+def search_tokens(doc):
+    """Prefijos de búsqueda (`searchTokens`) de un usuario, ordenados"""
+    tokens = set()
+    for field in SEARCH_FIELDS:
+        for word in words(doc.get(field)):
+            tokens.update(word[:k] for k in range(1, min(len(word), PREFIX_MAX) + 1))
+    return sorted(tokens)
+
+
+def query_terms(search):
+    """Términos de una búsqueda tal como están en el índice (sin repetir)"""
+    return list(dict.fromkeys(w[:PREFIX_MAX] for w in words(search)))
+
+
+def _score(doc, terms):
+    score = 0
+    for field, weight in SEARCH_FIELDS.items():
+        field_words = words(doc.get(field))
+        for term in terms:
+            if term in field_words:
+                score += 2 * weight
+            elif any(w.startswith(term) for w in field_words):
+                score += weight
+    return score
+
+
+def search_users(db, search, query, projection, limit):
+    """Usuarios con todos los términos de `search` como prefijo de alguna palabra,
+    del más al menos relevante. Usa el índice de `searchTokens`; se ordenan como
+    mucho SEARCH_CANDIDATES coincidencias"""
+    terms = query_terms(search)
+    if not terms:
+        return []
+    extra = []
+    if projection and any(projection.values()):
+        # Proyección de inclusión: los campos buscados hacen falta para ordenar
+        extra = [f for f in SEARCH_FIELDS if f not in projection]
+        projection = include_fields(projection, extra)
+    q = {**query, "searchTokens": {"$all": terms}}
+    candidates = list(db.users.find(q, projection).limit(SEARCH_CANDIDATES))
+    candidates.sort(key=lambda d: (-_score(d, terms), fold(d.get('nombre')), fold(d.get('apellidos')),
+                                   str(d['_id'])))
+    out = candidates[:limit]
+    for doc in out:
+        for f in extra:
+            doc.pop(f, None)
+    return out
+
+
+@users_cli.command('backfill-search')
+@click.option('--batch-size', default=500, show_default=True)
+@with_appcontext
+def backfill_search_command(batch_size):
+    """Calcular searchTokens de los usuarios existentes"""
+    db = get_db()
+    ops = []
+    updated = 0
+    for doc in db.users.find(NOT_DELETED, {f: 1 for f in SEARCH_FIELDS}).batch_size(batch_size):
+        ops.append(UpdateOne({"_id": doc['_id'], **NOT_DELETED}, {"$set": {"searchTokens": search_tokens(doc)}}))
+        if len(ops) >= batch_size:
+            updated += db.users.bulk_write(ops, ordered=False).modified_count
+            ops.clear()
+    if ops:
+        updated += db.users.bulk_write(ops, ordered=False).modified_count
+    click.echo(f"{updated} usuarios actualizados")
@@ -0,0 +1,152 @@
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+import jwt
+from flask import g, request
+
+from .utils.jwt import verify_token
+
+PUBLIC = None
+AUTHENTICATED = frozenset()
+
+# Política de acceso en un solo sitio. Cada blueprint tiene una regla por
+# defecto: PUBLIC, AUTHENTICATED o el conjunto de roles permitidos.
+BLUEPRINT_RULES = {
+    'health': PUBLIC,
+    # Lo lee Prometheus con su propio token (METRICS_TOKEN, app/metrics.py)
+    'metrics': PUBLIC,
+    'auth': PUBLIC,
+    # URLs por contenido, las pide el navegador desde <img> sin cabeceras
+    'blobs': PUBLIC,
+    'users': AUTHENTICATED,
+    'pets': AUTHENTICATED,
+    'appointments': AUTHENTICATED,
+    'historial': AUTHENTICATED,
+    'precitas': frozenset({'admin', 'veterinario'}),
+    'notifications': AUTHENTICATED,
+    'newsletter': frozenset({'admin'}),
+    'stats': frozenset({'admin', 'veterinario'}),
+}
+
+# Excepciones por endpoint a la regla de su blueprint
+ENDPOINT_RULES = {
+    'precitas.create_precita': PUBLIC,
+    'newsletter.subscribe': PUBLIC,
+    'newsletter.unsubscribe': PUBLIC,
+    'users.create_user': frozenset({'admin'}),
+    'users.delete_user': frozenset({'admin'}),
+    'users.get_deletion': frozenset({'admin'}),
+    'appointments.validar_pago': frozenset({'admin'}),
+    # El cliente sólo pasa su cita a en_validacion subiendo el comprobante
+    'appointments.update_estado': frozenset({'admin', 'veterinario'}),
+    'appointments.atender': frozenset({'admin', 'veterinario'}),
+    'historial.create_consulta': frozenset({'admin', 'veterinario'}),
+    'historial.update_consulta': frozenset({'admin', 'veterinario'}),
+}
+
+# EventSource no puede enviar cabeceras: estos endpoints aceptan ?access_token=
+QUERY_TOKEN_ENDPOINTS = {'notifications.stream'}
+
+# Endpoints con credencial propia en Authorization, que no es un JWT
+OWN_TOKEN_ENDPOINTS = {'metrics.metrics'}
+
+
+class ClaimsCache:
+    """LRU acotado de claims ya verificados, por digest del token; respeta `exp`"""
+
+    def __init__(self, maxsize=10000):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, now):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry['exp'] <= now:
+                if entry is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, claims):
+        with self._lock:
+            self._data[key] = claims
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+
+claims_cache = ClaimsCache()
+
+
+def verify_access_token(token: str):
+    """Claims del token de acceso; sólo se verifica la firma la primera vez"""
+    key = hashlib.sha256(token.encode('utf-8')).digest()
+    claims = claims_cache.get(key, time.time())
+    if claims is None:
+        claims = verify_token(token, expected_type='access')
+        claims_cache.put(key, claims)
+    return claims
+
+
+def required_roles(endpoint):
+    if endpoint is None:
+        return PUBLIC
+    if endpoint in ENDPOINT_RULES:
+        return ENDPOINT_RULES[endpoint]
+    return BLUEPRINT_RULES.get(endpoint.split('.', 1)[0], AUTHENTICATED)
+
+
+def allowed(endpoint) -> bool:
+    """¿Puede el usuario actual (g.auth) acceder a `endpoint` según la política?"""
+    roles = required_roles(endpoint)
+    if roles is PUBLIC:
+        return True
+    auth = g.get('auth')
+    return auth is not None and (not roles or auth.get('role') in roles)
+
+
+def authenticate():
+    """before_request: valida el Bearer token y aplica la política de roles"""
+    if request.method == "OPTIONS":
+        return None
+
+    g.auth = None
+    header = request.headers.get('Authorization', '')
+    if request.endpoint in OWN_TOKEN_ENDPOINTS:
+        header = ''
+    token = header[7:].strip() if header.startswith('Bearer ') else None
+    if token is None and request.endpoint in QUERY_TOKEN_ENDPOINTS:
+        token = request.args.get('access_token')
+    if token is not None:
+        try:
+            g.auth = verify_access_token(token)
+        except jwt.PyJWTError:
+            return {"error": "invalid token"}, 401
+    g.user_id = g.auth['sub'] if g.auth else None
+    g.role = g.auth.get('role') if g.auth else None
+
+    roles = required_roles(request.endpoint)
+    if roles is PUBLIC:
+        return None
+    if g.auth is None:
+        return {"error": "Authentication required"}, 401
+    if roles and g.role not in roles:
+        return {"error": "Forbidden"}, 403
+    return None
+
+
+def init_auth(app):
+    claims_cache.maxsize = app.config['AUTH_CACHE_SIZE']
+    app.before_request(authenticate)
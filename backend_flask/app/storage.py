@@ -0,0 +1,256 @@
+import base64
+import binascii
+import hashlib
+import io
+import os
+import re
+import tempfile
+from datetime import datetime, timedelta
+
+import click
+import gridfs
+from flask import current_app
+from flask.cli import AppGroup, with_appcontext
+from pymongo.errors import DuplicateKeyError
+
+from .db import get_db
+from .repository import versioned
+
+CHUNK_SIZE = 64 * 1024
+BLOB_URL_PREFIX = '/api/blobs/'
+SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+DATA_URL_RE = re.compile(r'^data:([\w.+-]+/[\w.+-]+)?(;[^,]*)?;base64,', re.IGNORECASE)
+
+# Campos de documentos que guardan una referencia a un blob (o, en datos
+# antiguos, la data URL en línea)
+BLOB_FIELDS = {
+    'users': ['foto', 'fotoMiniaturas.thumb', 'fotoMiniaturas.card', 'fotoMiniaturas.webp'],
+    'pets': ['foto', 'fotoMiniaturas.thumb', 'fotoMiniaturas.card', 'fotoMiniaturas.webp'],
+    'appointments': ['comprobantePago', 'comprobanteData.data'],
+}
+
+
+class DiskBlobStore:
+    """Blobs en disco bajo UPLOAD_DIR, en rutas derivadas del SHA-256"""
+
+    def __init__(self, root):
+        self.root = root
+
+    def path(self, sha):
+        return os.path.join(self.root, sha[:2], sha[2:4], sha)
+
+    def put(self, stream):
+        tmp_dir = os.path.join(self.root, 'tmp')
+        os.makedirs(tmp_dir, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                    digest.update(chunk)
+                    out.write(chunk)
+                    size += len(chunk)
+            sha = digest.hexdigest()
+            final = self.path(sha)
+            if os.path.exists(final):
+                os.unlink(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(final), exist_ok=True)
+                os.replace(tmp_path, final)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+        return sha, size
+
+    def open(self, sha):
+        return open(self.path(sha), 'rb')
+
+    def delete(self, sha):
+        try:
+            os.unlink(self.path(sha))
+        except FileNotFoundError:
+            pass
+
+
+class GridFSBlobStore:
+    """Blobs en GridFS (bucket `blobs`), con el SHA-256 como nombre de archivo"""
+
+    def __init__(self, db):
+        self.db = db
+        self.bucket = gridfs.GridFSBucket(db, bucket_name='blobs')
+
+    def put(self, stream):
+        digest = hashlib.sha256()
+        size = 0
+        upload = self.bucket.open_upload_stream('pending')
+        try:
+            for chunk in iter(lambda: stream.read(CHUNK_SIZE), b''):
+                digest.update(chunk)
+                upload.write(chunk)
+                size += len(chunk)
+            upload.close()
+        except BaseException:
+            upload.abort()
+            raise
+        sha = digest.hexdigest()
+        files = self.db['blobs.files']
+        if files.count_documents({"filename": sha}, limit=1):
+            self.bucket.delete(upload._id)
+            return sha, size
+        # metadata.sha256 es único (app/indexes.py): de dos subidas simultáneas
+        # del mismo contenido sólo una se queda con el nombre
+        try:
+            files.update_one({"_id": upload._id}, {"$set": {"filename": sha, "metadata.sha256": sha}})
+        except DuplicateKeyError:
+            self.bucket.delete(upload._id)
+        return sha, size
+
+    def open(self, sha):
+        return self.bucket.open_download_stream_by_name(sha)
+
+    def delete(self, sha):
+        for f in self.db['blobs.files'].find({"filename": sha}, {"_id": 1}):
+            self.bucket.delete(f['_id'])
+
+
+def get_store():
+    if current_app.config['BLOB_BACKEND'] == 'gridfs':
+        return GridFSBlobStore(get_db())
+    return DiskBlobStore(current_app.config['UPLOAD_DIR'])
+
+
+def blob_url(sha: str) -> str:
+    return f"{BLOB_URL_PREFIX}{sha}"
+
+
+def blob_sha(value):
+    """SHA-256 de una referencia `/api/blobs/<sha>`, o None si no lo es"""
+    if isinstance(value, str) and value.startswith(BLOB_URL_PREFIX):
+        sha = value[len(BLOB_URL_PREFIX):]
+        if SHA256_RE.match(sha):
+            return sha
+    return None
+
+
+def save_stream(stream, content_type=None):
+    """Guardar un stream por trozos, deduplicado por contenido"""
+    sha, size = get_store().put(stream)
+    get_db().blobs.update_one(
+        {"_id": sha},
+        {"$setOnInsert": {
+            "size": size,
+            "contentType": content_type or 'application/octet-stream',
+            "fechaCreacion": datetime.utcnow(),
+        }},
+        upsert=True,
+    )
+    return {"sha256": sha, "size": size, "contentType": content_type, "url": blob_url(sha)}
+
+
+def save_upload(file_storage):
+    return save_stream(file_storage.stream, file_storage.content_type)
+
+
+def parse_data_url(value):
+    """(content_type, bytes) de una data URL en base64, o None"""
+    if not isinstance(value, str):
+        return None
+    m = DATA_URL_RE.match(value)
+    if not m:
+        return None
+    try:
+        data = base64.b64decode(value[m.end():], validate=False)
+    except (binascii.Error, ValueError):
+        return None
+    return m.group(1) or 'application/octet-stream', data
+
+
+def store_data_url(value):
+    """Sustituir una data URL en línea por la URL de su blob; otros valores no cambian"""
+    parsed = parse_data_url(value)
+    if parsed is None:
+        return value
+    content_type, data = parsed
+    return save_stream(io.BytesIO(data), content_type)['url']
+
+
+def _get_path(doc, dotted):
+    for part in dotted.split('.'):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(part)
+    return doc
+
+
+def blob_shas(collection, doc):
+    """SHA-256 de los blobs que referencia un documento de `collection`"""
+    shas = set()
+    for field in BLOB_FIELDS.get(collection, []):
+        sha = blob_sha(_get_path(doc, field))
+        if sha:
+            shas.add(sha)
+    return shas
+
+
+def release_blobs(db, shas):
+    """Borrar los blobs de `shas` que ya no referencia ningún documento"""
+    shas = set(shas)
+    if not shas:
+        return 0
+    urls = [blob_url(sha) for sha in shas]
+    for collection, fields in BLOB_FIELDS.items():
+        for field in fields:
+            for doc in db[collection].find({field: {"$in": urls}}, {field: 1}):
+                shas.discard(blob_sha(_get_path(doc, field)))
+    store = get_store()
+    for sha in shas:
+        store.delete(sha)
+        db.blobs.delete_one({"_id": sha})
+    return len(shas)
+
+
+blobs_cli = AppGroup('blobs', help="Almacenamiento de fotos y comprobantes")
+
+
+@blobs_cli.command('migrate')
+@click.option('--batch-size', default=100, show_default=True)
+@with_appcontext
+def migrate_command(batch_size):
+    """Mover las data URLs en línea de los documentos al almacén de blobs"""
+    db = get_db()
+    for collection, fields in BLOB_FIELDS.items():
+        moved = 0
+        for field in fields:
+            query = {field: {"$regex": "^data:"}}
+            cursor = db[collection].find(query, {field: 1}).batch_size(batch_size)
+            for doc in cursor:
+                url = store_data_url(_get_path(doc, field))
+                db[collection].update_one({"_id": doc['_id']}, versioned(db[collection], {"$set": {field: url}}))
+                moved += 1
+        click.echo(f"{collection}: {moved} campos migrados")
+
+
+@blobs_cli.command('gc')
+@click.option('--grace-hours', default=24, show_default=True)
+@with_appcontext
+def gc_command(grace_hours):
+    """Borrar blobs que ya no referencia ningún documento"""
+    db = get_db()
+    referenced = set()
+    for collection, fields in BLOB_FIELDS.items():
+        for field in fields:
+            for doc in db[collection].find({field: {"$regex": f"^{BLOB_URL_PREFIX}"}}, {field: 1}):
+                sha = blob_sha(_get_path(doc, field))
+                if sha:
+                    referenced.add(sha)
+    cutoff = datetime.utcnow() - timedelta(hours=grace_hours)
+    store = get_store()
+    removed = 0
+    for blob in db.blobs.find({"fechaCreacion": {"$lt": cutoff}}, {"_id": 1}):
+        if blob['_id'] not in referenced:
+            store.delete(blob['_id'])
+            db.blobs.delete_one({"_id": blob['_id']})
+            removed += 1
+    click.echo(f"{removed} blobs eliminados")
@@ -0,0 +1,112 @@
+from bson import ObjectId
+from flask import request, abort, make_response
+from pymongo import InsertOne, UpdateOne, DeleteOne
+from pymongo.errors import BulkWriteError
+from ..security import allowed
+from ..repository import id_filter, versioned
+
+BULK_MAX_ITEMS = 500
+
+
+def requires(endpoint, handler):
+    """Aplicar a una operación bulk la misma política de roles que su ruta individual"""
+    def guarded(item):
+        if not allowed(endpoint):
+            raise ValueError("forbidden")
+        return handler(item)
+    return guarded
+
+
+def bulk_items():
+    """Operaciones del cuerpo: una lista o {"operations": [...]}"""
+    data = request.get_json(force=True)
+    items = data.get('operations') if isinstance(data, dict) else data
+    if not isinstance(items, list) or not items:
+        abort(make_response({"error": "operations required"}, 400))
+    if len(items) > BULK_MAX_ITEMS:
+        abort(make_response({"error": f"at most {BULK_MAX_ITEMS} operations per request"}, 400))
+    return items
+
+
+def _existing(collection, ids):
+    oids = [ObjectId(i) for i in ids if ObjectId.is_valid(i)]
+    legacy = [i for i in ids if not ObjectId.is_valid(i)]
+    clauses = []
+    if oids:
+        clauses.append({"_id": {"$in": oids}})
+    if legacy:
+        clauses.append({"id": {"$in": legacy}})
+    if not clauses:
+        return set()
+    found = set()
+    for doc in collection.find({"$or": clauses}, {"_id": 1, "id": 1}):
+        found.add(str(doc['_id']))
+        if doc.get('id') is not None:
+            found.add(doc['id'])
+    return found
+
+
+def run_bulk(collection, items, handlers):
+    """Ejecutar operaciones en un único bulk_write no ordenado.
+
+    `handlers` mapea cada `op` a una función item -> acción, donde la acción es
+    ("insert", doc), ("update", id, update) o ("delete", id). Las funciones
+    lanzan ValueError si el item no es válido. Devuelve la respuesta con un
+    resultado por item, en el mismo orden.
+    """
+    results = [None] * len(items)
+    actions = []
+    for index, item in enumerate(items):
+        handler = handlers.get(item.get('op')) if isinstance(item, dict) else None
+        if handler is None:
+            results[index] = {"index": index, "ok": False, "error": "unknown op"}
+            continue
+        try:
+            action = handler(item)
+            if action[0] != 'insert' and not isinstance(action[1], str):
+                raise ValueError("id required")
+        except ValueError as e:
+            results[index] = {"index": index, "ok": False, "error": str(e)}
+            continue
+        actions.append((index, action))
+
+    # Una sola consulta para saber qué ids existen
+    found = _existing(collection, [a[1] for _, a in actions if a[0] != 'insert'])
+    requests = []
+    request_items = []
+    for index, action in actions:
+        kind = action[0]
+        if kind == 'insert':
+            action[1].setdefault('_id', ObjectId())
+            requests.append(InsertOne(action[1]))
+        elif action[1] not in found:
+            results[index] = {"index": index, "ok": False, "error": "not found"}
+            continue
+        elif kind == 'update':
+            requests.append(UpdateOne(id_filter(action[1]), versioned(collection, action[2])))
+        else:
+            requests.append(DeleteOne(id_filter(action[1])))
+        request_items.append((index, action))
+
+    failed = {}
+    summary = {"inserted": 0, "modified": 0, "deleted": 0}
+    if requests:
+        try:
+            res = collection.bulk_write(requests, ordered=False)
+            summary = {"inserted": res.inserted_count, "modified": res.modified_count, "deleted": res.deleted_count}
+        except BulkWriteError as e:
+            details = e.details
+            summary = {"inserted": details.get('nInserted', 0), "modified": details.get('nModified', 0),
+                       "deleted": details.get('nRemoved', 0)}
+            failed = {err['index']: err.get('errmsg', 'write error') for err in details.get('writeErrors', [])}
+
+    for pos, (index, action) in enumerate(request_items):
+        if pos in failed:
+            results[index] = {"index": index, "ok": False, "error": failed[pos]}
+        elif action[0] == 'insert':
+            results[index] = {"index": index, "ok": True, "id": str(action[1]['_id'])}
+        else:
+            results[index] = {"index": index, "ok": True, "id": action[1]}
+
+    errors = sum(1 for r in results if not r['ok'])
+    return {"success": errors == 0, "data": results, "summary": {**summary, "errors": errors}}
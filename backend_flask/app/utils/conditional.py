@@ -0,0 +1,64 @@
+import hashlib
+from datetime import datetime, timezone
+
+from flask import Response, abort, make_response, request
+
+from ..repository import find_by_id
+from .projection import include_fields
+
+# Campos que identifican la versión de un documento (ver repository.VERSIONED)
+VERSION_FIELDS = ('version', 'fechaActualizacion', 'fechaCreacion')
+
+
+def _validators(doc):
+    """(ETag, Last-Modified) de un documento; el ETag cambia con la versión y con la query (?fields=...)"""
+    changed = doc.get('fechaActualizacion')
+    raw = f"{doc['_id']}:{doc.get('version', 0)}:{changed}:{request.query_string.decode()}"
+    etag = hashlib.sha1(raw.encode('utf-8')).hexdigest()[:20]
+    modified = changed or doc.get('fechaCreacion')
+    if not isinstance(modified, datetime):
+        return etag, None
+    return etag, modified if modified.tzinfo else modified.replace(tzinfo=timezone.utc)
+
+
+def _apply(response, validators):
+    etag, modified = validators
+    response.set_etag(etag)
+    if modified is not None:
+        response.last_modified = modified
+    # Datos con autenticación: sólo caché del navegador, revalidando siempre
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+
+def find_conditional(collection, id, projection=None, query=None):
+    """Documento por id para un GET condicional: (documento, validadores).
+
+    Si la petición trae If-None-Match / If-Modified-Since y el cliente ya tiene
+    la versión actual, responde 304 tras leer sólo los campos de versión, sin
+    traer el documento. Documento None si no existe.
+    """
+    if request.if_none_match or request.if_modified_since:
+        current = find_by_id(collection, id, {f: 1 for f in VERSION_FIELDS}, query=query)
+        if current is None:
+            return None, None
+        response = _apply(Response(status=200), _validators(current)).make_conditional(request)
+        if response.status_code == 304:
+            abort(response)
+
+    extra = ()
+    if projection and any(v for v in projection.values()):
+        extra = [f for f in VERSION_FIELDS if f not in projection]
+        projection = include_fields(projection, extra)
+    doc = find_by_id(collection, id, projection, query=query)
+    if doc is None:
+        return None, None
+    validators = _validators(doc)
+    for f in extra:
+        doc.pop(f, None)
+    return doc, validators
+
+
+def conditional_response(payload, validators):
+    """Respuesta JSON con ETag y Last-Modified"""
+    return _apply(make_response(payload), validators)
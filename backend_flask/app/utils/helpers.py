@@ -1,5 +1,4 @@
 from bson import ObjectId
-from datetime import datetime
 
 
 def to_object_id(value: str) -> ObjectId:
@@ -10,22 +9,18 @@ def to_object_id(value: str) -> ObjectId:
 
 
 def serialize_doc(doc):
+    """Preparar un documento para la respuesta: `_id` pasa a `id`.
+
+    Devuelve una copia superficial; el documento original no cambia. ObjectId,
+    datetime, etc. a cualquier nivel los convierte el proveedor JSON
+    (utils/json_provider.py).
+    """
     if not doc:
         return None
-    # shallow copy
-    out = {}
-    # id primero
-    _id = doc.get("_id")
+    doc = dict(doc)
+    _id = doc.pop("_id", None)
     if isinstance(_id, ObjectId):
-        out["id"] = str(_id)
-    # copiar resto convirtiendo tipos
-    for k, v in doc.items():
-        if k == "_id":
-            continue
-        if isinstance(v, ObjectId):
-            out[k] = str(v)
-        elif isinstance(v, datetime):
-            out[k] = v.isoformat()
-        else:
-            out[k] = v
-    return out
+        doc["id"] = str(_id)
+    elif _id is not None:
+        doc["id"] = _id
+    return doc
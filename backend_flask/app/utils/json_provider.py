@@ -0,0 +1,42 @@
+import base64
+import decimal
+import orjson
+from bson import ObjectId, Decimal128
+from flask.json.provider import JSONProvider
+
+# Los datetime sin zona vienen de Mongo y son UTC: se emiten con "Z"
+_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_NAIVE_UTC | orjson.OPT_UTC_Z
+
+
+def bson_default(value):
+    """Tipos BSON que orjson no conoce; se aplica a cualquier nivel de anidamiento"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    # Decimales como texto: pasar por float perdería precisión (importes)
+    if isinstance(value, Decimal128):
+        return str(value.to_decimal())
+    if isinstance(value, decimal.Decimal):
+        return str(value)
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(bytes(value)).decode('ascii')
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+class ORJSONProvider(JSONProvider):
+    """Proveedor JSON de Flask con orjson y soporte de ObjectId, datetime,
+    Decimal128 y bytes anidados"""
+
+    mimetype = "application/json"
+
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, default=bson_default, option=_OPTIONS).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=bson_default, option=_OPTIONS)
+        return self._app.response_class(body, mimetype=self.mimetype)
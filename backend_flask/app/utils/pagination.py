@@ -0,0 +1,97 @@
+import base64
+from flask import request, abort, make_response
+from bson import json_util
+from pymongo import ASCENDING
+from .projection import include_fields
+
+
+def encode_cursor(fields, values) -> str:
+    raw = json_util.dumps({"k": fields, "v": values}).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token: str, fields):
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        payload = json_util.loads(raw)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not isinstance(payload, dict) or payload.get("k") != fields:
+        raise ValueError("Invalid cursor")
+    values = payload.get("v")
+    if not isinstance(values, list) or len(values) != len(fields):
+        raise ValueError("Invalid cursor")
+    return values
+
+
+def _after(field, direction, value):
+    """Condición 'viene después de value' para un solo campo del orden"""
+    if value is None:
+        # null/ausente ordena primero: en ascendente sigue cualquier valor,
+        # en descendente no queda nada detrás
+        return {field: {"$ne": None}} if direction == ASCENDING else None
+    op = "$gt" if direction == ASCENDING else "$lt"
+    return {field: {op: value}}
+
+
+def keyset_filter(sort, values):
+    """Filtro que reanuda un orden (f1, f2, ..., _id) justo después de values"""
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        cond = _after(field, direction, values[i])
+        if cond is None:
+            continue
+        prefix = {sort[j][0]: values[j] for j in range(i)}
+        clauses.append({**prefix, **cond})
+    return {"$or": clauses} if clauses else {"_id": {"$exists": False}}
+
+
+def page_limit(default: int, maximum: int = 1000) -> int:
+    try:
+        limit = int(request.args.get('limit', default))
+    except (TypeError, ValueError):
+        abort(make_response({"error": "limit must be an integer"}, 400))
+    return max(1, min(limit, maximum))
+
+
+def paged_find(collection, query, sort=(), limit=None, projection=None):
+    """find() ordenado por sort + `_id` y reanudado desde ?cursor= si viene.
+
+    Devuelve (cursor de pymongo, campos del orden); limit None = sin límite.
+    """
+    sort = list(sort)
+    last_direction = sort[-1][1] if sort else ASCENDING
+    sort.append(("_id", last_direction))
+    fields = [f for f, _ in sort]
+
+    token = request.args.get('cursor')
+    if token:
+        try:
+            values = decode_cursor(token, fields)
+        except ValueError:
+            abort(make_response({"error": "invalid cursor"}, 400))
+        after = keyset_filter(sort, values)
+        query = {"$and": [query, after]} if query else after
+
+    if projection and any(projection.values()):
+        # Proyección de inclusión: los campos del orden hacen falta para el cursor
+        projection = include_fields(projection, fields)
+    cursor = collection.find(query, projection).sort(sort)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+    return cursor, fields
+
+
+def paginate(collection, query, sort=(), default_limit=100, max_limit=1000, projection=None):
+    """Paginación por cursor (keyset) sobre el orden dado más `_id`.
+
+    Devuelve (docs, next_cursor); next_cursor es None en la última página.
+    """
+    limit = page_limit(default_limit, max_limit)
+    cursor, fields = paged_find(collection, query, sort, limit + 1, projection)
+    docs = list(cursor)
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        next_cursor = encode_cursor(fields, [docs[-1].get(f) for f in fields])
+    return docs, next_cursor
@@ -0,0 +1,128 @@
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from passlib.context import CryptContext
+
+
+class PasswordBusy(Exception):
+    """La cola de hashing está llena; el cliente debe reintentar"""
+
+
+class HashStats:
+    """Tiempos de hash/verify de bcrypt en este proceso"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._ops = {}
+        self.rejected = 0
+
+    def record(self, op, seconds):
+        with self._lock:
+            count, total, worst = self._ops.get(op, (0, 0.0, 0.0))
+            self._ops[op] = (count + 1, total + seconds, max(worst, seconds))
+
+    def reject(self):
+        with self._lock:
+            self.rejected += 1
+
+    def snapshot(self):
+        with self._lock:
+            out = {
+                op: {"count": count, "avgMs": round(total / count * 1000, 2), "maxMs": round(worst * 1000, 2)}
+                for op, (count, total, worst) in self._ops.items()
+            }
+            out["rejected"] = self.rejected
+            out["inFlight"] = _in_flight
+            return out
+
+
+hash_stats = HashStats()
+
+_executor = None
+_executor_pid = None
+_slots = None
+_in_flight = 0
+_contexts = {}
+_lock = threading.Lock()
+
+
+def _get_context(rounds):
+    ctx = _contexts.get(rounds)
+    if ctx is None:
+        # min = max = rounds: cualquier hash con otro coste se marca para rehash
+        ctx = _contexts[rounds] = CryptContext(
+            schemes=["bcrypt"],
+            bcrypt__rounds=rounds,
+            bcrypt__min_rounds=rounds,
+            bcrypt__max_rounds=rounds,
+        )
+    return ctx
+
+
+def _thread_pool(workers):
+    """Pool de hilos del sistema. Con workers gevent (monkey patching) los hilos
+    de `threading` son greenlets y un hash bloquearía el worker entero; el pool
+    de gevent usa hilos reales y espera el resultado sin bloquear"""
+    monkey = sys.modules.get('gevent.monkey')
+    if monkey is not None and monkey.is_module_patched('threading'):
+        from gevent.threadpool import ThreadPoolExecutor as GeventThreadPoolExecutor
+        return GeventThreadPoolExecutor(max_workers=workers)
+    return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='bcrypt')
+
+
+def _get_executor():
+    global _executor, _executor_pid, _slots
+    pid = os.getpid()
+    if _executor is None or _executor_pid != pid:
+        with _lock:
+            if _executor is None or _executor_pid != pid:
+                cfg = current_app.config
+                _executor = _thread_pool(cfg['PASSWORD_HASH_WORKERS'])
+                _slots = threading.BoundedSemaphore(cfg['PASSWORD_HASH_WORKERS'] + cfg['PASSWORD_HASH_QUEUE'])
+                _executor_pid = pid
+    return _executor, _slots
+
+
+def _run(op, fn, *args):
+    """Ejecutar fn en el pool de bcrypt; PasswordBusy si no hay hueco"""
+    global _in_flight
+    executor, slots = _get_executor()
+    if not slots.acquire(blocking=False):
+        hash_stats.reject()
+        raise PasswordBusy()
+
+    def timed():
+        start = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            hash_stats.record(op, time.perf_counter() - start)
+
+    with _lock:
+        _in_flight += 1
+    try:
+        return executor.submit(timed).result()
+    finally:
+        with _lock:
+            _in_flight -= 1
+        slots.release()
+
+
+def hash_password(password: str) -> str:
+    ctx = _get_context(current_app.config['BCRYPT_ROUNDS'])
+    return _run('hash', ctx.hash, password)
+
+
+def verify_password(password: str, hashed):
+    """(válida, hash_nuevo). hash_nuevo no es None si el coste guardado difiere del configurado"""
+    if not hashed:
+        return False, None
+    ctx = _get_context(current_app.config['BCRYPT_ROUNDS'])
+    try:
+        return _run('verify', ctx.verify_and_update, password, hashed)
+    except ValueError:
+        # Hash con formato desconocido
+        return False, None
@@ -0,0 +1,109 @@
+import re
+from flask import request, abort, make_response
+
+# Campos con data URLs en base64 (o arrays grandes): sólo se devuelven en los
+# GET de un documento, nunca por defecto en los listados. Para fotos, los
+# listados usan `fotoMiniaturas` (ver app/images.py) en lugar del original
+HEAVY_FIELDS = {
+    'users': ['foto'],
+    'pets': ['foto'],
+    'appointments': ['comprobantePago', 'comprobanteData', 'historialData'],
+    'historial_clinico': ['archivosAdjuntos'],
+    'newsletter_emails': ['imagenes', 'archivos', 'destinatarios', 'contenido'],
+}
+
+# Campos que nunca salen de la API
+HIDDEN_FIELDS = {
+    'users': ['password', 'loginKeys', 'searchTokens'],
+}
+
+# Vistas con nombre (?view=) para las tablas del frontend
+VIEWS = {
+    'users': {
+        'summary': ['nombre', 'apellidos', 'username', 'email', 'telefono', 'rol', 'fechaRegistro',
+                    'fotoMiniaturas.thumb'],
+    },
+    'pets': {
+        'summary': ['nombre', 'especie', 'raza', 'sexo', 'fechaNacimiento', 'estado', 'clienteId',
+                    'fotoMiniaturas.thumb'],
+    },
+    'appointments': {
+        'summary': ['mascota', 'mascotaId', 'especie', 'clienteId', 'clienteNombre', 'fecha', 'estado',
+                    'veterinario', 'veterinarioId', 'motivo', 'tipoConsulta', 'precio'],
+    },
+    'historial_clinico': {
+        'summary': ['mascotaId', 'mascotaNombre', 'fecha', 'veterinario', 'veterinarioId', 'tipoConsulta',
+                    'motivo', 'diagnostico', 'estado'],
+    },
+    'notificaciones': {
+        'summary': ['usuarioId', 'tipo', 'titulo', 'leida', 'fechaCreacion'],
+    },
+    'pre_citas': {
+        'summary': ['nombreCliente', 'telefono', 'email', 'nombreMascota', 'tipoMascota', 'estado',
+                    'fechaPreferida', 'horaPreferida', 'fechaCreacion'],
+    },
+    'newsletter_suscriptores': {
+        'summary': ['email', 'activo', 'fechaSuscripcion'],
+    },
+    'newsletter_emails': {
+        'summary': ['asunto', 'estado', 'fechaEnvio', 'totalEnviados'],
+    },
+}
+
+_FIELD_RE = re.compile(r'^[A-Za-z0-9_]+(\.[A-Za-z0-9_]+)*$')
+
+
+def _bad_request(message):
+    abort(make_response({"error": message}, 400))
+
+
+def list_projection(collection_name):
+    """Proyección de Mongo para un listado según ?fields= / ?view=.
+
+    Sin parámetros se excluyen los campos pesados; `view=full` los incluye.
+    """
+    hidden = HIDDEN_FIELDS.get(collection_name, [])
+    fields = request.args.get('fields')
+    view = request.args.get('view')
+
+    if fields:
+        names = [f.strip() for f in fields.split(',') if f.strip()]
+        for name in names:
+            if not _FIELD_RE.match(name):
+                _bad_request(f"invalid field: {name}")
+    elif view and view != 'full':
+        names = VIEWS.get(collection_name, {}).get(view)
+        if names is None:
+            _bad_request(f"unknown view: {view}")
+    else:
+        excluded = hidden if view == 'full' else hidden + HEAVY_FIELDS.get(collection_name, [])
+        return {f: 0 for f in excluded} or None
+
+    included = [n for n in names if n not in hidden and n not in ('id', '_id')]
+    # Un campo y una subruta suya chocan en Mongo (Path collision); al ordenar,
+    # cada subruta queda justo detrás de su campo
+    paths = sorted(set(included))
+    for parent, child in zip(paths, paths[1:]):
+        if child.startswith(parent + '.'):
+            _bad_request(f"overlapping fields: {parent}, {child}")
+    return {f: 1 for f in included} or {"_id": 1}
+
+
+def include_fields(projection, names):
+    """Proyección de inclusión con además los campos `names`, sin colisiones:
+    un campo ya cubierto por otro no se añade y el añadido sustituye a sus subrutas"""
+    out = dict(projection)
+    for name in names:
+        if any(name == k or name.startswith(k + '.') for k in out):
+            continue
+        out = {k: v for k, v in out.items() if not k.startswith(name + '.')}
+        out[name] = 1
+    return out
+
+
+def doc_projection(collection_name):
+    """Proyección para la respuesta de un solo documento: como list_projection,
+    pero sin parámetros se devuelve el documento completo (`view=full`)"""
+    if request.args.get('fields') or request.args.get('view'):
+        return list_projection(collection_name)
+    return {f: 0 for f in HIDDEN_FIELDS.get(collection_name, [])} or None
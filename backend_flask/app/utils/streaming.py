@@ -0,0 +1,42 @@
+from flask import Response, current_app, request, stream_with_context
+from .helpers import serialize_doc
+from .pagination import encode_cursor, page_limit, paged_find
+
+NDJSON = 'application/x-ndjson'
+
+
+def wants_stream() -> bool:
+    """El cliente pidió NDJSON con `Accept: application/x-ndjson` o `?stream=1`"""
+    if request.args.get('stream', '').lower() in ('1', 'true'):
+        return True
+    return request.accept_mimetypes.best_match(['application/json', NDJSON]) == NDJSON
+
+
+def stream_docs(collection, query, sort=(), transform=serialize_doc, max_limit=100000, projection=None):
+    """Respuesta NDJSON: un documento serializado por línea, según llegan del cursor.
+
+    Sin `?limit=` se recorre todo el resultado (exportaciones). Con límite, si
+    quedan más documentos la última línea es `{"nextCursor": ...}`.
+    """
+    limit = page_limit(max_limit, max_limit) if 'limit' in request.args else None
+    cursor, fields = paged_find(collection, query, sort, None if limit is None else limit + 1, projection)
+    batch_size = request.args.get('batchSize', type=int) or current_app.config['STREAM_BATCH_SIZE']
+    cursor.batch_size(max(1, min(batch_size, 10000)))
+    dumps = current_app.json.dumps
+
+    def generate():
+        sent = 0
+        last_key = None
+        try:
+            for doc in cursor:
+                if limit is not None and sent == limit:
+                    yield dumps({"nextCursor": encode_cursor(fields, last_key)}) + "\n"
+                    break
+                # La clave se toma antes de serializar (serialize_doc quita `_id`)
+                last_key = [doc.get(f) for f in fields]
+                yield dumps(transform(doc)) + "\n"
+                sent += 1
+        finally:
+            cursor.close()
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON)
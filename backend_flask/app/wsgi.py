@@ -0,0 +1,4 @@
+from . import create_app
+
+# Punto de entrada WSGI para gunicorn (ver gunicorn.conf.py)
+app = create_app()
@@ -0,0 +1,110 @@
+"""Microbenchmark: serialización de 500 citas, ruta anterior vs. actual.
+
+Anterior: serialize_doc superficial (copia por documento) + DefaultJSONProvider
+de Flask. Actual: serialize_doc sin copia + ORJSONProvider.
+
+    python -m benchmarks.bench_json [--docs 500] [--rounds 200]
+"""
+import argparse
+import copy
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from flask import Flask
+from flask.json.provider import DefaultJSONProvider
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.utils.helpers import serialize_doc  # noqa: E402
+from app.utils.json_provider import ORJSONProvider  # noqa: E402
+
+
+def legacy_serialize_doc(doc):
+    """serialize_doc tal como era antes (sólo convierte el primer nivel)"""
+    if not doc:
+        return None
+    out = {}
+    _id = doc.get("_id")
+    if isinstance(_id, ObjectId):
+        out["id"] = str(_id)
+    for k, v in doc.items():
+        if k == "_id":
+            continue
+        if isinstance(v, ObjectId):
+            out[k] = str(v)
+        elif isinstance(v, datetime):
+            out[k] = v.isoformat()
+        else:
+            out[k] = v
+    return out
+
+
+def make_appointments(n):
+    base = datetime(2024, 1, 1, 9, 0)
+    docs = []
+    for i in range(n):
+        docs.append({
+            "_id": ObjectId(),
+            "mascota": f"Mascota {i}",
+            "mascotaId": str(ObjectId()),
+            "especie": "perro",
+            "clienteId": str(ObjectId()),
+            "clienteNombre": f"Cliente {i}",
+            "fecha": (base + timedelta(hours=i)).isoformat(),
+            "estado": "aceptada",
+            "veterinario": "Dra. García",
+            "veterinarioId": str(ObjectId()),
+            "motivo": "Control anual y vacunas",
+            "tipoConsulta": "consulta_general",
+            "ubicacion": "Clínica Principal",
+            "precio": 80,
+            "notas": "Sin observaciones",
+            "comprobanteData": {
+                "originalName": "pago.jpg",
+                "size": 123456,
+                "type": "image/jpeg",
+                "timestamp": 1704100000000 + i,
+            },
+            "historialData": {
+                "diagnostico": "Sano",
+                "peso": 12.5,
+                "fecha": base + timedelta(hours=i, minutes=30),
+            },
+            "fechaCreacion": base + timedelta(minutes=i),
+            "fechaActualizacion": base + timedelta(minutes=i, seconds=30),
+        })
+    return docs
+
+
+def bench(name, serialize, provider, docs, rounds):
+    batches = [copy.deepcopy(docs) for _ in range(rounds)]
+    size = 0
+    start = time.perf_counter()
+    for batch in batches:
+        body = provider.dumps({"success": True, "data": [serialize(d) for d in batch]})
+        size = len(body)
+    elapsed = time.perf_counter() - start
+    per_payload = elapsed / rounds * 1000
+    print(f"{name:<10} {per_payload:8.2f} ms/payload  {len(docs) * rounds / elapsed:10.0f} docs/s  {size / 1024:7.1f} KiB")
+    return per_payload
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--docs', type=int, default=500)
+    parser.add_argument('--rounds', type=int, default=200)
+    args = parser.parse_args()
+
+    app = Flask(__name__)
+    docs = make_appointments(args.docs)
+    with app.app_context():
+        legacy = bench("anterior", legacy_serialize_doc, DefaultJSONProvider(app), docs, args.rounds)
+        current = bench("actual", serialize_doc, ORJSONProvider(app), docs, args.rounds)
+    print(f"speedup    {legacy / current:8.2f}x")
+
+
+if __name__ == "__main__":
+    main()
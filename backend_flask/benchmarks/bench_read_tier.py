@@ -0,0 +1,186 @@
+"""Benchmark de carga: lecturas de la API Flask frente al servicio FastAPI/motor (backend/).
+
+Carga un conjunto de datos sintético en la base de datos que usan los dos
+servicios (se borra al empezar), crea los índices del registro y lanza las
+mismas peticiones GET contra cada servicio con N clientes concurrentes
+(conexiones keep-alive). Mide peticiones por segundo y latencias p50/p95/p99.
+Los dos servicios tienen que estar arrancados contra esa base de datos y con
+el mismo JWT_SECRET; por ejemplo:
+
+    MONGO_DB=petla_bench JWT_SECRET=bench flask --app app run --port 5000
+    MONGO_DB=petla_bench JWT_SECRET=bench uvicorn app.main:app --port 8000   # desde backend/
+    MONGO_URI=mongodb://localhost:27017 JWT_SECRET=bench python -m benchmarks.bench_read_tier \\
+        --db petla_bench --flask http://localhost:5000 --fastapi http://localhost:8000
+"""
+import argparse
+import http.client
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from urllib.parse import quote, urlsplit
+
+from bson import ObjectId
+from pymongo import MongoClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.indexes import ensure_indexes  # noqa: E402
+from app.search import search_tokens  # noqa: E402
+from app.utils.jwt import create_tokens  # noqa: E402
+
+NOMBRES = ['José', 'María', 'Ángel', 'Lucía', 'Raúl', 'Inés', 'Martín', 'Sofía', 'Andrés', 'Begoña']
+APELLIDOS = ['Gómez', 'Núñez', 'Pérez', 'Muñoz', 'Sánchez', 'Martínez', 'López', 'Díaz', 'Ruiz', 'Zúñiga']
+ESTADOS = ['pendiente_pago', 'en_validacion', 'aceptada', 'atendida', 'cancelada']
+
+
+def seed(db, clientes, rng):
+    """Usuarios, mascotas, citas, historial y notificaciones con la forma que escribe la API Flask"""
+    for name in ('users', 'pets', 'appointments', 'historial_clinico', 'notificaciones', 'contadores'):
+        db[name].drop()
+    now = datetime.utcnow()
+    vets = [ObjectId() for _ in range(20)]
+    users = [{"_id": v, "nombre": rng.choice(NOMBRES), "apellidos": rng.choice(APELLIDOS),
+              "email": f"vet{i}@petla.pe", "rol": "veterinario", "fechaRegistro": now} for i, v in enumerate(vets)]
+    pets, citas, historial, notificaciones = [], [], [], []
+    for i in range(clientes):
+        cliente = {"_id": ObjectId(), "nombre": rng.choice(NOMBRES),
+                   "apellidos": f"{rng.choice(APELLIDOS)} {rng.choice(APELLIDOS)}",
+                   "email": f"cliente{i}@correo.pe", "rol": "cliente", "fechaRegistro": now}
+        users.append(cliente)
+        for j in range(2):
+            mascota = {"_id": ObjectId(), "nombre": f"Mascota {i}-{j}", "especie": rng.choice(['perro', 'gato']),
+                       "raza": "mestizo", "sexo": "macho", "clienteId": str(cliente['_id']),
+                       "fechaNacimiento": now - timedelta(days=rng.randint(100, 4000)),
+                       "version": 1, "fechaActualizacion": now}
+            pets.append(mascota)
+            for k in range(3):
+                vet = rng.choice(vets)
+                fecha = now + timedelta(days=rng.randint(-180, 60), hours=rng.randint(8, 17))
+                citas.append({"mascota": mascota['nombre'], "mascotaId": str(mascota['_id']),
+                              "clienteId": str(cliente['_id']), "veterinarioId": str(vet), "veterinario": "Dr. X",
+                              "fecha": fecha, "estado": rng.choice(ESTADOS), "motivo": "control",
+                              "tipoConsulta": "consulta_general", "precio": 80, "version": 1,
+                              "fechaActualizacion": now})
+                historial.append({"mascotaId": str(mascota['_id']), "fecha": fecha - timedelta(days=200),
+                                  "veterinario": "Dr. X", "veterinarioId": str(vet), "tipoConsulta": "control",
+                                  "motivo": "control", "diagnostico": "sano", "tratamiento": "ninguno",
+                                  "peso": round(rng.uniform(2, 40), 1), "version": 1, "fechaActualizacion": now})
+        notificaciones.append({"usuarioId": str(cliente['_id']), "tipo": "cita", "titulo": "Recordatorio",
+                               "mensaje": "Tiene una cita", "leida": rng.random() < 0.5, "fechaCreacion": now})
+    for doc in users:
+        doc['searchTokens'] = search_tokens(doc)
+    for name, docs in (('users', users), ('pets', pets), ('appointments', citas),
+                       ('historial_clinico', historial), ('notificaciones', notificaciones)):
+        for start in range(0, len(docs), 5000):
+            db[name].insert_many(docs[start:start + 5000], ordered=False)
+    ensure_indexes(db)
+    return users, pets, vets
+
+
+def workload(users, pets, vets, rng, n):
+    """Mezcla de GET de las pantallas del panel y del cliente"""
+    clientes = [u for u in users if u['rol'] == 'cliente']
+    paths = []
+    for _ in range(n):
+        cliente = str(rng.choice(clientes)['_id'])
+        mascota = str(rng.choice(pets)['_id'])
+        vet = str(rng.choice(vets))
+        paths.append(rng.choice([
+            f"/api/citas?veterinarioId={vet}&fechaDesde=2024-01-01&limit=50&view=summary",
+            f"/api/citas?clienteId={cliente}&view=summary",
+            f"/api/mascotas?clienteId={cliente}&view=summary",
+            f"/api/mascotas/{mascota}",
+            f"/api/historial/mascota/{mascota}?view=summary",
+            f"/api/notificaciones?usuarioId={cliente}&leida=false",
+            f"/api/users?search={quote(rng.choice(APELLIDOS)[:3])}&view=summary",
+            "/api/users?rol=veterinario&view=summary",
+        ]))
+    return paths
+
+
+def run(base_url, paths, concurrency, token):
+    """Repartir `paths` entre `concurrency` hilos con una conexión keep-alive cada uno"""
+    url = urlsplit(base_url)
+    headers = {"Authorization": f"Bearer {token}", "Accept": "application/json"}
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker(chunk):
+        conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+        local, failed = [], 0
+        for path in chunk:
+            start = time.perf_counter()
+            try:
+                conn.request("GET", path, headers=headers)
+                response = conn.getresponse()
+                response.read()
+                if response.status != 200:
+                    failed += 1
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                conn.close()
+                conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+            local.append((time.perf_counter() - start) * 1000)
+        conn.close()
+        with lock:
+            latencies.extend(local)
+            errors.append(failed)
+
+    threads = [threading.Thread(target=worker, args=(paths[i::concurrency],)) for i in range(concurrency)]
+    start = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    pick = lambda q: latencies[min(len(latencies) - 1, int(len(latencies) * q))]  # noqa: E731
+    return {"rps": len(paths) / elapsed, "p50": statistics.median(latencies), "p95": pick(0.95),
+            "p99": pick(0.99), "errores": sum(errors)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--db', default='petla_bench')
+    parser.add_argument('--clientes', type=int, default=20_000)
+    parser.add_argument('--requests', type=int, default=20_000)
+    parser.add_argument('--concurrency', default='1,16,64', help="Niveles de concurrencia separados por comas")
+    parser.add_argument('--flask', default='http://localhost:5000')
+    parser.add_argument('--fastapi', default='http://localhost:8000')
+    parser.add_argument('--no-seed', action='store_true', help="Reutilizar los datos de una ejecución anterior")
+    args = parser.parse_args()
+
+    client = MongoClient(os.getenv('MONGO_URI', 'mongodb://localhost:27017'))
+    db = client[args.db]
+    rng = random.Random(42)
+    start = time.perf_counter()
+    if args.no_seed:
+        users = list(db.users.find({}, {"rol": 1}))
+        pets = list(db.pets.find({}, {"_id": 1}))
+        vets = [u['_id'] for u in users if u['rol'] == 'veterinario']
+    else:
+        users, pets, vets = seed(db, args.clientes, rng)
+        print(f"{len(users)} usuarios, {len(pets)} mascotas cargados en {time.perf_counter() - start:.1f} s")
+
+    token = create_tokens(str(vets[0]), 'admin')['access_token']
+    paths = workload(users, pets, vets, rng, args.requests)
+    services = {'flask': args.flask, 'fastapi': args.fastapi}
+    for name, base_url in services.items():
+        # Calentar pools de conexiones y cachés antes de medir
+        run(base_url, paths[:500], 8, token)
+
+    print(f"{'concurrencia':>12} {'servicio':>9} {'req/s':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'errores':>8}")
+    for concurrency in (int(c) for c in args.concurrency.split(',')):
+        for name, base_url in services.items():
+            r = run(base_url, paths, concurrency, token)
+            print(f"{concurrency:>12} {name:>9} {r['rps']:9.0f} {r['p50']:7.2f}ms {r['p95']:7.2f}ms "
+                  f"{r['p99']:7.2f}ms {r['errores']:>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+"""Benchmark: rendimiento del servidor de producción (gunicorn.conf.py) por modo de worker.
+
+Abre --sse conexiones SSE de notificaciones que se quedan abiertas, como los
+navegadores con el panel abierto. Luego lanza la mezcla de GET de
+bench_read_tier con varios niveles de concurrencia y mide req/s, latencias y
+errores. Con workers sync cada SSE ocupa un hilo; con gevent, un greenlet.
+Hay que arrancar el servidor en cada modo contra una base de datos cargada con
+bench_read_tier (--no-seed reutiliza los datos):
+
+    MONGO_DB=petla_bench JWT_SECRET=bench SERVER_WORKER_CLASS=gevent gunicorn -c gunicorn.conf.py app.wsgi:app
+    MONGO_URI=mongodb://localhost:27017 JWT_SECRET=bench python -m benchmarks.bench_server --db petla_bench --sse 200
+"""
+import argparse
+import http.client
+import os
+import random
+import sys
+import time
+from urllib.parse import urlsplit
+
+from pymongo import MongoClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.bench_read_tier import run, seed, workload  # noqa: E402
+from app.utils.jwt import create_tokens  # noqa: E402
+
+
+def open_streams(base_url, n, tokens):
+    """Conexiones SSE abiertas (ya recibido el primer evento); las que no se abren cuentan como fallo"""
+    url = urlsplit(base_url)
+    streams, failed = [], 0
+    for i in range(n):
+        conn = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=5)
+        try:
+            conn.request("GET", f"/api/notificaciones/stream?access_token={tokens[i % len(tokens)]}")
+            response = conn.getresponse()
+            if response.status != 200:
+                raise http.client.HTTPException(response.status)
+            response.fp.readline()
+            streams.append(conn)
+        except (OSError, http.client.HTTPException):
+            failed += 1
+            conn.close()
+    return streams, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default='http://localhost:5000')
+    parser.add_argument('--db', default='petla_bench')
+    parser.add_argument('--clientes', type=int, default=20_000)
+    parser.add_argument('--requests', type=int, default=10_000)
+    parser.add_argument('--concurrency', default='1,16,64', help="Niveles de concurrencia separados por comas")
+    parser.add_argument('--sse', type=int, default=0, help="Conexiones SSE abiertas durante la medida")
+    parser.add_argument('--no-seed', action='store_true', help="Reutilizar los datos de una ejecución anterior")
+    args = parser.parse_args()
+
+    db = MongoClient(os.getenv('MONGO_URI', 'mongodb://localhost:27017'))[args.db]
+    rng = random.Random(42)
+    if args.no_seed:
+        users = list(db.users.find({}, {"rol": 1}))
+        pets = list(db.pets.find({}, {"_id": 1}))
+        vets = [u['_id'] for u in users if u['rol'] == 'veterinario']
+    else:
+        users, pets, vets = seed(db, args.clientes, rng)
+
+    token = create_tokens(str(vets[0]), 'admin')['access_token']
+    paths = workload(users, pets, vets, rng, args.requests)
+    clientes = [str(u['_id']) for u in users if u['rol'] == 'cliente'][:max(args.sse, 1)]
+    streams, failed = open_streams(args.url, args.sse, [create_tokens(c, 'cliente')['access_token']
+                                                        for c in clientes])
+    print(f"SSE abiertas: {len(streams)}, rechazadas o sin respuesta: {failed}")
+    run(args.url, paths[:500], 8, token)
+
+    print(f"{'concurrencia':>12} {'req/s':>9} {'p50':>9} {'p95':>9} {'p99':>9} {'errores':>8}")
+    try:
+        for concurrency in (int(c) for c in args.concurrency.split(',')):
+            start = time.perf_counter()
+            r = run(args.url, paths, concurrency, token)
+            print(f"{concurrency:>12} {r['rps']:9.0f} {r['p50']:7.2f}ms {r['p95']:7.2f}ms {r['p99']:7.2f}ms "
+                  f"{r['errores']:>8}  ({time.perf_counter() - start:.0f} s)")
+    finally:
+        for conn in streams:
+            conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Benchmark: búsqueda de usuarios con $regex (anterior) vs. prefijos indexados (app/search.py).
+
+Carga N usuarios sintéticos en una base de datos aparte (se borra al empezar)
+y mide la latencia de las búsquedas típicas del panel, tecla a tecla. Necesita
+un MongoDB real: mongomock no usa índices.
+
+    MONGO_URI=mongodb://localhost:27017 python -m benchmarks.bench_user_search [--users 100000]
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import time
+
+from pymongo import ASCENDING, MongoClient
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.search import query_terms, search_tokens, search_users  # noqa: E402
+
+NOMBRES = ['José', 'María', 'Ángel', 'Lucía', 'Raúl', 'Inés', 'Martín', 'Sofía', 'Andrés', 'Begoña',
+           'Jesús', 'Noemí', 'Rubén', 'Verónica', 'Óscar', 'Mónica', 'Iván', 'Nuria', 'Adrián', 'Elena']
+APELLIDOS = ['Gómez', 'Núñez', 'Pérez', 'Muñoz', 'Sánchez', 'Martínez', 'Fernández', 'López', 'Díaz',
+             'Hernández', 'García', 'Rodríguez', 'Álvarez', 'Jiménez', 'Ruiz', 'Ibáñez', 'Cáceres',
+             'Ordóñez', 'Quiñones', 'Zúñiga']
+# Lo que escribe un admin en el buscador, letra a letra
+SEARCHES = ['g', 'go', 'gom', 'gome', 'gomez', 'nunez', 'maria', 'maria mun', 'jose perez',
+            'ang', 'zuniga', 'lucia ib', 'user12345', 'oscar']
+
+
+def make_users(n, rng):
+    for i in range(n):
+        nombre = rng.choice(NOMBRES)
+        apellidos = f"{rng.choice(APELLIDOS)} {rng.choice(APELLIDOS)}"
+        doc = {
+            "nombre": nombre,
+            "apellidos": apellidos,
+            "email": f"user{i}@correo.pe",
+            "rol": rng.choice(['cliente'] * 8 + ['veterinario', 'admin']),
+        }
+        doc['searchTokens'] = search_tokens(doc)
+        yield doc
+
+
+def regex_query(search):
+    """La consulta de users.list_users antes de app/search.py"""
+    return {"eliminadoEn": {"$exists": False}, "$or": [
+        {"nombre": {"$regex": search, "$options": "i"}},
+        {"email": {"$regex": search, "$options": "i"}},
+        {"apellidos": {"$regex": search, "$options": "i"}},
+    ]}
+
+
+def timed(fn, rounds):
+    samples = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        result = fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    samples.sort()
+    return statistics.median(samples), samples[int(len(samples) * 0.95) - 1], result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--rounds', type=int, default=20)
+    parser.add_argument('--db', default='petla_bench_search')
+    args = parser.parse_args()
+
+    client = MongoClient(os.getenv('MONGO_URI', 'mongodb://localhost:27017'))
+    db = client[args.db]
+    db.users.drop()
+    rng = random.Random(42)
+    batch = []
+    start = time.perf_counter()
+    for doc in make_users(args.users, rng):
+        batch.append(doc)
+        if len(batch) == 5000:
+            db.users.insert_many(batch, ordered=False)
+            batch.clear()
+    if batch:
+        db.users.insert_many(batch, ordered=False)
+    db.users.create_index([('searchTokens', ASCENDING), ('rol', ASCENDING)])
+    print(f"{args.users} usuarios cargados en {time.perf_counter() - start:.1f} s")
+
+    live = {"eliminadoEn": {"$exists": False}}
+    print(f"{'búsqueda':<12} {'regex p50':>10} {'p95':>8} {'índice p50':>11} {'p95':>8} "
+          f"{'leídos regex':>13} {'leídos índice':>14} {'hallados regex':>15} {'hallados índice':>16}")
+    for search in SEARCHES:
+        # Como paginaba list_users: orden por _id, 200 por página
+        legacy = lambda: list(db.users.find(regex_query(search)).sort('_id', 1).limit(200))  # noqa: E731
+        r50, r95, _ = timed(legacy, args.rounds)
+        i50, i95, _ = timed(lambda: search_users(db, search, live, None, 20), args.rounds)
+        indexed = {**live, "searchTokens": {"$all": query_terms(search)}}
+        regex_plan = db.users.find(regex_query(search)).sort('_id', 1).limit(200).explain()['executionStats']
+        index_plan = db.users.find(indexed).explain()['executionStats']
+        print(f"{search:<12} {r50:8.2f}ms {r95:6.2f}ms {i50:9.2f}ms {i95:6.2f}ms "
+              f"{regex_plan['totalDocsExamined']:>13} {index_plan['totalDocsExamined']:>14} "
+              f"{db.users.count_documents(regex_query(search)):>15} {db.users.count_documents(indexed):>16}")
+
+    client.drop_database(args.db)
+
+
+if __name__ == "__main__":
+    main()
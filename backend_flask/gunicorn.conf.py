@@ -0,0 +1,96 @@
+"""Servidor de producción: gunicorn con workers pre-forkeados, configurado por variables de entorno.
+
+    gunicorn -c gunicorn.conf.py app.wsgi:app
+
+SERVER_WORKER_CLASS elige el modo:
+- sync: procesos con SERVER_THREADS hilos cada uno (con más de un hilo
+  gunicorn usa su worker gthread). Para CPU (bcrypt, JSON) y pocas conexiones
+  largas.
+- gevent: un proceso por CPU con hasta SERVER_WORKER_CONNECTIONS greenlets.
+  Para muchas conexiones en espera: SSE de notificaciones y clientes lentos.
+
+La app se carga una vez en el maestro (SERVER_PRELOAD) y cada worker crea su
+propio cliente de Mongo tras el fork. Los workers se reciclan tras
+SERVER_MAX_REQUESTS peticiones (± jitter). `kill -HUP <maestro>` los sustituye
+de forma ordenada; con preload el código no se relee, para desplegar código
+nuevo: `kill -USR2 <maestro>` y, cuando el nuevo maestro responde,
+`kill -QUIT <maestro viejo>`.
+"""
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+
+worker_class = os.getenv("SERVER_WORKER_CLASS", "sync")
+if worker_class not in ("sync", "gevent"):
+    raise RuntimeError(f"SERVER_WORKER_CLASS must be sync or gevent, not {worker_class!r}")
+
+if worker_class == "gevent":
+    # Antes de cargar la app (preload): pymongo, threading y ssl tienen que
+    # importarse ya parcheados
+    from gevent import monkey
+    monkey.patch_all()
+
+# Métricas de Prometheus de todos los workers (app/metrics.py): cada proceso
+# escribe las suyas aquí; se vacía al arrancar el maestro (on_starting)
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/petla-metrics")
+os.makedirs(os.environ["PROMETHEUS_MULTIPROC_DIR"], exist_ok=True)
+
+_cpus = multiprocessing.cpu_count()
+
+bind = os.getenv("SERVER_BIND", f"0.0.0.0:{os.getenv('FLASK_RUN_PORT', 5000)}")
+# gevent: al menos 2, para que al reciclar uno (que espera a sus SSE hasta
+# graceful_timeout) el otro siga aceptando conexiones
+workers = int(os.getenv("SERVER_WORKERS", max(2, _cpus) if worker_class == "gevent" else 2 * _cpus + 1))
+# sync: hilos por worker. Cada conexión SSE ocupa uno durante SSE_MAX_SECONDS
+threads = int(os.getenv("SERVER_THREADS", 4)) if worker_class == "sync" else 1
+# gevent: conexiones simultáneas por worker
+worker_connections = int(os.getenv("SERVER_WORKER_CONNECTIONS", 1000))
+
+preload_app = os.getenv("SERVER_PRELOAD", "true").lower() == "true"
+max_requests = int(os.getenv("SERVER_MAX_REQUESTS", 5000))
+max_requests_jitter = int(os.getenv("SERVER_MAX_REQUESTS_JITTER", 500))
+# Segundos sin latido antes de matar un worker colgado, y de margen para
+# terminar las peticiones en curso al reciclar o parar
+timeout = int(os.getenv("SERVER_TIMEOUT", 60))
+graceful_timeout = int(os.getenv("SERVER_GRACEFUL_TIMEOUT", 30))
+keepalive = int(os.getenv("SERVER_KEEPALIVE", 5))
+backlog = int(os.getenv("SERVER_BACKLOG", 2048))
+
+loglevel = os.getenv("SERVER_LOG_LEVEL", "info")
+accesslog = os.getenv("SERVER_ACCESS_LOG", "-") or None
+errorlog = "-"
+# Cabeceras X-Forwarded-* de nginx
+forwarded_allow_ips = os.getenv("SERVER_FORWARDED_ALLOW_IPS", "127.0.0.1")
+
+
+def _close_streams_on_stop(worker):
+    """Al reciclar o parar, el worker espera a sus peticiones en curso; las SSE
+    durarían hasta SSE_MAX_SECONDS y lo retendrían graceful_timeout segundos"""
+    from app.events import bus
+    while worker.alive:
+        time.sleep(1)
+    bus.close_all()
+
+
+def post_fork(server, worker):
+    """Cliente de Mongo propio del worker: los sockets y los hilos de monitorización
+    de pymongo no sobreviven a fork()"""
+    from app.db import reset_client
+    reset_client(server.app.wsgi())
+    threading.Thread(target=_close_streams_on_stop, args=(worker,), name='sse-drain', daemon=True).start()
+
+
+def child_exit(server, worker):
+    """Los gauges del worker muerto dejan de sumar en /metrics"""
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
+
+
+def on_starting(server):
+    metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+    server.log.info("worker_class=%s workers=%s threads=%s worker_connections=%s preload=%s",
+                    worker_class, workers, threads, worker_connections, preload_app)
@@ -0,0 +1,176 @@
+"""Envío de newsletters (app/mailer.py) contra un servidor SMTP local de aiosmtpd"""
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+
+import mongomock
+import pytest
+from aiosmtpd.controller import Controller
+
+from app import create_app, mailer
+from app.db import get_db
+
+BATCH_SIZE = 3
+CONNECTIONS = 2
+
+
+class Recorder:
+    """Servidor SMTP de prueba: guarda cada mensaje y rechaza los destinatarios indicados"""
+
+    def __init__(self):
+        self.received = []  # (destinatario, conexión, instante)
+        self.reject = {}  # destinatario -> respuesta SMTP
+        self._lock = threading.Lock()
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        if address in self.reject:
+            return self.reject[address]
+        envelope.rcpt_tos.append(address)
+        return '250 OK'
+
+    async def handle_DATA(self, server, session, envelope):
+        with self._lock:
+            for rcpt in envelope.rcpt_tos:
+                self.received.append((rcpt, session.peer, time.monotonic()))
+        return '250 OK'
+
+    def recipients(self):
+        return [r for r, _, _ in self.received]
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+@pytest.fixture
+def smtp():
+    handler = Recorder()
+    handler.port = _free_port()
+    controller = Controller(handler, hostname='127.0.0.1', port=handler.port)
+    controller.start()
+    yield handler
+    controller.stop()
+
+
+@pytest.fixture
+def app(smtp, monkeypatch):
+    monkeypatch.setattr(mailer, 'RETRY_BACKOFF_SECONDS', 0)
+    app = create_app()
+    app.config.update(
+        TESTING=True,
+        SMTP_HOST='127.0.0.1', SMTP_PORT=smtp.port, SMTP_USER=None, SMTP_STARTTLS=False, SMTP_TIMEOUT=5,
+        NEWSLETTER_BATCH_SIZE=BATCH_SIZE, NEWSLETTER_SMTP_CONNECTIONS=CONNECTIONS,
+        NEWSLETTER_RATE_PER_SEC=0, NEWSLETTER_MAX_ATTEMPTS=2, NEWSLETTER_LEASE_SECONDS=300,
+    )
+    app.extensions['mongo'] = {"client": mongomock.MongoClient(), "pid": os.getpid()}
+    with app.app_context():
+        yield app
+
+
+def _campaign(db, n):
+    db.newsletter_suscriptores.insert_many([{"email": f"u{i}@petla.test", "activo": True} for i in range(n)])
+    db.newsletter_suscriptores.insert_one({"email": "baja@petla.test", "activo": False})
+    return db.newsletter_emails.insert_one({
+        "asunto": "Novedades", "contenido": "<p>Hola</p>", "estado": "en_cola",
+    }).inserted_id
+
+
+def _entregas(db, email_id):
+    return {e['email']: e for e in db.newsletter_entregas.find({"emailId": email_id})}
+
+
+def test_batches_and_per_recipient_status(app, smtp, monkeypatch):
+    db = get_db()
+    email_id = _campaign(db, 7)
+    smtp.reject = {"u1@petla.test": '550 no such user', "u2@petla.test": '451 try later'}
+
+    in_flight = peak = 0
+    deliver_one = mailer._deliver_one
+
+    async def counting(*args):
+        nonlocal in_flight, peak
+        in_flight += 1
+        peak = max(peak, in_flight)
+        try:
+            return await deliver_one(*args)
+        finally:
+            in_flight -= 1
+
+    monkeypatch.setattr(mailer, '_deliver_one', counting)
+    assert mailer.run_campaign(email_id)
+
+    # Como mucho un lote en vuelo
+    assert peak == BATCH_SIZE
+
+    entregas = _entregas(db, email_id)
+    assert set(entregas) == {f"u{i}@petla.test" for i in range(7)}
+    assert entregas["u1@petla.test"]['estado'] == 'fallido'
+    assert entregas["u1@petla.test"]['intentos'] == 1
+    # Error temporal: se reintenta hasta NEWSLETTER_MAX_ATTEMPTS
+    assert entregas["u2@petla.test"]['estado'] == 'fallido'
+    assert entregas["u2@petla.test"]['intentos'] == 2
+    sent = {email for email, e in entregas.items() if e['estado'] == 'enviado'}
+    assert sent == {f"u{i}@petla.test" for i in (0, 3, 4, 5, 6)}
+    assert sorted(smtp.recipients()) == sorted(sent)
+
+    campaign = db.newsletter_emails.find_one({"_id": email_id})
+    assert campaign['estado'] == 'enviado'
+    assert (campaign['totalDestinatarios'], campaign['totalEnviados'], campaign['totalFallidos']) == (7, 5, 2)
+    assert 'leaseHasta' not in campaign
+
+
+def test_rate_limit(app, smtp):
+    app.config['NEWSLETTER_RATE_PER_SEC'] = 20
+    email_id = _campaign(get_db(), 6)
+    assert mailer.run_campaign(email_id)
+
+    times = sorted(t for _, _, t in smtp.received)
+    assert len(times) == 6
+    # 6 envíos a 20/s: al menos 5 intervalos de 50 ms entre el primero y el último
+    assert times[-1] - times[0] >= 5 / 20 * 0.9
+    # Sin errores, las conexiones del pool se reutilizan entre lotes
+    assert len({peer for _, peer, _ in smtp.received}) <= CONNECTIONS
+
+
+def test_resume_after_crash(app, smtp, monkeypatch):
+    db = get_db()
+    email_id = _campaign(db, 7)
+    build_message = mailer.build_message
+
+    def crash_on_second_batch(campaign, to, cfg):
+        if to == "u3@petla.test":
+            raise RuntimeError("worker killed")
+        return build_message(campaign, to, cfg)
+
+    monkeypatch.setattr(mailer, 'build_message', crash_on_second_batch)
+    with pytest.raises(RuntimeError):
+        mailer.run_campaign(email_id)
+
+    # El primer lote quedó registrado y el envío sigue tomado por el proceso caído
+    entregas = _entregas(db, email_id)
+    assert {e for e, d in entregas.items() if d['estado'] == 'enviado'} == {f"u{i}@petla.test" for i in range(3)}
+    campaign = db.newsletter_emails.find_one({"_id": email_id})
+    assert campaign['estado'] == 'enviando'
+    assert campaign['leaseHasta'] > datetime.utcnow()
+    assert not mailer.run_campaign(email_id)
+
+    # Caduca el lease: se retoma sin reenviar lo ya registrado
+    monkeypatch.setattr(mailer, 'build_message', build_message)
+    db.newsletter_emails.update_one({"_id": email_id},
+                                    {"$set": {"leaseHasta": datetime.utcnow() - timedelta(seconds=1)}})
+    assert mailer.run_campaign(email_id)
+
+    entregas = _entregas(db, email_id)
+    assert all(e['estado'] == 'enviado' for e in entregas.values())
+    received = smtp.recipients()
+    for i in range(3):
+        assert received.count(f"u{i}@petla.test") == 1
+    assert set(received) == set(entregas)
+    campaign = db.newsletter_emails.find_one({"_id": email_id})
+    assert campaign['estado'] == 'enviado'
+    assert campaign['totalEnviados'] == 7
+    assert 'leaseHasta' not in campaign
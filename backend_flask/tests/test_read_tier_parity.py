@@ -0,0 +1,164 @@
+"""El servicio de lectura (backend/app/query.py) copia los helpers de consulta de
+Flask: mismas proyecciones, filtros y cursores para las mismas query strings"""
+import importlib.util
+import sys
+from datetime import datetime
+from pathlib import Path
+from urllib.parse import urlencode
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException as ReadTierError
+from starlette.requests import Request
+from werkzeug.exceptions import HTTPException
+
+from app import create_app, dates, search
+from app.deletion import NOT_DELETED
+from app.utils import pagination, projection
+
+READ_TIER = Path(__file__).resolve().parents[2] / 'backend' / 'app' / 'query.py'
+
+
+def _load_read_tier():
+    spec = importlib.util.spec_from_file_location('read_tier_query', READ_TIER)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[spec.name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+query = _load_read_tier()
+
+COLLECTIONS = sorted({*projection.HEAVY_FIELDS, *projection.HIDDEN_FIELDS, *projection.VIEWS,
+                      'notificaciones', 'newsletter_entregas'})
+PROJECTION_ARGS = [
+    {}, {'view': 'full'}, {'view': 'summary'}, {'view': 'nope'},
+    {'fields': 'nombre,fotoMiniaturas.thumb'}, {'fields': 'password,id,_id'}, {'fields': ' estado , '},
+    {'fields': 'nombre,$where'}, {'fields': 'a..b'}, {'fields': 'estado', 'view': 'summary'},
+    {'fields': 'foto,foto.x'}, {'fields': 'fotoMiniaturas.thumb,nombre,fotoMiniaturas'}, {'fields': 'a.b,a.c,ab'},
+]
+
+
+class FakeCollection:
+    """Guarda el find() y el sort() que arma paged_find"""
+
+    def find(self, query, projection=None):
+        self.query, self.projection = query, projection
+        return self
+
+    def sort(self, sort):
+        self.sort_spec = list(sort)
+        return self
+
+    def limit(self, limit):
+        self.limit_value = limit
+        return self
+
+
+@pytest.fixture(scope='module')
+def app():
+    return create_app()
+
+
+def _flask(app, args, fn, *fn_args):
+    """(resultado, None) o (None, (código, error)) de un helper de Flask con `args` en la query string"""
+    with app.test_request_context('/?' + urlencode(args)):
+        try:
+            return fn(*fn_args), None
+        except HTTPException as e:
+            response = e.get_response()
+            return None, (response.status_code, response.get_json()['error'])
+
+
+def _read_tier(args, fn, *fn_args):
+    request = Request({'type': 'http', 'query_string': urlencode(args).encode(), 'headers': []})
+    try:
+        return fn(request, *fn_args), None
+    except ReadTierError as e:
+        return None, (e.status_code, e.detail)
+
+
+def _read_tier_paged_find(request, collection, *args):
+    return query.paged_find(collection, request, *args)
+
+
+def test_tables_match():
+    assert query.HEAVY_FIELDS == projection.HEAVY_FIELDS
+    assert query.HIDDEN_FIELDS == projection.HIDDEN_FIELDS
+    assert query.VIEWS == projection.VIEWS
+    assert query._FIELD_RE.pattern == projection._FIELD_RE.pattern
+    assert query.NOT_DELETED == NOT_DELETED
+    assert query.SEARCH_FIELDS == search.SEARCH_FIELDS
+    assert (query.PREFIX_MAX, query.SEARCH_CANDIDATES) == (search.PREFIX_MAX, search.SEARCH_CANDIDATES)
+
+
+@pytest.mark.parametrize('collection', COLLECTIONS)
+@pytest.mark.parametrize('args', PROJECTION_ARGS, ids=urlencode)
+def test_projections_match(app, collection, args):
+    assert _read_tier(args, query.list_projection, collection) == \
+        _flask(app, args, projection.list_projection, collection)
+    assert _read_tier(args, query.doc_projection, collection) == \
+        _flask(app, args, projection.doc_projection, collection)
+
+
+SORTS = [(), [('fecha', 1)], [('fechaCreacion', -1)]]
+KEYS = [
+    [ObjectId('64b000000000000000000001')],
+    [datetime(2026, 3, 1, 15, 30), ObjectId('64b000000000000000000002')],
+    [None, ObjectId('64b000000000000000000003')],
+]
+
+
+@pytest.mark.parametrize('sort', SORTS, ids=str)
+@pytest.mark.parametrize('proj', [None, {'foto': 0}, {'estado': 1}, {'fecha.x': 1, 'estado': 1}], ids=str)
+def test_cursors_match(app, sort, proj):
+    fields = [f for f, _ in sort] + ['_id']
+    for key in KEYS:
+        values = ([None] * len(fields) + key)[-len(fields):]
+        token = pagination.encode_cursor(fields, values)
+        assert query.encode_cursor(fields, values) == token
+        assert query.decode_cursor(token, fields) == pagination.decode_cursor(token, fields)
+
+        flask_find, read_find = FakeCollection(), FakeCollection()
+        args = {'cursor': token}
+        flask_out = _flask(app, args, pagination.paged_find, flask_find, {'estado': 'x'}, sort, 11, proj)
+        read_out = _read_tier(args, _read_tier_paged_find, read_find, {'estado': 'x'}, sort, 11, proj)
+        assert read_out[0][1] == flask_out[0][1]
+        assert (read_find.query, read_find.projection, read_find.sort_spec, read_find.limit_value) == \
+            (flask_find.query, flask_find.projection, flask_find.sort_spec, flask_find.limit_value)
+
+    for bad in ('zzz', pagination.encode_cursor(['otro', '_id'], [1, 2])):
+        assert _read_tier({'cursor': bad}, _read_tier_paged_find, FakeCollection(), {}, sort) == \
+            _flask(app, {'cursor': bad}, pagination.paged_find, FakeCollection(), {}, sort)
+
+
+@pytest.mark.parametrize('args', [{}, {'limit': '5'}, {'limit': '0'}, {'limit': '99999'}, {'limit': 'x'}],
+                         ids=urlencode)
+def test_page_limit_matches(app, args):
+    assert _read_tier(args, query.page_limit, 100, 1000) == _flask(app, args, pagination.page_limit, 100, 1000)
+
+
+@pytest.mark.parametrize('desde,hasta', [
+    (None, None), ('2026-03-01', None), ('2026-03-01', '2026-03-31'), ('2026-03-01T08:00:00', None),
+    ('2026-03-01T08:00:00Z', '2026-03-01T12:00:00-05:00'), (None, '2026-03-31T23:59'),
+    ('nope', None), (None, '2026-13-01'), (None, 'nope-later'),
+])
+def test_date_ranges_match(app, desde, hasta):
+    with app.app_context():
+        try:
+            expected = dates.range_filter(desde, hasta), None
+        except ValueError as e:
+            expected = None, (400, str(e))
+    try:
+        got = query.range_filter(desde, hasta), None
+    except ReadTierError as e:
+        got = None, (e.status_code, e.detail)
+    assert got == expected
+
+
+@pytest.mark.parametrize('text', ['José Núñez', 'MARÍA  de-la O', 'ángel_99 x', '', None, 'Ñandú Ütz ÇA'])
+def test_search_terms_match(text):
+    assert query.fold(text) == search.fold(text)
+    assert query.words(text) == search.words(text)
+    if text is not None:
+        assert query.query_terms(text) == search.query_terms(text)